@@ -0,0 +1,74 @@
+# 標準ライブラリ
+import io
+from typing import Iterable
+
+# サードパーティ
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+
+# アップロードを読み出す単位
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageRejected(Exception):
+    """アップロードされた画像を受け付けられない（status_code はHTTPのステータス）"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    """アップロードを少しずつ読み出し、上限を超えた時点で打ち切る"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise ImageRejected(f"ファイルサイズが上限（{max_bytes // (1024 * 1024)}MB）を超えています", 413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def decode_image(
+    data: bytes, max_pixels: int, max_edge: int, allowed_formats: Iterable[str]
+) -> Image.Image:
+    """
+    画像のヘッダーで形式とサイズを確認してから、縮小しながらデコードする
+
+    Image.open はヘッダーしか読まないので、巨大な画像（展開爆弾を含む）は
+    画素データを展開する前に断る。JPEGは draft() でDCTの段階で縮小してデコードするため、
+    高解像度の写真でもフルサイズの画素バッファを確保しない。
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(f"画像が大きすぎます: {str(e)}", 413)
+    except Exception as e:
+        raise ImageRejected(f"画像を読み込めません: {str(e)}", 400)
+
+    # 拡張子の表記（jpg）をPillowの形式名（JPEG）にそろえる
+    allowed = {"JPEG" if f.upper() == "JPG" else f.upper() for f in allowed_formats}
+    if image.format not in allowed:
+        raise ImageRejected(f"対応していない画像形式です: {image.format}", 415)
+
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageRejected(f"画像の画素数が大きすぎます: {width}x{height}", 413)
+
+    # JPEGはデコード時に1/2・1/4・1/8に縮小できる（max_edge 以上の大きさは保たれる）
+    image.draft("RGB", (max_edge, max_edge))
+    try:
+        image.load()
+    except Exception as e:
+        raise ImageRejected(f"画像をデコードできません: {str(e)}", 400)
+
+    # スマートフォンの写真の向き（EXIF）を反映し、残りの縮小を行う
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    return image.convert("RGB")
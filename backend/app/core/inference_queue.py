@@ -0,0 +1,117 @@
+# 標準ライブラリ
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+# ローカルモジュール
+from app.core.metrics import record_span
+
+T = TypeVar("T")
+
+
+class QueueFullError(Exception):
+    """待ち行列が上限に達していて、新しいジョブを受け付けられない"""
+
+
+class InferenceQueue:
+    """
+    推論を専用のスレッドプールで実行する、上限付きの待ち行列
+
+    イベントループから await run(fn) で投入すると、推論中も他のリクエストを処理できる。
+    実行中と待機中のジョブの合計が max_pending に達している場合は QueueFullError を送出する。
+    """
+
+    def __init__(self, workers: int = 1, max_pending: int = 8, history: int = 1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # 直近のジョブの待ち時間と実行時間（秒）
+        self._wait_times = deque(maxlen=history)
+        self._run_times = deque(maxlen=history)
+
+    @property
+    def depth(self) -> int:
+        """待機中と実行中のジョブの合計"""
+        return self._waiting + self._running
+
+    async def run(self, fn: Callable[[], T], requests: int = 1) -> T:
+        """
+        fn をワーカースレッドで実行し、結果を返す
+
+        fn は呼び出し元のコンテキストのコピーで実行するため、fn の中のスパンは呼び出し元の
+        スパンに記録される。待ち行列で待った時間は段階 queue_wait として記録する。
+        requests は fn がまとめて処理するリクエストの数（断った場合に rejected に加える）。
+        """
+        with self._lock:
+            if self.depth >= self.max_pending:
+                self.rejected += requests
+                raise QueueFullError(f"推論の待ち行列が上限（{self.max_pending}件）に達しています")
+            self._waiting += 1
+
+        enqueued = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                self._waiting -= 1
+                self._running += 1
+                self._wait_times.append(started - enqueued)
+            record_span("queue_wait", started - enqueued)
+            try:
+                return fn()
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._run_times.append(time.perf_counter() - started)
+
+        # run_in_executor はコンテキスト変数を引き継がないため、コピーしたコンテキストで実行する
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, context.run, job)
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        return result
+
+    def stats(self) -> Dict:
+        """待ち行列の長さと待ち時間・実行時間の統計を返す"""
+
+        def summary(values):
+            if not values:
+                return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            ordered = sorted(values)
+            return {
+                "count": len(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "waiting": self._waiting,
+                "running": self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds": summary(self._wait_times),
+                "run_seconds": summary(self._run_times),
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,106 @@
+# 標準ライブラリ
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+_COLUMNS = (
+    "id",
+    "kind",
+    "status",
+    "step",
+    "total_steps",
+    "error",
+    "created_at",
+    "updated_at",
+    "expires_at",
+)
+_SELECT_JOB = f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?"  # nosec B608
+
+
+class JobStore:
+    """
+    生成ジョブのメタデータを保存するSQLiteのストア
+
+    ジョブの状態は queued → running → done / failed と変わる。
+    推論のワーカースレッドからも更新するため、1つの接続をロックで保護して使う。
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    step INTEGER NOT NULL DEFAULT 0,
+                    total_steps INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+
+    def create(self, kind: str, total_steps: int = 0) -> str:
+        """新しいジョブを登録し、そのIDを返す"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs"
+                " (id, kind, status, total_steps, created_at, updated_at, expires_at)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, total_steps, now, now, now + self.ttl_seconds),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields) -> None:
+        """ジョブの状態を更新する（status, step, total_steps, error）"""
+        unknown = set(fields) - {"status", "step", "total_steps", "error"}
+        if unknown:
+            raise ValueError(f"更新できない項目です: {', '.join(sorted(unknown))}")
+
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            # 列名は上で許可したものだけなので、SQLインジェクションの余地はない
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",  # nosec B608
+                (*fields.values(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """ジョブの状態を返す（存在しなければ None）"""
+        with self._lock:
+            row = self._conn.execute(_SELECT_JOB, (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(zip(_COLUMNS, row))
+        job["progress"] = job["step"] / job["total_steps"] if job["total_steps"] else 0.0
+        if job["status"] == "done":
+            job["progress"] = 1.0
+        return job
+
+    def pop_expired(self, now: Optional[float] = None) -> List[str]:
+        """有効期限が切れたジョブを削除し、そのIDを返す"""
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            ids = [
+                row[0]
+                for row in self._conn.execute("SELECT id FROM jobs WHERE expires_at <= ?", (now,))
+            ]
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+        return ids
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
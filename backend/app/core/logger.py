@@ -1,33 +1,52 @@
+import atexit
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # ログディレクトリの作成
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
+# ロガー名ごとの、ファイルとコンソールへの書き出しを行うリスナー
+_listeners = {}
+
 
 # ロガーの設定
 def setup_logger(name: str) -> logging.Logger:
+    """
+    ロガーを設定して返す
+
+    リクエストを処理するスレッドはログをキューに入れるだけで、ファイルとコンソールへの
+    書き出しは QueueListener のスレッドで行う（ディスクの書き込みを待たない）。
+    同じ名前で何度呼んでもハンドラーは1組だけ登録する。
+    """
     logger = logging.getLogger(name)
+    if name in _listeners:
+        return logger
     logger.setLevel(logging.INFO)
 
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
     # ファイルハンドラーの設定
     file_handler = RotatingFileHandler(
         os.path.join(LOG_DIR, f"{name}.log"), maxBytes=10 * 1024 * 1024, backupCount=5  # 10MB
     )
     file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    file_handler.setFormatter(file_formatter)
+    file_handler.setFormatter(formatter)
 
     # コンソールハンドラーの設定
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    console_handler.setFormatter(console_formatter)
+    console_handler.setFormatter(formatter)
+
+    # ハンドラーはリスナーのスレッドで実行し、ロガーにはキューへのハンドラーだけを追加する
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    _listeners[name] = listener
 
-    # ハンドラーの追加
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(QueueHandler(log_queue))
 
     return logger
@@ -0,0 +1,243 @@
+# 標準ライブラリ
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Prometheus のテキスト形式（/metrics）で公開する計測値と、処理段階ごとの所要時間（スパン）
+
+# レイテンシのヒストグラムの既定のバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# main の "app" ロガーの子（ハンドラーは setup_logger で設定したものを使う）
+logger = logging.getLogger("app.metrics")
+
+# (メトリクス名, ラベル, 値) の列
+Samples = Iterable[Tuple[str, Dict[str, str], float]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {', '.join(self.labelnames)} です")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Samples:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調に増える回数"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Samples:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}_total", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """値の分布（バケットごとの累積件数・合計・件数）"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとの [各バケットの件数..., +Inf の件数], 合計
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        # value 以上の最初のバケットに数える（出力時に累積する）
+        index = next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def samples(self) -> Samples:
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Gauge(_Metric):
+    """読み出すたびに関数で求める現在の値（待ち行列の長さ・メモリ使用量など）"""
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+        labelnames: Tuple[str, ...] = (),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def samples(self) -> Samples:
+        for labels, value in self._collect():
+            yield self.name, labels, value
+
+
+class CollectedCounter(Gauge):
+    """読み出すたびに関数で求める累計（他のオブジェクトが数えている回数を counter として出す）"""
+
+    type_name = "counter"
+
+    def samples(self) -> Samples:
+        for labels, value in self._collect():
+            yield f"{self.name}_total", labels, value
+
+
+class MetricsRegistry:
+    """メトリクスをまとめて Prometheus のテキスト形式で出力する"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def collected_counter(
+        self, name: str, documentation: str, collect, labelnames=()
+    ) -> CollectedCounter:
+        return self.register(CollectedCounter(name, documentation, collect, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def gauge(self, name: str, documentation: str, collect, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, collect, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # 1つの値が取得できなくても、他のメトリクスは出力する
+                logger.warning(f"メトリクスを取得できないため省略します: {metric.name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+# アプリ全体で共有するレジストリと、処理段階ごとの所要時間
+registry = MetricsRegistry()
+STAGE_SECONDS = registry.histogram("design_stage_seconds", "処理段階ごとの所要時間（秒）", labelnames=("stage",))
+
+# 処理中のリクエストの段階ごとの所要時間（スパン）。start_trace() で開始する
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("trace", default=None)
+
+
+def start_trace() -> Dict[str, float]:
+    """
+    このリクエスト（現在のコンテキスト）のスパンの記録を開始し、記録先の辞書を返す
+
+    スパンは同じコンテキストから作られたタスクや run_in_threadpool のスレッドでも記録される。
+    """
+    trace: Dict[str, float] = {}
+    _trace.set(trace)
+    return trace
+
+
+def current_trace() -> Dict[str, float]:
+    """記録中のスパン（段階名 → 秒、記録していなければ空の辞書）"""
+    trace = _trace.get()
+    return trace if trace is not None else {}
+
+
+def record_span(stage: str, seconds: float) -> None:
+    """計測済みの時間を段階 stage のヒストグラムと、記録中のスパンに加える"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str):
+    """with の中の処理時間を段階 stage のヒストグラムと、記録中のスパンに加える"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_spans():
+    """
+    with の中で記録したスパンを、記録中のスパンとは別の辞書に集める
+
+    複数のリクエストをまとめたバッチの推論のように、1回の処理の所要時間をそれぞれの
+    リクエストのスパンに加える（merge_spans）場合に使う。with を抜けると元の記録先に戻る。
+    """
+    spans: Dict[str, float] = {}
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+
+def merge_spans(trace: Dict[str, float], spans: Dict[str, float]) -> None:
+    """collect_spans で集めたスパンを trace に加える（ヒストグラムには記録済み）"""
+    for stage, seconds in spans.items():
+        trace[stage] = trace.get(stage, 0.0) + seconds
@@ -0,0 +1,71 @@
+# 標準ライブラリ
+import logging
+import threading
+import time
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+# main の "app" ロガーの子（ハンドラーは setup_logger で設定したものを使う）
+logger = logging.getLogger("app.model_loader")
+
+
+class ModelLoader(Generic[T]):
+    """
+    重いモデルを一度だけ読み込むための遅延ローダー（スレッドセーフ）
+
+    初回の get() で読み込むか、start_background() で別スレッドから先に読み込んでおく。
+    読み込みに失敗した場合は次の get() で再試行する。
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance: Optional[T] = None
+        self.state = "not_loaded"  # not_loaded / loading / ready / failed
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        """モデルを返す（未読み込みなら読み込みが終わるまで待つ）"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._load()
+        return self._instance
+
+    def _load(self) -> None:
+        self.state = "loading"
+        self.error = None
+        start = time.perf_counter()
+        try:
+            instance = self._factory()
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            raise
+        self.load_seconds = time.perf_counter() - start
+        self._instance = instance
+        self.state = "ready"
+
+    def start_background(self) -> threading.Thread:
+        """別スレッドで読み込みを開始する（失敗しても例外は呼び出し元に伝えない）"""
+
+        def warm_up():
+            try:
+                self.get()
+            except Exception as e:
+                # 状態は state / error からも確認できる
+                logger.warning(f"モデルの読み込みに失敗しました: {str(e)}")
+
+        thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict:
+        """読み込み状態を返す"""
+        return {"state": self.state, "error": self.error, "load_seconds": self.load_seconds}
@@ -0,0 +1,227 @@
+# 標準ライブラリ
+import argparse
+import glob
+import os
+import resource
+import sys
+from typing import Dict, Optional
+
+# 1台のマシンで複数の uvicorn ワーカーを動かすための、ワーカー数の自動調整とメモリの計測。
+# モデルの重みを safetensors のメモリマップで読み込むと（MMAP_WEIGHTS）、重みのページは
+# ワーカー間で共有されるため、ワーカーを増やしても増えるのは推論中の作業用メモリだけになる。
+
+# ワーカー1つあたりの、重み以外のメモリ（Python・torch本体と512pxでの推論中の作業用メモリ）
+WORKER_OVERHEAD_BYTES = int(os.getenv("WORKER_MEMORY_MB", "1536")) * 1024 * 1024
+
+# ワーカーごとの推論スレッド数の既定値
+THREADS_PER_WORKER = int(os.getenv("THREADS_PER_WORKER", "2"))
+
+# 空きメモリのうち、ワーカーに割り当ててよい割合
+MEMORY_HEADROOM = 0.8
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    プロセスのメモリ使用量（バイト）を /proc/<pid>/smaps_rollup から求める
+
+    smaps_rollup がない環境（macOS・古いLinuxカーネル）では、このプロセスについてのみ
+    resource.getrusage の最大RSSを rss として返す（他のプロセスについては空の辞書）。
+
+    Returns:
+    --------
+    Dict[str, int]
+        rss: 常駐メモリ, uss: そのプロセスだけが使っているメモリ（共有していないページ）,
+        pss: 共有ページをプロセス数で割って足したメモリ, shared: 他のプロセスと共有しているページ
+    """
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    try:
+        f = open(path)
+    except OSError:
+        if pid is not None and pid != os.getpid():
+            return {}
+        # ru_maxrss の単位は Linux では KB、macOS ではバイト
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss": max_rss if sys.platform == "darwin" else max_rss * 1024}
+
+    fields = {}
+    with f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+    return None if value == "max" else int(value)
+
+
+def available_memory() -> int:
+    """
+    新しく使えるメモリ（バイト）
+
+    /proc/meminfo の MemAvailable と、コンテナ（cgroup v2）のメモリ上限の残りの小さい方。
+    """
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if available is None:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+    limit = _read_int("/sys/fs/cgroup/memory.max")
+    if limit is not None:
+        available = min(available, limit - (_read_int("/sys/fs/cgroup/memory.current") or 0))
+    return max(available, 0)
+
+
+def available_cores() -> int:
+    """このプロセスが使えるCPUコア数（CPUアフィニティとコンテナのCPU上限を考慮する）"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def model_weight_bytes(model_id: str) -> int:
+    """
+    モデルの重みのファイルの合計バイト数（ローカルのディレクトリか、ダウンロード済みのモデル）
+
+    コンポーネントごとに safetensors があればそれを、なければ .bin を数える（fp16 などの別版は除く）。
+    見つからない場合は 0 を返す。
+    """
+    if not os.path.isdir(model_id):
+        try:
+            from huggingface_hub import snapshot_download
+
+            # ダウンロード済みのキャッシュを探すだけで、ダウンロードはしない
+            model_id = snapshot_download(model_id, local_files_only=True)  # nosec B615
+        except Exception:
+            return 0
+
+    total = 0
+    for directory in glob.glob(os.path.join(model_id, "*", "")):
+        for extension in ("safetensors", "bin"):
+            files = [
+                path
+                for path in glob.glob(os.path.join(directory, f"*.{extension}"))
+                if os.path.basename(path).count(".") == 1
+            ]
+            if files:
+                total += sum(os.path.getsize(path) for path in files)
+                break
+    return total
+
+
+def recommend_workers(
+    weight_bytes: int,
+    shared_weights: bool = True,
+    threads_per_worker: int = THREADS_PER_WORKER,
+    worker_overhead_bytes: int = WORKER_OVERHEAD_BYTES,
+    memory_bytes: Optional[int] = None,
+    cores: Optional[int] = None,
+) -> Dict:
+    """
+    CPUコア数と空きメモリから、起動するワーカー数を決める
+
+    コアは threads_per_worker ずつ割り当てる。メモリは、重みを共有する場合は重みを1回だけ、
+    共有しない場合はワーカーごとに数える。
+
+    Parameters:
+    -----------
+    weight_bytes : int
+        モデルの重みのバイト数
+    shared_weights : bool, default=True
+        重みをメモリマップでワーカー間で共有するかどうか
+    threads_per_worker : int
+        ワーカーごとの推論スレッド数
+    worker_overhead_bytes : int
+        ワーカーごとの重み以外のメモリ
+    memory_bytes, cores : int, optional
+        使えるメモリとコア数（省略時はこのマシンの値）
+
+    Returns:
+    --------
+    Dict
+        workers（ワーカー数）, threads_per_worker と、決めるときに使った値
+    """
+    memory_bytes = available_memory() if memory_bytes is None else memory_bytes
+    cores = available_cores() if cores is None else cores
+    threads_per_worker = max(1, min(threads_per_worker, cores))
+
+    by_cores = max(1, cores // threads_per_worker)
+    budget = memory_bytes * MEMORY_HEADROOM
+    if shared_weights:
+        by_memory = int((budget - weight_bytes) // worker_overhead_bytes)
+    else:
+        by_memory = int(budget // (worker_overhead_bytes + weight_bytes))
+    workers = max(1, min(by_cores, by_memory))
+
+    return {
+        "workers": workers,
+        "threads_per_worker": threads_per_worker,
+        "limited_by": "cores" if by_cores <= by_memory else "memory",
+        "cores": cores,
+        "memory_bytes": memory_bytes,
+        "weight_bytes": weight_bytes,
+        "shared_weights": shared_weights,
+    }
+
+
+def main() -> None:
+    """ワーカー数を自動で決めて uvicorn を起動するコマンド"""
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="複数のワーカーで API サーバーを起動する")
+    parser.add_argument("--host", default="0.0.0.0")  # nosec B104
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", default="auto", help="ワーカー数（auto で自動調整）")
+    parser.add_argument("--threads-per-worker", type=int, default=THREADS_PER_WORKER)
+    parser.add_argument("--no-mmap", action="store_true", help="重みをメモリマップで共有せず、ワーカーごとに読み込む")
+    args = parser.parse_args()
+
+    shared = not args.no_mmap
+    model_id = os.getenv("MODEL_ID", "runwayml/stable-diffusion-v1-5")
+    plan = recommend_workers(model_weight_bytes(model_id), shared, args.threads_per_worker)
+    if args.workers != "auto":
+        plan["workers"] = int(args.workers)
+    print(
+        f"ワーカー数: {plan['workers']}（スレッド数 {plan['threads_per_worker']}/ワーカー, "
+        f"コア数 {plan['cores']}, 空きメモリ {plan['memory_bytes'] / 2**30:.1f}GB, "
+        f"重み {plan['weight_bytes'] / 2**30:.1f}GB{'（共有）' if shared else ''}）"
+    )
+
+    # ワーカーのプロセスは環境変数を引き継ぐ（main が TORCH_THREADS からスレッド数を設定する）
+    os.environ["MMAP_WEIGHTS"] = "true" if shared else "false"
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "TORCH_THREADS"):
+        os.environ[name] = str(plan["threads_per_worker"])
+    # 拡散のステップは順に実行するため、独立した演算を同時に実行する inter-op のスレッドは1つで足りる
+    os.environ.setdefault("TORCH_INTEROP_THREADS", "1")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=plan["workers"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# 標準ライブラリ
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+# サードパーティ
+from PIL import Image
+
+# ローカルモジュール
+from app.generator.pixel_generator import convert_image, encode_design_data
+
+# 一括変換の対象とする拡張子
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
+
+# ワーカープロセス数（未指定時はCPUコア数）
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "0")) or os.cpu_count() or 1
+
+# 1件分の入力: (名前, ファイルパスまたは画像のバイト列)
+BatchItem = Tuple[str, Union[str, bytes]]
+
+
+def create_executor(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """一括変換用のプロセスプールを作成する"""
+    # torchのスレッドを持つ親プロセスをforkしないよう spawn で起動する
+    return ProcessPoolExecutor(
+        max_workers=max_workers or BATCH_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def iter_directory(directory: str) -> Iterator[BatchItem]:
+    """ディレクトリ内の画像ファイルを (名前, パス) として順に返す"""
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            yield filename, os.path.join(directory, filename)
+
+
+def convert_item(
+    name: str, source: Union[str, bytes], output_dir: Optional[str] = None, **options
+) -> Dict:
+    """1件の画像をデザインデータに変換する（ワーカープロセスで実行）"""
+    output_path = None
+    if output_dir:
+        output_path = os.path.join(output_dir, f"{os.path.splitext(name)[0]}.png")
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    with Image.open(source) as img:
+        design_data = convert_image(img, output_path, **options)
+
+    return encode_design_data(design_data)
+
+
+def iter_batch(
+    items: Iterable[BatchItem],
+    executor: Optional[Executor] = None,
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    output_dir: Optional[str] = None,
+    **options,
+) -> Iterator[Dict]:
+    """
+    複数の画像をプロセスプールで並列に変換し、完了した順に結果を返す
+
+    Parameters:
+    -----------
+    items : Iterable[BatchItem]
+        (名前, ファイルパスまたはバイト列) の列。必要な分だけ順に読み出される
+    executor : Executor, optional
+        使用するプール（省略時は新規に作成し、終了時に閉じる）
+    max_workers : int, optional
+        プールのワーカー数（省略時は BATCH_WORKERS）
+    max_in_flight : int, optional
+        同時に投入しておく件数の上限（省略時はワーカー数の2倍）。メモリ使用量の上限になる
+    output_dir : str, optional
+        指定した場合、各ワーカーが量子化後のPNGをこのディレクトリに保存する
+    **options
+        convert_image に渡す変換オプション（size, palette_size, style, method, compact, dither, color_space）
+
+    Returns:
+    --------
+    Iterator[Dict]
+        成功時は {"name", "design_data"}、失敗時は {"name", "error"}。
+        1件の失敗でバッチ全体は止まらない
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = create_executor(max_workers)
+
+    if max_in_flight is None:
+        max_in_flight = 2 * (max_workers or BATCH_WORKERS)
+
+    item_iter = iter(items)
+    pending = {}
+
+    def submit_next() -> bool:
+        try:
+            name, source = next(item_iter)
+        except StopIteration:
+            return False
+        future = executor.submit(convert_item, name, source, output_dir, **options)
+        pending[future] = name
+        return True
+
+    try:
+        while len(pending) < max_in_flight and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    yield {"name": name, "design_data": future.result()}
+                except Exception as e:
+                    yield {"name": name, "error": str(e)}
+                # 1件完了するごとに次の1件を投入する
+                submit_next()
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def main() -> None:
+    """ディレクトリ内の画像を一括でマイデザインに変換するコマンド"""
+    parser = argparse.ArgumentParser(description="画像を一括でマイデザインに変換する")
+    parser.add_argument("input_dir", help="変換する画像のディレクトリ")
+    parser.add_argument("output_dir", help="PNGとデザインデータ（JSON Lines）の出力先")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--palette-size", type=int, default=15)
+    parser.add_argument("--method", default="kmeans")
+    parser.add_argument("--compact", action="store_true")
+    parser.add_argument("--dither", default="none")
+    parser.add_argument("--color-space", default="rgb")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    count = errors = 0
+
+    with create_executor(args.workers) as executor, open(
+        os.path.join(args.output_dir, "designs.jsonl"), "w", encoding="utf-8"
+    ) as out:
+        results = iter_batch(
+            iter_directory(args.input_dir),
+            executor=executor,
+            max_workers=args.workers,
+            output_dir=args.output_dir,
+            size=args.size,
+            palette_size=args.palette_size,
+            method=args.method,
+            compact=args.compact,
+            dither=args.dither,
+            color_space=args.color_space,
+        )
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            count += 1
+            if "error" in result:
+                errors += 1
+                print(f"Error converting {result['name']}: {result['error']}")
+
+    elapsed = time.perf_counter() - start
+    print(f"{count}件を変換（失敗 {errors}件）: {elapsed:.1f}秒, {count / elapsed:.1f}枚/秒")
+
+
+if __name__ == "__main__":
+    main()
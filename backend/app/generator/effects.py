@@ -0,0 +1,229 @@
+# 標準ライブラリ
+from functools import lru_cache
+from typing import Callable, Dict, Tuple
+
+# サードパーティ
+import numpy as np
+
+# ピクセルアート用の色変換・最近傍色の参照表（LUT）・ディザリング
+# 画素ごとのPythonループは使わず、すべてNumPyの配列演算で処理する。
+
+# LUT の1チャンネルあたりのビット数（2^5 = 32 段階、32^3 = 32768 セル）
+LUT_BITS = 5
+
+# sRGB（D65）→ XYZ の変換行列と白色点
+_RGB_TO_XYZ = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]
+)
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """0〜255 の sRGB 値（(..., 3)）を CIE L*a*b* に変換する"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack(
+        [116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])],
+        axis=-1,
+    )
+
+
+def lab_to_srgb(lab: np.ndarray) -> np.ndarray:
+    """CIE L*a*b*（(..., 3)）を 0〜255 の sRGB 値（float、範囲外は切り詰め）に変換する"""
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    xyz = np.where(f > 6 / 29, f**3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * _WHITE
+    linear = np.clip(xyz @ _XYZ_TO_RGB.T, 0, 1)
+    c = np.where(linear > 0.0031308, 1.055 * linear ** (1 / 2.4) - 0.055, 12.92 * linear)
+    return np.clip(c * 255, 0, 255)
+
+
+# 色の距離を測る色空間（入力は 0〜255 の sRGB 値）
+COLOR_SPACES: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "rgb": lambda rgb: np.asarray(rgb, dtype=np.float64),
+    "lab": srgb_to_lab,
+}
+
+
+def nearest_colors(colors: np.ndarray, palette: np.ndarray, color_space: str = "rgb") -> np.ndarray:
+    """colors の各色に最も近い palette の番号を返す（LUT を使わない厳密な計算）"""
+    to_space = COLOR_SPACES[color_space]
+    a, b = to_space(colors), to_space(palette)
+    dist = np.einsum("ij,ij->i", b, b) - 2 * (a @ b.T)
+    return np.argmin(dist, axis=1)
+
+
+def parse_hex_colors(colors) -> np.ndarray:
+    """ "#RRGGBB" 形式の色の一覧を (色数, 3) の int 配列にする（不正な形式は ValueError）"""
+    palette = []
+    for color in colors:
+        value = color.lstrip("#")
+        if len(value) != 6:
+            raise ValueError(f"色は #RRGGBB 形式で指定してください: {color}")
+        palette.append([int(value[i : i + 2], 16) for i in (0, 2, 4)])
+    return np.array(palette, dtype=int).reshape(-1, 3)
+
+
+@lru_cache(maxsize=32)
+def _cached_lut(palette_bytes: bytes, color_space: str, bits: int) -> np.ndarray:
+    palette = np.frombuffer(palette_bytes, dtype=np.int64).reshape(-1, 3)
+    # 各セルの中心の色について、最も近いパレット番号を求める
+    step = 1 << (8 - bits)
+    axis = np.arange(1 << bits) * step + (step - 1) / 2
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing="ij"), axis=-1).reshape(-1, 3)
+    lut = nearest_colors(grid, palette, color_space).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def build_lut(palette: np.ndarray, color_space: str = "rgb", bits: int = LUT_BITS) -> np.ndarray:
+    """
+    パレットの最近傍色の参照表（平坦化した (2^bits)^3 の uint8 配列）を作る
+
+    同じパレットの参照表は使い回す（固定パレットでは最初の1回だけ計算する）。
+    """
+    if len(palette) > 256:
+        raise ValueError("参照表で扱えるパレットは256色までです")
+    palette = np.ascontiguousarray(palette, dtype=np.int64)
+    return _cached_lut(palette.tobytes(), color_space, bits)
+
+
+def lookup(lut: np.ndarray, rgb: np.ndarray) -> np.ndarray:
+    """参照表で (..., 3) の色を最も近いパレット番号に変換する（画素数に比例する計算量）"""
+    bits = (len(lut).bit_length() - 1) // 3
+    q = np.clip(rgb, 0, 255).astype(np.intp) >> (8 - bits)
+    return lut[(q[..., 0] << (2 * bits)) | (q[..., 1] << bits) | q[..., 2]]
+
+
+def _no_dither(rgb: np.ndarray, opaque: np.ndarray, palette: np.ndarray, lut: np.ndarray):
+    return lookup(lut, rgb)
+
+
+def bayer_matrix(size: int) -> np.ndarray:
+    """size x size（2のべき乗）のベイヤー行列を -0.5〜0.5 のしきい値にして返す"""
+    matrix = np.zeros((1, 1))
+    while len(matrix) < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size - 0.5
+
+
+def _color_spacing(palette: np.ndarray) -> float:
+    """パレットの色どうしの間隔（各色から最も近い別の色までの距離の中央値）"""
+    if len(palette) < 2:
+        return 0.0
+    diff = palette[:, None, :].astype(np.float64) - palette[None, :, :]
+    dist = np.sqrt(np.einsum("ijk,ijk->ij", diff, diff))
+    np.fill_diagonal(dist, np.inf)
+    return float(np.median(dist.min(axis=1)))
+
+
+def _ordered_dither(size: int):
+    def dither(rgb: np.ndarray, opaque: np.ndarray, palette: np.ndarray, lut: np.ndarray):
+        # しきい値の模様をパレットの色の間隔の幅で加えてから最も近い色を引く
+        height, width = rgb.shape[:2]
+        reps = (-(-height // size), -(-width // size))
+        threshold = np.tile(bayer_matrix(size), reps)[:height, :width]
+        return lookup(lut, rgb + threshold[..., None] * _color_spacing(palette))
+
+    return dither
+
+
+@lru_cache(maxsize=16)
+def _wavefronts(height: int, width: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """誤差拡散で同時に処理できる画素（t = 2y + x が等しい画素）の組を返す"""
+    ys, xs = np.divmod(np.arange(height * width), width)
+    t = 2 * ys + xs
+    order = np.argsort(t, kind="stable")
+    return ys[order], xs[order], np.cumsum(np.bincount(t))
+
+
+def _floyd_steinberg(rgb: np.ndarray, opaque: np.ndarray, palette: np.ndarray, lut: np.ndarray):
+    """
+    Floyd–Steinberg 法の誤差拡散
+
+    画素 (y, x) は左 (y, x-1) と上の行の3画素 (y-1, x-1〜x+1) から誤差を受け取る。
+    これらはすべて t = 2y + x が小さい画素なので、t が等しい斜めの列（波面）ごとに
+    まとめて処理すれば、ラスター順に1画素ずつ処理した場合と同じ結果になる。
+    ループは画素数ではなく波面の数（2 * 高さ + 幅）だけ回る。
+    """
+    height, width = rgb.shape[:2]
+    # 右端・左端・下端の外に誤差を捨てるための余白を付ける
+    work = np.zeros((height + 1, width + 2, 3), dtype=np.float32)
+    work[:height, 1 : width + 1] = rgb
+    colors = palette.astype(np.float32)
+    labels = np.empty((height, width), dtype=np.intp)
+
+    ys, xs, bounds = _wavefronts(height, width)
+    start = 0
+    for end in bounds:
+        y, x = ys[start:end], xs[start:end]
+        start = end
+        value = np.clip(work[y, x + 1], 0, 255)
+        index = lookup(lut, value)
+        labels[y, x] = index
+        # 透明な画素は誤差を周りに広げない
+        error = (value - colors[index]) * opaque[y, x, None]
+        # 同じ波面の画素の拡散先は文ごとに重ならないので、+= で正しく加算される
+        work[y, x + 2] += error * (7 / 16)
+        work[y + 1, x] += error * (3 / 16)
+        work[y + 1, x + 1] += error * (5 / 16)
+        work[y + 1, x + 2] += error * (1 / 16)
+    return labels
+
+
+# ディザリングの手法（いずれも (高さ, 幅) のパレット番号を返す）
+DITHERS: Dict[str, Callable] = {
+    "none": _no_dither,
+    "floyd_steinberg": _floyd_steinberg,
+    # 組織的ディザリング（ordered は 4x4 のベイヤー行列と同じ）
+    "ordered": _ordered_dither(4),
+    "bayer2": _ordered_dither(2),
+    "bayer4": _ordered_dither(4),
+    "bayer8": _ordered_dither(8),
+}
+
+
+def dither_to_palette(
+    rgb: np.ndarray,
+    opaque: np.ndarray,
+    palette: np.ndarray,
+    dither: str = "none",
+    color_space: str = "rgb",
+) -> np.ndarray:
+    """
+    (高さ, 幅, 3) の画像の各画素をパレットの色に割り当てる
+
+    Parameters:
+    -----------
+    rgb : np.ndarray
+        (高さ, 幅, 3) の 0〜255 の色
+    opaque : np.ndarray
+        (高さ, 幅) の bool 配列（False の画素は誤差拡散の対象外）
+    palette : np.ndarray
+        (色数, 3) のパレット
+    dither : str, default="none"
+        ディザリングの手法（DITHERS のキー）
+    color_space : str, default="rgb"
+        最も近い色を決める色空間（"rgb", "lab"）
+
+    Returns:
+    --------
+    np.ndarray
+        (高さ, 幅) のパレット番号
+    """
+    if dither not in DITHERS:
+        raise ValueError(f"未対応のディザリングです: {dither}（{', '.join(DITHERS)} のいずれか）")
+    if color_space not in COLOR_SPACES:
+        raise ValueError(f"未対応の色空間です: {color_space}（{', '.join(COLOR_SPACES)} のいずれか）")
+
+    palette = np.asarray(palette)
+    lut = build_lut(palette, color_space)
+    return DITHERS[dither](np.asarray(rgb, dtype=np.float32), opaque, palette, lut)
@@ -0,0 +1,251 @@
+# 標準ライブラリ
+import argparse
+import io
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# サードパーティ
+import numpy as np
+from PIL import Image, ImageOps
+
+# ローカルモジュール
+from app.generator.batch import BATCH_WORKERS, create_executor
+from app.generator.pixel_generator import build_design_data, design_to_png, encode_design_data
+from app.generator.quantizer import ALPHA_THRESHOLD, map_to_palette, quantize_array
+
+# 複数のデザインを並べて1枚の絵にする「壁画」モード。
+# 画像全体で1つのパレットを求め、タイル（既定は 32x32 のデザイン）ごとに割り当てる。
+
+# パレットの計算に使うピクセル数の上限（画像全体から無作為に選ぶ）
+PALETTE_SAMPLE_SIZE = 16384
+
+# 並列処理するタイルの画素数の合計の下限（これより小さい壁画はプロセスを起動しない）
+PARALLEL_MIN_PIXELS = 1 << 20
+
+# ワーカーごとに同時に投入しておくタイルの行の数
+BANDS_PER_WORKER = 2
+
+
+def load_mural_image(
+    source: Union[str, bytes, Image.Image], width: int, height: int
+) -> Image.Image:
+    """
+    画像を読み込み、壁画全体の大きさ（width x height）に切り抜いて縮小する
+
+    JPEGはデコード時に縮小し、その他の形式も整数倍の縮小（reduce）を先に行ってから
+    LANCZOS で仕上げるため、元画像が非常に大きくても作業用のバッファは小さく済む。
+    縦横比が異なる場合は中央を切り抜く。
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+
+    image.draft(image.mode, (width, height))
+    scale = int(min(image.width / width, image.height / height))
+    if scale >= 2:
+        image = image.reduce(scale)
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+
+def fit_shared_palette(
+    img_array: np.ndarray,
+    palette_size: int,
+    method: str = "kmeans",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
+    sample_size: int = PALETTE_SAMPLE_SIZE,
+    seed: int = 0,
+) -> np.ndarray:
+    """壁画全体から無作為に選んだ不透明なピクセルで、すべてのタイルに共通のパレットを求める"""
+    pixels = img_array.reshape(-1, img_array.shape[2])
+    if pixels.shape[1] == 4:
+        candidates = np.flatnonzero(pixels[:, 3] > ALPHA_THRESHOLD)
+    else:
+        candidates = np.arange(len(pixels))
+    if len(candidates) > sample_size:
+        rng = np.random.default_rng(seed)
+        candidates = np.sort(rng.choice(candidates, sample_size, replace=False))
+
+    sample = pixels[candidates].reshape(-1, 1, pixels.shape[1])
+    _, palette, _ = quantize_array(sample, palette_size, method, color_space, target_palette)
+    return palette
+
+
+def _quantize_band(
+    band: np.ndarray,
+    palette: np.ndarray,
+    tile_size: int,
+    dither: str,
+    color_space: str,
+    compact: bool,
+) -> List[Dict]:
+    """
+    1行分のタイルを共通のパレットに割り当て、タイルごとのデザインデータを返す（ワーカーで実行）
+
+    誤差拡散は行全体で1枚の画像として行うため、同じ行のタイルの境目に継ぎ目が出ない。
+    """
+    _, labels = map_to_palette(band, palette, dither, color_space)
+    labels = labels.reshape(band.shape[0], -1)
+    return [
+        build_design_data(
+            palette, labels[:, x : x + tile_size].reshape(-1), tile_size, tile_size, compact
+        )
+        for x in range(0, labels.shape[1], tile_size)
+    ]
+
+
+def iter_mural_tiles(
+    img_array: np.ndarray,
+    palette: np.ndarray,
+    tile_size: int = 32,
+    dither: str = "none",
+    color_space: str = "rgb",
+    compact: bool = True,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, int, Dict]]:
+    """
+    壁画の画像をタイルに分け、(行, 列, デザインデータ) を左上から順に返す
+
+    壁画が大きい場合はタイルの行ごとにプロセスプールで並列に処理する。
+    同時に投入する行の数を制限するため、ワーカーに渡している画素は壁画の大きさによらない。
+    """
+    rows = img_array.shape[0] // tile_size
+    bands = (img_array[r * tile_size : (r + 1) * tile_size] for r in range(rows))
+    options = (palette, tile_size, dither, color_space, compact)
+
+    if img_array.shape[0] * img_array.shape[1] < PARALLEL_MIN_PIXELS or workers == 1:
+        for row, band in enumerate(bands):
+            for column, design_data in enumerate(_quantize_band(band, *options)):
+                yield row, column, design_data
+        return
+
+    workers = workers or BATCH_WORKERS
+    with create_executor(workers) as executor:
+        max_in_flight = workers * BANDS_PER_WORKER
+        pending = deque()
+        for row, band in enumerate(bands):
+            pending.append((row, executor.submit(_quantize_band, band, *options)))
+            while len(pending) >= max_in_flight or (pending and row == rows - 1):
+                done_row, future = pending.popleft()
+                for column, design_data in enumerate(future.result()):
+                    yield done_row, column, design_data
+
+
+def convert_mural(
+    source: Union[str, bytes, Image.Image],
+    columns: int,
+    rows: int,
+    tile_size: int = 32,
+    palette_size: int = 15,
+    method: str = "kmeans",
+    dither: str = "none",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
+    compact: bool = True,
+    output_dir: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Dict:
+    """
+    大きな画像を columns x rows 枚のデザインに分けて変換する
+
+    パレットは画像全体のサンプルから1回だけ求め、すべてのタイルで共有する。
+
+    Parameters:
+    -----------
+    source : str, bytes or Image.Image
+        入力画像（パス、バイト列、読み込み済みの画像）
+    columns, rows : int
+        横・縦に並べるデザインの枚数
+    tile_size : int, default=32
+        1枚のデザインの大きさ（ピクセル単位、正方形）
+    palette_size : int, default=15
+        共有するパレットの色数
+    method, dither, color_space, target_palette
+        generate_pixel_art と同じ（dither は行ごとに誤差拡散する）
+    compact : bool, default=True
+        True の場合、各タイルのピクセルを uint8 のインデックス列で返す
+    output_dir : str, optional
+        指定した場合、タイルごとのPNG（compact のとき）とデザインデータ、索引（index.json）を保存する
+    workers : int, optional
+        並列処理のワーカー数（省略時は BATCH_WORKERS、1 の場合は並列化しない）
+
+    Returns:
+    --------
+    Dict
+        壁画の索引（columns, rows, tile_size, palette）と、タイルの一覧
+        （tiles: 行・列・名前・デザインデータ）
+    """
+    image = load_mural_image(source, columns * tile_size, rows * tile_size)
+    img_array = np.array(image)
+    palette = fit_shared_palette(img_array, palette_size, method, color_space, target_palette)
+
+    mural = {
+        "columns": columns,
+        "rows": rows,
+        "tile_size": tile_size,
+        "palette": [{"r": int(c[0]), "g": int(c[1]), "b": int(c[2])} for c in palette],
+        "tiles": [],
+    }
+    tiles = iter_mural_tiles(img_array, palette, tile_size, dither, color_space, compact, workers)
+    for row, column, design_data in tiles:
+        name = f"tile_r{row:02d}_c{column:02d}"
+        if output_dir:
+            if compact:
+                with open(os.path.join(output_dir, f"{name}.png"), "wb") as f:
+                    f.write(design_to_png(design_data))
+            with open(os.path.join(output_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+                json.dump(encode_design_data(design_data), f)
+        mural["tiles"].append(
+            {"name": name, "row": row, "column": column, "design_data": design_data}
+        )
+
+    if output_dir:
+        # 索引にはデザインデータを含めず、タイルの位置と名前だけを書く
+        entries = [{k: v for k, v in t.items() if k != "design_data"} for t in mural["tiles"]]
+        index = dict(mural, tiles=entries)
+        with open(os.path.join(output_dir, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+
+    return mural
+
+
+def main() -> None:
+    """大きな画像を複数のマイデザインに分けて変換するコマンド"""
+    parser = argparse.ArgumentParser(description="大きな画像を複数のマイデザイン（壁画）に変換する")
+    parser.add_argument("input", help="変換する画像")
+    parser.add_argument("output_dir", help="タイルのPNG・デザインデータと index.json の出力先")
+    parser.add_argument("--columns", type=int, required=True)
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--tile-size", type=int, default=32)
+    parser.add_argument("--palette-size", type=int, default=15)
+    parser.add_argument("--method", default="kmeans")
+    parser.add_argument("--dither", default="none")
+    parser.add_argument("--color-space", default="rgb")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    mural = convert_mural(
+        args.input,
+        args.columns,
+        args.rows,
+        tile_size=args.tile_size,
+        palette_size=args.palette_size,
+        method=args.method,
+        dither=args.dither,
+        color_space=args.color_space,
+        output_dir=args.output_dir,
+        workers=args.workers,
+    )
+    elapsed = time.perf_counter() - start
+    print(f"{len(mural['tiles'])}枚のタイルに変換（{len(mural['palette'])}色）: {elapsed:.1f}秒")
+
+
+if __name__ == "__main__":
+    main()
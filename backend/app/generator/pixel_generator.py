@@ -1,11 +1,18 @@
 # 標準ライブラリ
+import base64
+import io
 import os
 from typing import Dict, List, Optional, Tuple
 
 # サードパーティ
 import numpy as np
 from PIL import Image
-from sklearn.cluster import KMeans
+
+# ローカルモジュール
+from app.generator.quantizer import map_to_palette, quantize_array
+
+# コンパクト形式のデザインデータで透明ピクセルを表すインデックス
+TRANSPARENT_INDEX = 255
 
 
 def resize_image(image: Image.Image, size: int) -> Image.Image:
@@ -14,7 +21,7 @@ def resize_image(image: Image.Image, size: int) -> Image.Image:
 
 
 def quantize_colors(
-    image: Image.Image, palette_size: int
+    image: Image.Image, palette_size: int, method: str = "kmeans"
 ) -> Tuple[Image.Image, List[Tuple[int, int, int]]]:
     """画像の色数をAnimal Crossingで使用可能な色数に減らす"""
     # 画像データをnumpy配列に変換
@@ -23,42 +30,11 @@ def quantize_colors(
 
     # 画像が3チャンネル(RGB)または4チャンネル(RGBA)であることを確認
     if len(original_shape) == 3 and original_shape[2] in [3, 4]:
-        # ピクセルデータを2次元配列に変形
-        pixels = img_array.reshape(-1, original_shape[2])
-
-        # アルファチャンネルがある場合は、透明度が一定以上のピクセルだけを色の計算に使用
-        if original_shape[2] == 4:
-            # アルファ値が50%以上のピクセルを色の計算に使用
-            rgb_pixels = pixels[pixels[:, 3] > 128][:, :3]
-        else:
-            rgb_pixels = pixels[:, :3]
-
-        # K-means法で色をクラスタリング
-        kmeans = KMeans(n_clusters=palette_size, random_state=0).fit(rgb_pixels)
-        colors = kmeans.cluster_centers_.astype(int)
-
-        # 全ピクセルに対して最も近い色を割り当て
-        labels = kmeans.predict(pixels[:, :3])
-        quantized_pixels = np.zeros_like(pixels)
-
-        for i in range(len(pixels)):
-            if original_shape[2] == 4 and pixels[i, 3] <= 128:
-                # 透明ピクセルは透明のまま
-                quantized_pixels[i] = [0, 0, 0, 0]
-            else:
-                # 不透明ピクセルに近い色を割り当て
-                quantized_pixels[i, :3] = colors[labels[i]]
-                if original_shape[2] == 4:
-                    quantized_pixels[i, 3] = pixels[i, 3]
-
-        # 配列を元の形状に戻す
-        quantized_array = quantized_pixels.reshape(original_shape)
+        # ラベル割り当て・透明マスク・色の展開を配列演算で一括処理
+        quantized_array, colors, _ = quantize_array(img_array, palette_size, method)
 
         # numpy配列をPIL画像に変換
-        if original_shape[2] == 4:
-            quantized_image = Image.fromarray(quantized_array.astype("uint8"), "RGBA")
-        else:
-            quantized_image = Image.fromarray(quantized_array.astype("uint8"), "RGB")
+        quantized_image = Image.fromarray(quantized_array.astype("uint8"))
 
         # 実際に使用されている色のリストを返す
         palette = [tuple(color) for color in colors]
@@ -69,10 +45,192 @@ def quantize_colors(
         return image, []
 
 
-def apply_pixel_art_effect(image: Image.Image) -> Image.Image:
-    """ピクセルアート効果を適用する"""
-    # 既にピクセル化されている状態なので、効果的なディザリングを適用
-    return image
+def build_design_data(
+    palette: np.ndarray, labels: np.ndarray, width: int, height: int, compact: bool = False
+) -> Dict:
+    """
+    パレットと各ピクセルのパレット番号からAnimal Crossing形式のデザインデータを作る
+
+    compact=True の場合は、ピクセルごとの辞書の代わりに平坦な uint8 のインデックス列
+    （bytes、透明ピクセルは TRANSPARENT_INDEX）を "indices" に格納する。
+    """
+    design_data = {
+        "width": width,
+        "height": height,
+        "palette": [{"r": int(c[0]), "g": int(c[1]), "b": int(c[2])} for c in palette],
+    }
+
+    if compact:
+        indices = np.where(labels < 0, TRANSPARENT_INDEX, labels).astype(np.uint8)
+        design_data["transparent_index"] = TRANSPARENT_INDEX
+        design_data["indices"] = indices.tobytes()
+    else:
+        design_data["pixels"] = [
+            {"x": i % width, "y": i // width, "color_index": color_index}
+            for i, color_index in enumerate(labels.tolist())
+        ]
+
+    return design_data
+
+
+def encode_design_data(design_data: Dict) -> Dict:
+    """コンパクト形式のインデックス列をbase64文字列にして、JSONに変換できる形にする"""
+    if isinstance(design_data.get("indices"), bytes):
+        design_data = dict(design_data, indices=base64.b64encode(design_data["indices"]).decode())
+    return design_data
+
+
+def design_to_png(design_data: Dict, compress_level: Optional[int] = None) -> bytes:
+    """
+    コンパクト形式のデザインデータを、パレットモード（P）のPNGにする
+
+    パレットの色数（透明色を含む）が16以下なら4ビット、それ以外は8ビットのインデックスで
+    書き出す。透明ピクセルがある場合は、パレットの最後に追加した透明色を指す。
+    RGBAのPNGより小さく、PNG自体がパレットと各ピクセルのパレット番号をそのまま表す。
+    compress_level を省略した場合、64x64以下は最大圧縮（9）、それより大きい場合は
+    サイズの差が小さい割に時間がかかるため標準（6）で圧縮する。
+    """
+    width, height = design_data["width"], design_data["height"]
+    if compress_level is None:
+        compress_level = 9 if width * height <= 64 * 64 else 6
+    palette = design_data["palette"]
+    indices = np.frombuffer(design_data["indices"], dtype=np.uint8)
+
+    colors = [value for c in palette for value in (c["r"], c["g"], c["b"])]
+    options = {}
+    transparent = indices == design_data["transparent_index"]
+    if transparent.any():
+        indices = np.where(transparent, len(palette), indices).astype(np.uint8)
+        colors += [0, 0, 0]
+        options["transparency"] = len(palette)
+
+    image = Image.frombytes("P", (width, height), indices.tobytes())
+    image.putpalette(colors or [0, 0, 0])
+    bits = 4 if len(colors) // 3 <= 16 else 8
+
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", bits=bits, compress_level=compress_level, **options)
+    return buffered.getvalue()
+
+
+def apply_pixel_art_effect(
+    img_array: np.ndarray, palette: np.ndarray, dither: str, color_space: str = "rgb"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    ピクセルアート効果（ディザリング）を適用する
+
+    量子化前の画像を決まったパレットに割り当て直し、パレットにない中間色を
+    パレットの色の混ぜ合わせで表す。戻り値は (量子化後の配列, 各ピクセルのパレット番号)。
+    """
+    return map_to_palette(img_array, palette, dither, color_space)
+
+
+def _quantize_image(
+    image: Image.Image,
+    palette_size: int,
+    style: str,
+    method: str,
+    dither: str = "none",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
+) -> Tuple[Image.Image, np.ndarray, np.ndarray]:
+    """RGBA画像を量子化し、プレビュー画像・パレット・各ピクセルのパレット番号を返す"""
+    # 色の量子化（パレット番号は量子化器のラベルをそのまま使う）
+    img_array = np.array(image)
+    quantized_array, palette, labels = quantize_array(
+        img_array, palette_size, method, color_space, target_palette
+    )
+
+    # ピクセルアート効果の適用（パレットは量子化で決めたものを使う）
+    if style == "pixel" and dither != "none":
+        quantized_array, labels = apply_pixel_art_effect(img_array, palette, dither, color_space)
+    pixel_art = Image.fromarray(quantized_array.astype("uint8"))
+
+    return pixel_art, palette, labels
+
+
+def _quantize_to_design(
+    image: Image.Image,
+    size: int,
+    palette_size: int,
+    style: str,
+    method: str,
+    output_path: Optional[str],
+    compact: bool,
+    **effects,
+) -> Dict:
+    """RGBA画像を量子化し、量子化結果のラベルから直接デザインデータを作る"""
+    pixel_art, palette, labels = _quantize_image(image, palette_size, style, method, **effects)
+
+    # 出力を保存
+    if output_path:
+        pixel_art.save(output_path, format="PNG")
+
+    # Animal Crossing形式のデザインデータの作成
+    return build_design_data(palette, labels, size, size, compact)
+
+
+def convert_image(
+    image: Image.Image,
+    output_path: Optional[str] = None,
+    size: int = 32,
+    palette_size: int = 15,
+    style: str = "pixel",
+    method: str = "kmeans",
+    compact: bool = False,
+    dither: str = "none",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
+) -> Dict:
+    """読み込み済みの画像をリサイズ・量子化してデザインデータを作る（引数は generate_pixel_art と同じ）"""
+    # RGBA形式に変換
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    # リサイズ
+    resized_img = resize_image(image, size)
+
+    return _quantize_to_design(
+        resized_img,
+        size,
+        palette_size,
+        style,
+        method,
+        output_path,
+        compact,
+        dither=dither,
+        color_space=color_space,
+        target_palette=target_palette,
+    )
+
+
+def quantize_design(
+    image: Image.Image,
+    size: int = 32,
+    palette_size: int = 15,
+    style: str = "pixel",
+    method: str = "kmeans",
+    compact: bool = True,
+    dither: str = "none",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
+) -> Tuple[Image.Image, Dict]:
+    """
+    メモリ上の画像をリサイズ・量子化し、プレビュー画像とデザインデータを返す
+
+    ファイルへの書き出しやPNGへの変換は行わない（生成結果をそのままデザインにする用途）。
+    画像がすでに size x size の場合はリサイズしない。
+    dither, color_space, target_palette は generate_pixel_art と同じ。
+    """
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    if image.size != (size, size):
+        image = resize_image(image, size)
+
+    pixel_art, palette, labels = _quantize_image(
+        image, palette_size, style, method, dither, color_space, target_palette
+    )
+    return pixel_art, build_design_data(palette, labels, size, size, compact)
 
 
 def generate_pixel_art(
@@ -82,6 +240,11 @@ def generate_pixel_art(
     size: int = 32,
     palette_size: int = 15,
     style: str = "pixel",
+    method: str = "kmeans",
+    compact: bool = False,
+    dither: str = "none",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
 ) -> Dict:
     """
     画像またはテキストプロンプトからAnimal Crossing用のピクセルアートを生成する
@@ -100,6 +263,16 @@ def generate_pixel_art(
         使用する色の数
     style : str, default="pixel"
         変換スタイル
+    method : str, default="kmeans"
+        色の量子化に使うクラスタリング手法（"kmeans", "minibatch", "median_cut"）
+    compact : bool, default=False
+        True の場合、ピクセルごとの辞書の代わりに uint8 のインデックス列を返す
+    dither : str, default="none"
+        style="pixel" のときのディザリング（"floyd_steinberg", "ordered", "bayer2/4/8"）
+    color_space : str, default="rgb"
+        クラスタリングと色の距離に使う色空間（"rgb", "lab"）
+    target_palette : np.ndarray, optional
+        使える色の一覧（(色数, 3)、ゲーム内の色など）
 
     Returns:
     --------
@@ -110,45 +283,18 @@ def generate_pixel_art(
     if input_path and os.path.exists(input_path):
         # 画像からピクセルアートを生成
         with Image.open(input_path) as img:
-            # RGBA形式に変換
-            if img.mode != "RGBA":
-                img = img.convert("RGBA")
-
-            # リサイズ
-            resized_img = resize_image(img, size)
-
-            # 色の量子化
-            quantized_img, palette = quantize_colors(resized_img, palette_size)
-
-            # ピクセルアート効果の適用
-            if style == "pixel":
-                pixel_art = apply_pixel_art_effect(quantized_img)
-            else:
-                pixel_art = quantized_img
-
-            # 出力を保存
-            if output_path:
-                pixel_art.save(output_path, format="PNG")
-
-            # ピクセルデータの抽出
-            pixel_data = list(pixel_art.getdata())
-
-            # Animal Crossing形式のデザインデータの作成
-            design_data = {
-                "width": size,
-                "height": size,
-                "palette": [{"r": c[0], "g": c[1], "b": c[2]} for c in palette],
-                "pixels": [
-                    {
-                        "x": i % size,
-                        "y": i // size,
-                        "color_index": palette.index((p[0], p[1], p[2])) if p[3] > 128 else -1,
-                    }
-                    for i, p in enumerate(pixel_data)
-                ],
-            }
-
-            return design_data
+            return convert_image(
+                img,
+                output_path,
+                size,
+                palette_size,
+                style,
+                method,
+                compact,
+                dither=dither,
+                color_space=color_space,
+                target_palette=target_palette,
+            )
 
     elif input_text:
         # テキストプロンプトからピクセルアートを生成
@@ -233,38 +379,18 @@ def generate_pixel_art(
                     if (x + y) % 8 < 4:
                         draw.point((x, y), fill=(0, 0, 255, 255))
 
-        # 色の量子化
-        quantized_img, palette = quantize_colors(img, palette_size)
-
-        # ピクセルアート効果の適用
-        if style == "pixel":
-            pixel_art = apply_pixel_art_effect(quantized_img)
-        else:
-            pixel_art = quantized_img
-
-        # 出力を保存
-        if output_path:
-            pixel_art.save(output_path, format="PNG")
-
-        # ピクセルデータの抽出
-        pixel_data = list(pixel_art.getdata())
-
-        # Animal Crossing形式のデザインデータの作成
-        design_data = {
-            "width": size,
-            "height": size,
-            "palette": [{"r": c[0], "g": c[1], "b": c[2]} for c in palette],
-            "pixels": [
-                {
-                    "x": i % size,
-                    "y": i // size,
-                    "color_index": palette.index((p[0], p[1], p[2])) if p[3] > 128 else -1,
-                }
-                for i, p in enumerate(pixel_data)
-            ],
-        }
-
-        return design_data
+        return _quantize_to_design(
+            img,
+            size,
+            palette_size,
+            style,
+            method,
+            output_path,
+            compact,
+            dither=dither,
+            color_space=color_space,
+            target_palette=target_palette,
+        )
 
     else:
         raise ValueError("input_path または input_text のいずれかを指定する必要があります")
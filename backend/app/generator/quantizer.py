@@ -0,0 +1,211 @@
+# 標準ライブラリ
+from typing import Callable, Dict, Optional, Tuple
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from app.generator.effects import COLOR_SPACES, dither_to_palette, lab_to_srgb, nearest_colors
+
+# scikit-learn は読み込みに時間がかかるため、K-means系の手法を使うときに import する
+
+# アルファ値がこの値以下のピクセルは透明として扱う
+ALPHA_THRESHOLD = 128
+
+
+def _fit_kmeans(rgb_pixels: np.ndarray, n_colors: int) -> Tuple[np.ndarray, np.ndarray]:
+    """K-means法でパレットを計算する（従来の quantize_colors と同じ設定）"""
+    from sklearn.cluster import KMeans
+
+    kmeans = KMeans(n_clusters=n_colors, random_state=0).fit(rgb_pixels)
+    # labels_ は学習後の中心に対する最終割り当てなので predict を呼び直す必要はない
+    return kmeans.cluster_centers_, kmeans.labels_
+
+
+def _fit_minibatch_kmeans(rgb_pixels: np.ndarray, n_colors: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ミニバッチK-means法でパレットを計算する（大きな画像向けの高速版）"""
+    from sklearn.cluster import MiniBatchKMeans
+
+    kmeans = MiniBatchKMeans(n_clusters=n_colors, random_state=0, batch_size=1024, n_init=3).fit(
+        rgb_pixels
+    )
+    return kmeans.cluster_centers_, kmeans.labels_
+
+
+def _fit_median_cut(rgb_pixels: np.ndarray, n_colors: int) -> Tuple[np.ndarray, np.ndarray]:
+    """メディアンカット法でパレットを計算する（反復計算なしで決定的）"""
+    pixels = rgb_pixels.astype(np.int32)
+
+    def color_range(indices: np.ndarray) -> int:
+        if len(indices) < 2:
+            return 0
+        box = pixels[indices]
+        return int((box.max(axis=0) - box.min(axis=0)).max())
+
+    boxes = [np.arange(len(pixels))]
+    ranges = [color_range(boxes[0])]
+
+    while len(boxes) < n_colors:
+        # 色の範囲が最も広いボックスを、範囲が最も広いチャンネルの中央値で分割
+        target = int(np.argmax(ranges))
+        if ranges[target] == 0:
+            break
+        indices = boxes.pop(target)
+        ranges.pop(target)
+
+        box = pixels[indices]
+        channel = int(np.argmax(box.max(axis=0) - box.min(axis=0)))
+        half = len(indices) // 2
+        order = np.argpartition(box[:, channel], half)
+
+        for part in (indices[order[:half]], indices[order[half:]]):
+            boxes.append(part)
+            ranges.append(color_range(part))
+
+    centers = np.empty((len(boxes), 3), dtype=np.float64)
+    labels = np.empty(len(pixels), dtype=np.intp)
+    for i, indices in enumerate(boxes):
+        centers[i] = pixels[indices].mean(axis=0)
+        labels[indices] = i
+
+    return centers, labels
+
+
+def _merge_duplicate_colors(
+    colors: np.ndarray, labels: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """整数化で同じ色になったパレット項目をまとめ、ラベルを付け替える（最初に現れた順を保つ）"""
+    _, first, inverse = np.unique(colors, axis=0, return_index=True, return_inverse=True)
+    if len(first) == len(colors):
+        return colors, labels
+
+    # 重複をまとめた後のパレット番号（元のパレットで最初に現れた順）
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return colors[np.sort(first)], rank[inverse.reshape(-1)][labels]
+
+
+# クラスタリング手法の一覧（いずれも (中心色, 各ピクセルのラベル) を返す）
+QUANTIZERS: Dict[str, Callable[[np.ndarray, int], Tuple[np.ndarray, np.ndarray]]] = {
+    "kmeans": _fit_kmeans,
+    "minibatch": _fit_minibatch_kmeans,
+    "median_cut": _fit_median_cut,
+}
+
+
+def _opaque_mask(pixels: np.ndarray) -> np.ndarray:
+    """アルファ値が50%以上のピクセルだけを色の計算と割り当ての対象にする"""
+    if pixels.shape[1] == 4:
+        return pixels[:, 3] > ALPHA_THRESHOLD
+    return np.ones(len(pixels), dtype=bool)
+
+
+def _expand(
+    img_array: np.ndarray, colors: np.ndarray, labels: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """パレット番号（透明は -1）から量子化後の配列を作る"""
+    pixels = img_array.reshape(-1, img_array.shape[2])
+    opaque = labels >= 0
+    quantized = np.zeros_like(pixels)
+    quantized[opaque, :3] = colors[labels[opaque]]
+    if pixels.shape[1] == 4:
+        quantized[opaque, 3] = pixels[opaque, 3]
+    return quantized.reshape(img_array.shape), colors, labels
+
+
+def map_to_palette(
+    img_array: np.ndarray, palette: np.ndarray, dither: str = "none", color_space: str = "rgb"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    RGB/RGBA画像の配列を、決まったパレットの色に（必要ならディザリングして）割り当てる
+
+    最も近い色は参照表（LUT）で引くため、画素数に比例する計算量で済む。
+    戻り値は quantize_array と同じ形式の (量子化後の配列, 各ピクセルのパレット番号)。
+    """
+    palette = np.asarray(palette, dtype=int).reshape(-1, 3)
+    height, width, channels = img_array.shape
+    pixels = img_array.reshape(-1, channels)
+    opaque = _opaque_mask(pixels)
+
+    labels = np.full(len(pixels), -1, dtype=np.intp)
+    if len(palette) and opaque.any():
+        rgb = pixels[:, :3].reshape(height, width, 3)
+        indices = dither_to_palette(
+            rgb, opaque.reshape(height, width), palette, dither, color_space
+        )
+        labels[opaque] = indices.reshape(-1)[opaque]
+
+    quantized, _, labels = _expand(img_array, palette, labels)
+    return quantized, labels
+
+
+def quantize_array(
+    img_array: np.ndarray,
+    palette_size: int,
+    method: str = "kmeans",
+    color_space: str = "rgb",
+    target_palette: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    RGB/RGBA画像の配列をパレットの色に量子化する
+
+    ラベルの割り当て、透明ピクセルのマスク、パレット色の展開はすべて
+    NumPyの配列演算で一括して行う。
+
+    Parameters:
+    -----------
+    img_array : np.ndarray
+        (高さ, 幅, 3) または (高さ, 幅, 4) の uint8 配列
+    palette_size : int
+        使用する色の数
+    method : str, default="kmeans"
+        クラスタリング手法（"kmeans", "minibatch", "median_cut"）
+    color_space : str, default="rgb"
+        クラスタリングと色の距離に使う色空間（"rgb", "lab"）
+    target_palette : np.ndarray, optional
+        使える色の一覧（(色数, 3)、ゲーム内の色など）。色数が palette_size 以下なら
+        そのままパレットにし、多い場合はクラスタの中心を最も近い使える色に置き換える
+
+    Returns:
+    --------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        量子化後の配列（入力と同じ形状）、パレット（(色数, 3) の int 配列）、
+        各ピクセルのパレット番号（平坦化した順序、透明ピクセルは -1）
+    """
+    if method not in QUANTIZERS:
+        raise ValueError(f"未対応の量子化手法です: {method}（{', '.join(QUANTIZERS)} のいずれか）")
+    if color_space not in COLOR_SPACES:
+        raise ValueError(f"未対応の色空間です: {color_space}（{', '.join(COLOR_SPACES)} のいずれか）")
+
+    if target_palette is not None:
+        target_palette = np.asarray(target_palette, dtype=int).reshape(-1, 3)
+        if len(target_palette) <= palette_size:
+            # 使える色が少なければクラスタリングせず、各ピクセルを最も近い色に割り当てる
+            quantized, labels = map_to_palette(img_array, target_palette, color_space=color_space)
+            return quantized, target_palette, labels
+
+    pixels = img_array.reshape(-1, img_array.shape[2])
+    opaque = _opaque_mask(pixels)
+    rgb_pixels = pixels[opaque, :3]
+    labels = np.full(len(pixels), -1, dtype=np.intp)
+
+    if len(rgb_pixels) == 0:
+        # 完全に透明な画像はパレットなし
+        return _expand(img_array, np.empty((0, 3), dtype=int), labels)
+
+    n_colors = min(palette_size, len(rgb_pixels))
+    if color_space == "lab":
+        # 知覚的な色差に近い L*a*b* 空間でクラスタリングし、中心をRGBに戻す
+        centers, opaque_labels = QUANTIZERS[method](COLOR_SPACES["lab"](rgb_pixels), n_colors)
+        centers = np.rint(lab_to_srgb(centers))
+    else:
+        centers, opaque_labels = QUANTIZERS[method](rgb_pixels, n_colors)
+
+    if target_palette is not None:
+        # クラスタの中心を最も近い使える色に置き換える（同じ色になった項目は下でまとめる）
+        centers = target_palette[nearest_colors(centers, target_palette, color_space)]
+
+    colors, opaque_labels = _merge_duplicate_colors(centers.astype(int), opaque_labels)
+
+    labels[opaque] = opaque_labels
+    return _expand(img_array, colors, labels)
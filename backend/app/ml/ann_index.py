@@ -0,0 +1,228 @@
+# 標準ライブラリ
+from typing import Dict, Tuple, Type
+
+# サードパーティ
+import numpy as np
+
+# 近似最近傍探索（ANN）の索引。どれも sklearn の NearestNeighbors と同じく
+# fit(features) と kneighbors(X, n_neighbors) -> (距離, インデックス) を持つ。
+# 候補を絞り込んだ後の距離はユークリッド距離で正確に計算し直す。
+
+# 一度に計算する距離の行列の要素数の上限
+CHUNK_ELEMENTS = 1 << 24
+
+
+def _top_k(
+    data: np.ndarray, norms: np.ndarray, ids: np.ndarray, query: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """候補 data の中から query に近い k 件を、近い順に (距離, ids) で返す"""
+    # ||a - q||^2 = ||a||^2 - 2 a・q + ||q||^2
+    dist = norms - 2 * (data @ query) + query @ query
+    if len(dist) > k:
+        top = np.argpartition(dist, k - 1)[:k]
+        dist, ids = dist[top], ids[top]
+    order = np.argsort(dist, kind="stable")
+    return np.sqrt(np.maximum(dist[order], 0)), ids[order]
+
+
+class ExactIndex:
+    """すべての特徴量との距離を計算する厳密な探索（基準・小規模向け）"""
+
+    def __init__(self, n_neighbors: int = 5):
+        self.n_neighbors = n_neighbors
+
+    def fit(self, features: np.ndarray) -> "ExactIndex":
+        self._data = np.ascontiguousarray(features, dtype=np.float32)
+        self._norms = np.einsum("ij,ij->i", self._data, self._data)
+        self._ids = np.arange(len(self._data))
+        return self
+
+    def kneighbors(self, X: np.ndarray, n_neighbors: int = None):
+        k = min(n_neighbors or self.n_neighbors, len(self._data))
+        X = np.asarray(X, dtype=np.float32)
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=np.intp)
+        # 距離の行列が大きくなりすぎないよう、クエリを分けて計算する
+        chunk = max(1, CHUNK_ELEMENTS // len(self._data))
+        for start in range(0, len(X), chunk):
+            queries = X[start : start + chunk]
+            dist = self._norms - 2 * (queries @ self._data.T)
+            dist += np.einsum("ij,ij->i", queries, queries)[:, None]
+            if k < dist.shape[1]:
+                top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(self._ids, dist.shape)
+            top_dist = np.take_along_axis(dist, top, axis=1)
+            order = np.argsort(top_dist, axis=1, kind="stable")
+            distances[start : start + chunk] = np.sqrt(
+                np.maximum(np.take_along_axis(top_dist, order, axis=1), 0)
+            )
+            indices[start : start + chunk] = np.take_along_axis(top, order, axis=1)
+        return distances, indices
+
+
+class IVFIndex(ExactIndex):
+    """
+    転置ファイル索引（IVF）
+
+    特徴量を K-means で n_lists 個のリストに分け、検索時はクエリに近い n_probe 個の
+    リストだけを調べる。n_probe を増やすと再現率が上がり、検索は遅くなる。
+
+    Parameters:
+    -----------
+    n_lists : int or None
+        リストの数（None の場合は件数の平方根）
+    n_probe : int
+        検索時に調べるリストの数
+    n_iter : int
+        K-means の反復回数
+    sample_size : int
+        K-means の学習に使う特徴量の最大数
+    """
+
+    def __init__(
+        self,
+        n_neighbors: int = 5,
+        n_lists: int = None,
+        n_probe: int = 8,
+        n_iter: int = 10,
+        sample_size: int = 20000,
+        seed: int = 0,
+    ):
+        super().__init__(n_neighbors)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+
+    def _assign(self, X: np.ndarray) -> np.ndarray:
+        dist = self._centroid_norms - 2 * (X @ self.centroids.T)
+        return np.argmin(dist, axis=1)
+
+    def fit(self, features: np.ndarray) -> "IVFIndex":
+        data = np.ascontiguousarray(features, dtype=np.float32)
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(len(data)))), len(data))
+
+        # 一部の特徴量だけで K-means（Lloyd法）を行い、リストの中心を決める
+        rng = np.random.default_rng(self.seed)
+        sample = data[rng.choice(len(data), min(len(data), self.sample_size), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            self._centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+            labels = self._assign(sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            # 空になったリストは前回の中心のまま残す
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+        self._centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        # リストごとに連続して並ぶよう特徴量を並べ替える
+        labels = self._assign(data)
+        order = np.argsort(labels, kind="stable")
+        self._ids = order
+        self._data = data[order]
+        self._norms = np.einsum("ij,ij->i", self._data, self._data)
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        return self
+
+    def kneighbors(self, X: np.ndarray, n_neighbors: int = None):
+        k = min(n_neighbors or self.n_neighbors, len(self._data))
+        X = np.asarray(X, dtype=np.float32)
+        n_lists = len(self.centroids)
+        n_probe = min(self.n_probe, n_lists)
+
+        # すべてのクエリについて、近いリストをまとめて求める
+        centroid_dist = self._centroid_norms - 2 * (X @ self.centroids.T)
+        probes = np.argsort(centroid_dist, axis=1)
+
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=np.intp)
+        for i, query in enumerate(X):
+            # 候補が k 件に満たない場合は、次に近いリストも調べる
+            n = n_probe
+            while True:
+                lists = probes[i, :n]
+                sizes = self._offsets[lists + 1] - self._offsets[lists]
+                if sizes.sum() >= k or n == n_lists:
+                    break
+                n += 1
+            rows = np.concatenate(
+                [np.arange(self._offsets[j], self._offsets[j + 1]) for j in lists]
+            )
+            distances[i], indices[i] = _top_k(
+                self._data[rows], self._norms[rows], self._ids[rows], query, k
+            )
+        return distances, indices
+
+
+class LSHIndex(ExactIndex):
+    """
+    ランダム射影による局所性鋭敏型ハッシュ（LSH）の索引
+
+    n_tables 個のハッシュ表それぞれで、特徴量を n_bits 枚のランダムな超平面のどちら側にあるかで
+    バケットに分ける。検索時はクエリと同じバケットに入った特徴量だけを調べる。
+    n_bits を増やすとバケットが小さくなって速くなり、n_tables を増やすと再現率が上がる。
+    """
+
+    def __init__(self, n_neighbors: int = 5, n_tables: int = 8, n_bits: int = 10, seed: int = 0):
+        super().__init__(n_neighbors)
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+
+    def _hash(self, X: np.ndarray) -> np.ndarray:
+        """(件数, n_tables) のハッシュ値を返す"""
+        bits = np.einsum("nd,tbd->ntb", X - self._mean, self.planes) > 0
+        return bits @ (1 << np.arange(self.n_bits, dtype=np.int64))
+
+    def fit(self, features: np.ndarray) -> "LSHIndex":
+        super().fit(features)
+        rng = np.random.default_rng(self.seed)
+        self._mean = self._data.mean(axis=0)
+        self.planes = rng.standard_normal((self.n_tables, self.n_bits, self._data.shape[1]))
+        self.planes = self.planes.astype(np.float32)
+
+        # ハッシュ表ごとに、ハッシュ値の順に並べたIDを持つ（バケットは二分探索で引く）
+        chunk = max(1, CHUNK_ELEMENTS // (self.n_tables * self.n_bits))
+        codes = np.concatenate(
+            [self._hash(self._data[i : i + chunk]) for i in range(0, len(self._data), chunk)]
+        )
+        self._orders = np.argsort(codes, axis=0, kind="stable").T
+        self._sorted_codes = np.take_along_axis(codes, self._orders.T, axis=0).T
+        return self
+
+    def kneighbors(self, X: np.ndarray, n_neighbors: int = None):
+        k = min(n_neighbors or self.n_neighbors, len(self._data))
+        X = np.asarray(X, dtype=np.float32)
+        codes = self._hash(X)
+
+        distances = np.empty((len(X), k))
+        indices = np.empty((len(X), k), dtype=np.intp)
+        for i, query in enumerate(X):
+            buckets = []
+            for t in range(self.n_tables):
+                start, end = np.searchsorted(self._sorted_codes[t], [codes[i, t], codes[i, t] + 1])
+                buckets.append(self._orders[t, start:end])
+            rows = np.unique(np.concatenate(buckets))
+            # 同じバケットの候補が k 件に満たない場合は全件を調べる
+            if len(rows) < k:
+                rows = self._ids
+            distances[i], indices[i] = _top_k(self._data[rows], self._norms[rows], rows, query, k)
+        return distances, indices
+
+
+ANN_INDEXES: Dict[str, Type[ExactIndex]] = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+    "lsh": LSHIndex,
+}
+
+
+def create_index(name: str, n_neighbors: int = 5, **params) -> ExactIndex:
+    """名前で近傍探索の索引を作る（params は各索引の調整用パラメータ）"""
+    if name not in ANN_INDEXES:
+        raise ValueError(f"不明な索引です: {name}（{', '.join(ANN_INDEXES)} から選択）")
+    return ANN_INDEXES[name](n_neighbors=n_neighbors, **params)
@@ -0,0 +1,115 @@
+# 標準ライブラリ
+import logging
+from contextlib import nullcontext
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+# サードパーティ
+# torch は読み込みに時間がかかるため、関数の中で import する
+
+# CPUで推論するときに選べる高速化の方法（組み合わせて指定できる）
+# - channels_last: UNet・VAEの畳み込みの重みと入力を NHWC の並びにする（oneDNN の畳み込みが速くなる）
+# - bf16: 推論を bfloat16 の autocast で行う（AVX512-BF16 / AMX のあるCPUのみ。重みは float32 のまま）
+# - compile: UNet を torch.compile する（初回の呼び出しと、解像度を変えたときにコンパイルする）
+# - int8: UNet とテキストエンコーダーの全結合層を動的 int8 量子化する
+# channels_last と int8 は重みを作り直すため、メモリマップで共有している重み（MMAP_WEIGHTS）の
+# うち、対象の層の重みはワーカーごとのコピーになる。
+CPU_MODES = ("channels_last", "bf16", "compile", "int8")
+
+# main の "app" ロガーの子（ハンドラーは setup_logger で設定したものを使う）
+logger = logging.getLogger("app.cpu_acceleration")
+
+
+def parse_cpu_modes(modes: Union[str, Iterable[str], None]) -> Tuple[str, ...]:
+    """カンマ区切りの指定（"channels_last,bf16" など）を CPU_MODES の名前のタプルにする"""
+    if modes is None:
+        return ()
+    # "default" と空の指定は、高速化なし
+    if isinstance(modes, str):
+        modes = modes.split(",")
+    names = tuple(m.strip() for m in modes if m.strip() and m.strip() != "default")
+    unknown = [m for m in names if m not in CPU_MODES]
+    if unknown:
+        raise ValueError(f"不明なCPUの高速化モードです: {', '.join(unknown)}（{', '.join(CPU_MODES)}）")
+    if "int8" in names and "bf16" in names:
+        # 動的量子化した全結合層は float32 の入力しか受け付けない
+        raise ValueError("int8 と bf16 は同時に指定できません")
+    return names
+
+
+def bf16_supported() -> bool:
+    """このCPUが bfloat16 の演算命令（AVX512-BF16 または AMX）を持つかどうか"""
+    import torch
+
+    try:
+        return bool(torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported())
+    except AttributeError:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+
+
+def supported_cpu_modes(modes: Tuple[str, ...]) -> Tuple[str, ...]:
+    """このCPUで使える方法だけを返す（bfloat16 の演算命令がなければ bf16 を除く）"""
+    if "bf16" in modes and not bf16_supported():
+        return tuple(m for m in modes if m != "bf16")
+    return modes
+
+
+def configure_threads(threads: Optional[int] = None, interop_threads: Optional[int] = None) -> Dict:
+    """
+    このプロセスの推論スレッド数を設定し、設定後の値を返す
+
+    threads は1つの演算を並列に処理するスレッド数（intra-op）、interop_threads は独立した演算を
+    同時に実行するスレッド数（inter-op）。1台で複数のワーカーを動かす場合は、
+    ワーカー数 x threads がコア数を超えないようにする。inter-op のスレッド数は最初の並列処理の
+    前にしか変更できないため、モデルを読み込む前に呼ぶ。
+    """
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            logger.warning("inter-op のスレッド数は並列処理の開始後には変更できません")
+    return {"threads": torch.get_num_threads(), "interop_threads": torch.get_num_interop_threads()}
+
+
+def apply_cpu_modes(pipelines, modes: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    パイプライン（UNet・VAE・テキストエンコーダーを共有する text2img と img2img）に
+    高速化の方法を適用し、実際に適用した方法を返す
+
+    bf16 はモジュールを変更せず、推論時に inference_context で有効にする。
+    CPUが対応していない場合は適用しない。
+    """
+    import torch
+
+    base = pipelines[0]
+    applied = supported_cpu_modes(modes)
+    if applied != modes:
+        logger.warning("このCPUは bfloat16 に対応していないため、bf16 は使いません")
+    for mode in applied:
+        if mode == "int8":
+            from torch.ao.quantization import quantize_dynamic
+
+            for module in (base.unet, base.text_encoder):
+                quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        elif mode == "channels_last":
+            base.unet.to(memory_format=torch.channels_last)
+            base.vae.to(memory_format=torch.channels_last)
+
+    # コンパイルは他の変更の後に行い、同じコンパイル済みの UNet をすべてのパイプラインで使う
+    if "compile" in applied:
+        compiled = torch.compile(base.unet)
+        for pipeline in pipelines:
+            pipeline.unet = compiled
+    return applied
+
+
+def inference_context(modes: Tuple[str, ...]):
+    """推論を囲むコンテキスト（bf16 では bfloat16 の autocast。呼び出しごとに新しく作る）"""
+    if "bf16" not in modes:
+        return nullcontext()
+    import torch
+
+    return torch.autocast("cpu", dtype=torch.bfloat16)
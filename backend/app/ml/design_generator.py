@@ -1,125 +1,442 @@
 # 標準ライブラリ
 import os
 import re
+import tempfile
+from collections import deque
 
 # サードパーティ
 import numpy as np
+import scipy.sparse as sp
 from PIL import Image
-from sklearn.decomposition import PCA
-from sklearn.neighbors import NearestNeighbors
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+# ローカルモジュール
+from app.generator.batch import BATCH_WORKERS, create_executor
+from app.ml.ann_index import create_index
+
+
+# 保存するインデックスの形式のバージョン（形式を変えたら上げる）
+INDEX_VERSION = 1
+
+# 学習用画像として扱う拡張子
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# 追加・変更・削除された画像がこの割合を超えたら、差分更新ではなくPCAから学習し直す
+REFIT_RATIO = 0.5
+
+# 1枚あたりの画素値の数（32x32x3）
+IMAGE_FEATURES = 32 * 32 * 3
+
+# ワーカープロセスに1回で渡す画像の数と、同時に実行する数（ワーカー数あたり）
+READ_BLOCK_SIZE = 256
+READ_BLOCKS_PER_WORKER = 2
+
+# この枚数未満の場合は、プロセスを起動せずにその場で読み込む
+PARALLEL_MIN_IMAGES = 1024
+
+# 画素の行列がこのバイト数を超える場合は、一時ファイルにメモリマップして保持する
+MEMMAP_BYTES = 256 * 1024 * 1024
+
+# この枚数を超える場合は、IncrementalPCA でこの枚数ずつ学習する
+PCA_CHUNK_SIZE = 1024
+
+
+def load_image_array(image_path):
+    """画像を読み込んで前処理を行う"""
+    img = Image.open(image_path)
+    img = img.resize((32, 32))  # サイズを統一
+    img = img.convert("RGB")  # RGBモードに変換
+    img_array = np.array(img)
+    return img_array.reshape(-1)  # 1次元に変換（3072要素: 32x32x3）
+
+
+def _read_images(image_paths):
+    """
+    画像をまとめて読み込む（ワーカープロセスで実行）
+
+    Returns:
+    --------
+    tuple
+        (件数, 3072) の uint8 配列と、各画像を読み込めたかどうかの配列
+    """
+    X = np.zeros((len(image_paths), IMAGE_FEATURES), dtype=np.uint8)
+    ok = np.zeros(len(image_paths), dtype=bool)
+    for i, image_path in enumerate(image_paths):
+        try:
+            X[i] = load_image_array(image_path)
+            ok[i] = True
+        except Exception as e:
+            print(f"Error loading {os.path.basename(image_path)}: {e}")
+    return X, ok
+
+
+def _chunks(rows, min_size):
+    """rows を PCA_CHUNK_SIZE 件ずつに分ける（最後が min_size 件未満なら前とまとめる）"""
+    bounds = list(range(0, len(rows), PCA_CHUNK_SIZE)) + [len(rows)]
+    if len(bounds) > 2 and bounds[-1] - bounds[-2] < min_size:
+        del bounds[-2]
+    return [rows[start:end] for start, end in zip(bounds, bounds[1:])]
+
 
 class DesignGenerator:
-    def __init__(self, training_dir="data/training_images"):
+    def __init__(
+        self,
+        training_dir="data/training_images",
+        index_path=None,
+        index="exact",
+        index_params=None,
+        workers=None,
+    ):
         self.training_dir = training_dir
+        self.workers = workers  # 画像を読み込むワーカープロセス数（None はCPUコア数）
+        # 学習済みのインデックス（PCA・特徴量・パス・TF-IDFの語彙）の保存先
+        self.index_path = index_path or os.path.join(training_dir, "design_index.npz")
         self.pca = PCA(n_components=50)  # 特徴量の次元数
-        self.nn = NearestNeighbors(n_neighbors=5)
+        self.pca_components = None  # PCAの射影行列（インデックスから読み込んだ場合も使う）
+        self.pca_mean = None
+        # 画像の類似検索に使う索引（"exact", "ivf", "lsh"）と、その調整用パラメータ
+        self.index = index
+        self.index_params = index_params or {}
+        self.nn = create_index(index, n_neighbors=5, **self.index_params)
         self.features = None
         self.images = []
         self.image_descriptions = {}  # 画像の説明文を保持
+        self.manifest = {}  # 画像のパス -> (更新時刻, ファイルサイズ)
         self.tfidf = TfidfVectorizer(max_features=1000)
+        self.description_matrix = None  # 説明文のTF-IDF（画像数 x 語彙数の疎行列）
         self.is_trained = False
 
     def load_and_preprocess_image(self, image_path):
         """画像を読み込んで前処理を行う"""
-        img = Image.open(image_path)
-        img = img.resize((32, 32))  # サイズを統一
-        img = img.convert("RGB")  # RGBモードに変換
-        img_array = np.array(img)
-        return img_array.reshape(-1)  # 1次元に変換（3072要素: 32x32x3）
-
-    def train(self):
-        """学習用画像から特徴量を抽出"""
-        image_data = []
-        descriptions = []
-
-        # 学習用画像の読み込み
-        for filename in os.listdir(self.training_dir):
-            if filename.endswith((".png", ".jpg", ".jpeg")):
+        return load_image_array(image_path)
+
+    def _scan_training_dir(self):
+        """学習用画像の一覧と、変更検知用の (更新時刻, ファイルサイズ) を返す"""
+        manifest = {}
+        for filename in sorted(os.listdir(self.training_dir)):
+            if filename.endswith(IMAGE_EXTENSIONS):
                 image_path = os.path.join(self.training_dir, filename)
-                try:
-                    img_array = self.load_and_preprocess_image(image_path)
-                    image_data.append(img_array)
-                    self.images.append(image_path)
-
-                    # ファイル名から説明文を生成
-                    description = re.sub(r"[_-]", " ", os.path.splitext(filename)[0])
-                    descriptions.append(description)
-                    self.image_descriptions[image_path] = description
-                except Exception as e:
-                    print(f"Error loading {filename}: {e}")
-
-        if not image_data:
-            raise ValueError("No valid images found in training directory")
+                stat = os.stat(image_path)
+                manifest[image_path] = (stat.st_mtime_ns, stat.st_size)
+        return manifest
 
-        # 特徴量抽出
-        X = np.array(image_data)
-        n_samples = len(image_data)
-        n_features = X.shape[1]
+    @staticmethod
+    def _describe(image_path):
+        """ファイル名から説明文を生成"""
+        return re.sub(r"[_-]", " ", os.path.splitext(os.path.basename(image_path))[0])
 
-        # PCAの次元数を動的に調整
-        n_components = min(50, n_samples, n_features)
-        self.pca = PCA(n_components=n_components)
+    def _load_images(self, image_paths, tmp_dir=None):
+        """
+        画像を読み込み、(件数, 3072) の uint8 の行列に書き込む
 
-        self.features = self.pca.fit_transform(X)
+        枚数が多い場合はプロセスプールで並列に読み込み、同時に実行するブロック数を
+        制限して結果を順に行列へ書き込む。tmp_dir を指定し、行列が MEMMAP_BYTES を
+        超える場合は一時ファイルにメモリマップするため、枚数によらずメモリ使用量は一定。
 
-        # NearestNeighborsのn_neighborsを動的に調整
-        n_neighbors = min(5, n_samples)
-        self.nn = NearestNeighbors(n_neighbors=n_neighbors)
-        self.nn.fit(self.features)
+        Returns:
+        --------
+        tuple
+            画素の行列と、各画像を読み込めたかどうかの配列
+        """
+        n_images = len(image_paths)
+        if tmp_dir and n_images * IMAGE_FEATURES > MEMMAP_BYTES:
+            X = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, "images.npy"),
+                mode="w+",
+                dtype=np.uint8,
+                shape=(n_images, IMAGE_FEATURES),
+            )
+        else:
+            X = np.empty((n_images, IMAGE_FEATURES), dtype=np.uint8)
+        ok = np.zeros(n_images, dtype=bool)
+
+        starts = range(0, n_images, READ_BLOCK_SIZE)
+        if n_images < PARALLEL_MIN_IMAGES or self.workers == 1:
+            for start in starts:
+                end = start + READ_BLOCK_SIZE
+                X[start:end], ok[start:end] = _read_images(image_paths[start:end])
+            return X, ok
+
+        workers = self.workers or BATCH_WORKERS
+        with create_executor(workers) as executor:
+            max_in_flight = workers * READ_BLOCKS_PER_WORKER
+            pending = deque()
+            for start in starts:
+                end = start + READ_BLOCK_SIZE
+                pending.append((start, executor.submit(_read_images, image_paths[start:end])))
+                while len(pending) >= max_in_flight or (pending and end >= n_images):
+                    done_start, future = pending.popleft()
+                    block, block_ok = future.result()
+                    X[done_start : done_start + len(block)] = block
+                    ok[done_start : done_start + len(block)] = block_ok
+        return X, ok
+
+    def _project(self, X):
+        """画像の配列をPCAの特徴量に変換する"""
+        return (X - self.pca_mean) @ self.pca_components.T
+
+    def train(self, full=False):
+        """
+        学習用画像から特徴量を抽出
+
+        保存済みのインデックスがあれば読み込み、追加・変更・削除された画像の分だけ更新する。
+        変更が多い場合や full=True の場合は、すべての画像から学習し直す。
+        """
+        manifest = self._scan_training_dir()
+
+        if not full and not self.is_trained:
+            self.load_index()
+
+        if full or not self.is_trained:
+            self._fit(manifest)
+        elif not self._update(manifest):
+            return
+
+        self.save_index()
+
+    def _fit(self, manifest):
+        """すべての画像からPCA・近傍探索・TF-IDFを学習する"""
+        image_paths = list(manifest)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            X, ok = self._load_images(image_paths, tmp_dir)
+            rows = np.flatnonzero(ok)
+            images = [image_paths[i] for i in rows]
+
+            if not images:
+                raise ValueError("No valid images found in training directory")
+
+            # 特徴量抽出
+            n_samples = len(images)
+            n_features = X.shape[1]
+
+            # PCAの次元数を動的に調整
+            n_components = min(50, n_samples, n_features)
+            chunks = _chunks(rows, n_components)
+            if len(chunks) == 1:
+                self.pca = PCA(n_components=n_components)
+                self.pca.fit(X[rows])
+            else:
+                # 大量の画像は一部ずつ読み出して学習し、行列全体を浮動小数点にしない
+                self.pca = IncrementalPCA(n_components=n_components)
+                for chunk in chunks:
+                    self.pca.partial_fit(X[chunk])
+            self.pca_components = self.pca.components_
+            self.pca_mean = self.pca.mean_
+
+            features = np.concatenate([self._project(X[chunk]) for chunk in chunks])
+            del X
+
+        self.images = images
+        self.image_descriptions = {path: self._describe(path) for path in images}
+        self.manifest = {path: manifest[path] for path in images}
+        self.features = features
+        self._fit_neighbors()
 
         # テキスト特徴量の学習
-        self.tfidf.fit(descriptions)
+        self.tfidf = TfidfVectorizer(max_features=1000)
+        self.description_matrix = self.tfidf.fit_transform(
+            [self.image_descriptions[path] for path in images]
+        ).tocsr()
         self.is_trained = True
 
-    def generate_from_image(self, input_image_path):
-        """入力画像から類似画像を生成"""
+    def _update(self, manifest):
+        """
+        前回からの差分だけインデックスを更新する（PCAとTF-IDFの語彙は学習し直さない）
+
+        Returns:
+        --------
+        bool
+            インデックスが変わった場合は True
+        """
+        removed = {path for path in self.images if self.manifest.get(path) != manifest.get(path)}
+        added = [path for path in manifest if self.manifest.get(path) != manifest[path]]
+        if not removed and not added:
+            return False
+
+        if len(removed) + len(added) > REFIT_RATIO * len(self.images):
+            self._fit(manifest)
+            return True
+
+        # 削除・変更された画像の行を取り除く
+        keep = np.array([path not in removed for path in self.images], dtype=bool)
+        images = [path for path in self.images if path not in removed]
+        features = self.features[keep]
+        description_matrix = self.description_matrix[keep]
+
+        # 追加・変更された画像だけを読み込み、既存のPCAで特徴量に変換して追加
+        X, ok = self._load_images(added)
+        loaded = [path for path, loaded_ok in zip(added, ok) if loaded_ok]
+        X = X[ok]
+        if loaded:
+            features = np.vstack([features, self._project(X)])
+            description_matrix = sp.vstack(
+                [description_matrix, self.tfidf.transform([self._describe(p) for p in loaded])]
+            )
+            images += loaded
+
+        if not images:
+            raise ValueError("No valid images found in training directory")
+
+        for path in removed:
+            self.image_descriptions.pop(path, None)
+            self.manifest.pop(path, None)
+        for path in loaded:
+            self.image_descriptions[path] = self._describe(path)
+            self.manifest[path] = manifest[path]
+
+        self.images = images
+        self.features = features
+        self.description_matrix = description_matrix.tocsr()
+        self._fit_neighbors()
+        return True
+
+    def _fit_neighbors(self):
+        # 近傍探索のn_neighborsを動的に調整
+        n_neighbors = min(5, len(self.images))
+        self.nn = create_index(self.index, n_neighbors=n_neighbors, **self.index_params)
+        self.nn.fit(self.features)
+
+    def save_index(self):
+        """学習済みのインデックスをファイルに保存する"""
+        vocabulary = sorted(self.tfidf.vocabulary_, key=self.tfidf.vocabulary_.get)
+        stats = np.array([self.manifest[path] for path in self.images], dtype=np.int64)
+
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = f"{self.index_path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.array(INDEX_VERSION),
+            training_dir=np.array(os.path.abspath(self.training_dir)),
+            pca_components=self.pca_components,
+            pca_mean=self.pca_mean,
+            features=self.features,
+            paths=np.array(self.images, dtype=str),
+            stats=stats.reshape(len(self.images), 2),
+            tfidf_vocabulary=np.array(vocabulary, dtype=str),
+            tfidf_idf=self.tfidf.idf_,
+        )
+        os.replace(tmp_path, self.index_path)
+
+    def load_index(self):
+        """
+        保存済みのインデックスを読み込む
+
+        Returns:
+        --------
+        bool
+            読み込めた場合は True（ファイルがない・形式のバージョンや学習用ディレクトリが
+            異なる場合は False）
+        """
+        if not os.path.exists(self.index_path):
+            return False
+
+        with np.load(self.index_path, allow_pickle=False) as index:
+            if int(index["version"]) != INDEX_VERSION or str(index["training_dir"]) != (
+                os.path.abspath(self.training_dir)
+            ):
+                return False
+
+            self.pca_components = index["pca_components"]
+            self.pca_mean = index["pca_mean"]
+            self.features = index["features"]
+            self.images = index["paths"].tolist()
+            self.manifest = {
+                path: tuple(int(v) for v in stat) for path, stat in zip(self.images, index["stats"])
+            }
+            vocabulary = index["tfidf_vocabulary"].tolist()
+            idf = index["tfidf_idf"]
+
+        self.image_descriptions = {path: self._describe(path) for path in self.images}
+        self.tfidf = TfidfVectorizer(
+            max_features=1000, vocabulary={term: i for i, term in enumerate(vocabulary)}
+        )
+        self.tfidf.idf_ = idf
+        self.description_matrix = self.tfidf.transform(
+            [self.image_descriptions[path] for path in self.images]
+        ).tocsr()
+        self._fit_neighbors()
+        self.is_trained = True
+        return True
+
+    def generate_batch_from_image(self, input_image_paths):
+        """複数の入力画像から、それぞれ最も似ている画像を返す"""
         if not self.is_trained:
             self.train()
 
-        # 入力画像の特徴量を抽出
-        input_array = self.load_and_preprocess_image(input_image_path)
-        input_features = self.pca.transform(input_array.reshape(1, -1))
-
-        # 最も近い特徴量を持つ画像を探す
-        distances, indices = self.nn.kneighbors(input_features)
+        # 入力画像の特徴量をまとめて抽出し、1回の検索で近傍を求める
+        input_arrays = np.stack([self.load_and_preprocess_image(p) for p in input_image_paths])
+        _, indices = self.nn.kneighbors(self._project(input_arrays))
 
         # 最も類似度の高い画像を返す
-        similar_image_path = self.images[indices[0][0]]
-        return Image.open(similar_image_path)
+        return [Image.open(self.images[neighbors[0]]) for neighbors in indices]
 
-    def generate_from_text(self, text_prompt):
-        """テキストプロンプトから画像を生成"""
+    def generate_from_image(self, input_image_path):
+        """入力画像から類似画像を生成"""
+        return self.generate_batch_from_image([input_image_path])[0]
+
+    def search_text(self, text_prompts, k=3):
+        """
+        複数のテキストプロンプトについて、説明文が似ている画像を検索する
+
+        すべてのプロンプトを1回の疎行列の積で採点し、類似度が0より大きい画像の中から
+        上位 k 件を argpartition で選ぶ。一致する語がない画像は採点の対象にならないため、
+        画像の数が増えても検索時間はほとんど変わらない。
+
+        Parameters:
+        -----------
+        text_prompts : list of str
+            検索するテキストプロンプト
+        k : int
+            プロンプトごとに返す画像の最大数
+
+        Returns:
+        --------
+        list of (numpy.ndarray, numpy.ndarray)
+            プロンプトごとの (画像のインデックス, 類似度)。類似度の高い順に並び、
+            一致する画像がない場合は空の配列
+        """
         if not self.is_trained:
             self.train()
 
-        # テキストプロンプトの特徴量を抽出
-        prompt_features = self.tfidf.transform([text_prompt]).toarray()
-
-        # 各画像の説明文との類似度を計算
-        similarities = []
-        for img_path in self.images:
-            desc = self.image_descriptions[img_path]
-            desc_features = self.tfidf.transform([desc]).toarray()
-            similarity = np.dot(prompt_features, desc_features.T)[0][0]
-            similarities.append(similarity)
-
-        # 最も類似度の高い3つの画像を選択
-        top_indices = np.argsort(similarities)[-3:][::-1]
-
-        # 選択された画像を組み合わせて新しい画像を生成
-        combined_image = Image.new("RGB", (32, 32))
-        for i, idx in enumerate(top_indices):
-            img = Image.open(self.images[idx])
-            img = img.resize((32, 32))
-            # 重み付けして画像を合成
-            weight = similarities[idx] / sum(similarities[j] for j in top_indices)
-            img_array = np.array(img) * weight
-            if i == 0:
-                combined_array = img_array
-            else:
-                combined_array += img_array
+        # 行がプロンプト、列が画像の類似度（TF-IDFはL2正規化済みなのでコサイン類似度）
+        scores = (self.tfidf.transform(text_prompts) @ self.description_matrix.T).tocsr()
+
+        results = []
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            indices = scores.indices[start:end]
+            similarities = scores.data[start:end]
+
+            if len(similarities) > k:
+                top = np.argpartition(-similarities, k - 1)[:k]
+                indices, similarities = indices[top], similarities[top]
+            order = np.argsort(-similarities, kind="stable")
+            results.append((indices[order], similarities[order]))
+        return results
+
+    def _blend(self, indices, similarities):
+        """選択された画像を類似度で重み付けして合成する"""
+        combined_array = np.zeros((32, 32, 3))
+        for idx, weight in zip(indices, similarities / similarities.sum()):
+            img = Image.open(self.images[idx]).convert("RGB").resize((32, 32))
+            combined_array += np.array(img) * weight
 
         combined_array = np.clip(combined_array, 0, 255).astype(np.uint8)
         return Image.fromarray(combined_array)
+
+    def generate_batch_from_text(self, text_prompts, k=3):
+        """複数のテキストプロンプトから画像を生成"""
+        images = []
+        for indices, similarities in self.search_text(text_prompts, k):
+            if len(indices) == 0:
+                # どの説明文とも一致しない場合は、先頭の画像を同じ重みで合成する
+                indices = np.arange(min(k, len(self.images)))
+                similarities = np.ones(len(indices))
+            images.append(self._blend(indices, similarities))
+        return images
+
+    def generate_from_text(self, text_prompt):
+        """テキストプロンプトから画像を生成"""
+        # 最も類似度の高い3つの画像を選択し、組み合わせて新しい画像を生成
+        return self.generate_batch_from_text([text_prompt], k=3)[0]
@@ -0,0 +1,76 @@
+# 標準ライブラリ
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    キャッシュのキーにするプロンプトの正規化（前後と連続する空白をまとめ、小文字にする）
+
+    CLIPのトークナイザーも空白をまとめて小文字にしてから分割するため、
+    正規化して同じになるプロンプトは同じ埋め込みになる。
+    """
+    return " ".join(text.split()).lower()
+
+
+class PromptEmbeddingCache:
+    """
+    テキストエンコーダーの出力（プロンプトの埋め込み）のLRUキャッシュ
+
+    キーは (モデルID, 正規化したプロンプト)。ネガティブプロンプトや画像からの生成の既定の
+    プロンプトのように毎回同じ文字列は、最初の1回だけエンコードすればよい。
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model_id: str, prompts: List[str], encode: Callable) -> List:
+        """
+        プロンプトごとの埋め込みを返す
+
+        キャッシュにないプロンプトは重複を除いて encode(正規化したプロンプトのリスト) に渡し
+        （戻り値はプロンプトごとの埋め込みの列）、キャッシュに加える。
+        """
+        keys = [(model_id, normalize_prompt(p)) for p in prompts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            n_missing = sum(1 for k in keys if k not in found)
+            self.hits += len(keys) - n_missing
+            self.misses += n_missing
+            missing = list(dict.fromkeys(k for k in keys if k not in found))
+
+        if missing:
+            # エンコード中はロックを持たない（同じプロンプトを同時にエンコードすることはある）
+            embeddings = encode([text for _, text in missing])
+            with self._lock:
+                for key, embedding in zip(missing, embeddings):
+                    found[key] = embedding
+                    self._entries[key] = embedding
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return [found[key] for key in keys]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """ヒット・ミスの回数と件数を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,173 @@
+# 標準ライブラリ
+import glob
+import importlib
+import json
+import os
+import struct
+from typing import Dict, List, Tuple
+
+# サードパーティ
+# torch・diffusers・accelerate は読み込みに時間がかかるため、関数の中で import する
+
+# safetensors のファイルをメモリマップし、その上に直接テンソルを作って重みとして使う。
+# マップは MAP_PRIVATE（書き込むとそのページだけコピーされる）で、推論では重みを書き換えないため、
+# 同じファイルを読み込んだ複数のワーカープロセスがページキャッシュの同じページを共有する。
+
+# safetensors のデータ型の名前と torch のデータ型の名前
+SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+# 重みをメモリマップで読み込むコンポーネント（model_index.json のライブラリ名）
+WEIGHT_LIBRARIES = ("diffusers", "transformers")
+
+
+def read_header(path: str) -> Tuple[int, Dict]:
+    """safetensors のヘッダー（先頭8バイトの長さ + JSON）を読み、(データの開始位置, ヘッダー) を返す"""
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    header.pop("__metadata__", None)
+    return 8 + length, header
+
+
+def mmap_state_dict(path: str, dtype=None) -> Tuple[Dict, int]:
+    """
+    safetensors のファイルをメモリマップし、ファイルのページを参照するテンソルの辞書を返す
+
+    Parameters:
+    -----------
+    path : str
+        safetensors のファイル
+    dtype : torch.dtype, optional
+        浮動小数点の重みをこの型で使う。ファイルの型と異なる重みは変換するため、
+        その重みはプロセス間で共有されない
+
+    Returns:
+    --------
+    tuple
+        (名前 -> テンソルの辞書, 型の変換や位置合わせのためにコピーした重みのバイト数)
+    """
+    import torch
+
+    data_start, header = read_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+
+    state_dict = {}
+    copied = 0
+    for name, info in header.items():
+        tensor_dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        raw = data[data_start + begin : data_start + end]
+        if (data_start + begin) % torch.empty(0, dtype=tensor_dtype).element_size():
+            # 要素の大きさの倍数の位置にない重みはそのまま参照できないのでコピーする
+            raw = raw.clone()
+            copied += raw.numel()
+        tensor = raw.view(tensor_dtype).reshape(info["shape"])
+        if dtype is not None and tensor.is_floating_point() and tensor.dtype != dtype:
+            tensor = tensor.to(dtype)
+            copied += tensor.numel() * tensor.element_size()
+        state_dict[name] = tensor
+    return state_dict, copied
+
+
+def weight_files(directory: str) -> List[str]:
+    """コンポーネントのディレクトリにある重みのファイル（fp16 などの別版は除く）"""
+    files = sorted(glob.glob(os.path.join(directory, "*.safetensors")))
+    return [f for f in files if os.path.basename(f).count(".") == 1]
+
+
+def resolve_model_path(model_id: str) -> str:
+    """モデルIDをローカルのディレクトリにする（Hugging Face Hub のIDはキャッシュにダウンロードする）"""
+    if os.path.isdir(model_id):
+        return model_id
+    from diffusers import DiffusionPipeline
+
+    return DiffusionPipeline.download(model_id)
+
+
+def load_component(directory: str, library: str, class_name: str, dtype):
+    """
+    重みを持たない状態でモデルを作り、メモリマップした重みをそのまま割り当てる
+
+    乱数での初期化や重みのコピーを行わないため、読み込み時にも重みの分のメモリを確保しない。
+
+    Returns:
+    --------
+    tuple
+        (モデル, コピーした重みのバイト数)
+    """
+    from accelerate import init_empty_weights
+
+    files = weight_files(directory)
+    if not files:
+        raise FileNotFoundError(f"safetensors の重みがありません: {directory}")
+
+    cls = getattr(importlib.import_module(library), class_name)
+    # バッファ（位置のインデックスなど）は重みのファイルにないことがあるので、通常どおり作る
+    with init_empty_weights(include_buffers=False):
+        if library == "diffusers":
+            model = cls.from_config(cls.load_config(directory))
+        else:
+            model = cls(cls.config_class.from_pretrained(directory))
+
+    state_dict = {}
+    copied = 0
+    for path in files:
+        tensors, nbytes = mmap_state_dict(path, dtype)
+        state_dict.update(tensors)
+        copied += nbytes
+    model.load_state_dict(state_dict, strict=False, assign=True)
+
+    missing = [name for name, p in model.named_parameters() if p.is_meta]
+    if missing:
+        raise ValueError(f"{class_name} の重みが足りません: {', '.join(missing[:5])}")
+    return model.eval(), copied
+
+
+def load_mmap_components(model_id: str, dtype=None) -> Tuple[Dict, Dict]:
+    """
+    パイプラインのうち重みを持つコンポーネント（UNet・VAE・テキストエンコーダー）を
+    メモリマップした safetensors から読み込む
+
+    戻り値の辞書は StableDiffusionPipeline.from_pretrained にキーワード引数で渡す。
+
+    Parameters:
+    -----------
+    model_id : str
+        Hugging Face Hub のモデルIDまたはローカルのディレクトリ
+    dtype : torch.dtype, optional
+        浮動小数点の重みの型（省略時はファイルの型のまま）
+
+    Returns:
+    --------
+    tuple
+        (コンポーネント名 -> モデル, 共有できなかった重みの情報 {"copied_bytes": ...})
+    """
+    path = resolve_model_path(model_id)
+    with open(os.path.join(path, "model_index.json"), encoding="utf-8") as f:
+        model_index = json.load(f)
+
+    components = {}
+    copied = 0
+    for name, spec in model_index.items():
+        if not isinstance(spec, list) or spec[0] not in WEIGHT_LIBRARIES:
+            continue
+        directory = os.path.join(path, name)
+        weights = glob.glob(os.path.join(directory, "*.safetensors"))
+        weights += glob.glob(os.path.join(directory, "*.bin"))
+        if not weights or name == "safety_checker":
+            continue  # スケジューラーなど、重みを持たないコンポーネント
+        components[name], nbytes = load_component(directory, spec[0], spec[1], dtype)
+        copied += nbytes
+    return components, {"copied_bytes": copied}
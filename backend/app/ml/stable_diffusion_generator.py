@@ -1,80 +1,385 @@
 # 標準ライブラリ
 import os
+import resource
+import time
 
 # サードパーティ
-import torch
-from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionPipeline
+# torch と diffusers は読み込みに時間がかかるため、モデルを作成するときに import する
 from PIL import Image
 import numpy as np
 
+# ローカルモジュール
+from app.core.metrics import span
+from app.ml.cpu_acceleration import (
+    apply_cpu_modes,
+    configure_threads,
+    inference_context,
+    parse_cpu_modes,
+)
+from app.ml.prompt_cache import PromptEmbeddingCache
+from app.ml.shared_weights import load_mmap_components
+
+# 生成時に名前で指定できるスケジューラー（diffusers のクラス名）
+SCHEDULERS = {
+    "pndm": "PNDMScheduler",
+    "ddim": "DDIMScheduler",
+    "lms": "LMSDiscreteScheduler",
+    "euler": "EulerDiscreteScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+    "dpm": "DPMSolverMultistepScheduler",
+}
+
+
+# 速度の段階ごとの生成設定（解像度・ステップ数・スケジューラー）
+# 最終的なデザインは32x32に縮小されるため、低い解像度で生成しても差は小さい
+SPEED_TIERS = {
+    "quality": {"resolution": 512, "num_steps": 30, "scheduler": None},
+    "balanced": {"resolution": 256, "num_steps": 20, "scheduler": "dpm"},
+    "fast": {"resolution": 128, "num_steps": 10, "scheduler": "dpm"},
+}
+
+
+def _peak_rss_bytes() -> int:
+    """このプロセスの最大常駐メモリ（バイト）"""
+    # Linuxの ru_maxrss はキロバイト単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _progress_kwargs(on_step, total_steps):
+    """進捗の通知をパイプラインのステップごとのコールバック引数に変換する"""
+    if on_step is None:
+        return {}
+
+    def callback(step, timestep, latents):
+        # スケジューラーによっては総ステップ数より1回多く呼ばれるため上限で止める
+        on_step(min(step + 1, total_steps), total_steps)
+
+    return {"callback": callback, "callback_steps": 1}
+
+
+def _generator_kwargs(seeds):
+    """
+    シードを画像ごとの乱数生成器に変換する
+
+    生成器はデバイスによらずCPU上に作るため、同じシードからは同じ初期ノイズになる。
+    バッチ内の画像ごとに別の生成器を使うので、結果はバッチの組み合わせに依存しない。
+    """
+    if seeds is None or all(seed is None for seed in seeds):
+        return {}
+
+    import torch
+
+    generators = []
+    for seed in seeds:
+        generator = torch.Generator("cpu")
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        generators.append(generator)
+    return {"generator": generators}
+
 
 class StableDiffusionGenerator:
-    def __init__(self, model_id="runwayml/stable-diffusion-v1-5"):
-        """Stable Diffusionモデルの初期化"""
+    def __init__(
+        self,
+        model_id="runwayml/stable-diffusion-v1-5",
+        vae_slicing=False,
+        vae_tiling=False,
+        mmap_weights=False,
+        cpu_modes=(),
+        threads=None,
+        interop_threads=None,
+        prompt_cache_size=128,
+    ):
+        """
+        Stable Diffusionモデルの初期化
+
+        vae_slicing はバッチの画像を1枚ずつ、vae_tiling は画像をタイルに分けてデコードし、
+        VAEのデコード時のメモリ使用量を抑える（text2img と img2img の両方に効く）。
+        mmap_weights は UNet・VAE・テキストエンコーダーの重みを safetensors のメモリマップから
+        直接使い、同じモデルを読み込んだ複数のワーカープロセスで重みのメモリを共有する（CPUのみ）。
+        cpu_modes はCPUでの高速化の方法（CPU_MODES の名前の組み合わせ、または "channels_last,bf16"
+        のような文字列）、threads・interop_threads は推論スレッド数（CPUのみ）。
+        prompt_cache_size はプロンプトの埋め込みをキャッシュする件数（0 でキャッシュしない）。
+        """
+        import torch
+        from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionPipeline
+
+        start = time.perf_counter()
+        self.model_id = model_id
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        dtype = torch.float16 if self.device == "cuda" else torch.float32
+        cpu_modes = parse_cpu_modes(cpu_modes) if self.device == "cpu" else ()
+        if self.device == "cpu":
+            configure_threads(threads, interop_threads)
+
+        # GPUでは重みをデバイスにコピーするため、メモリマップは使わない
+        self.mmap_weights = mmap_weights and self.device == "cpu"
+        self.copied_weight_bytes = None
+        components = {}
+        if self.mmap_weights:
+            components, report = load_mmap_components(model_id, dtype)
+            self.copied_weight_bytes = report["copied_bytes"]
 
         # テキストからの画像生成用パイプライン
         self.text2img = StableDiffusionPipeline.from_pretrained(
             model_id,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+            torch_dtype=dtype,
             safety_checker=None,
             requires_safety_checker=False,
+            **components,
         ).to(self.device)
 
         # 画像からの画像生成用パイプライン
-        self.img2img = StableDiffusionImg2ImgPipeline.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            safety_checker=None,
-            requires_safety_checker=False,
-        ).to(self.device)
+        # UNet・VAE・テキストエンコーダーは text2img と共有し、重みを二重に読み込まない
+        # （スケジューラーは生成ごとに状態が変わるため別のインスタンスにする）
+        components = dict(self.text2img.components)
+        components["scheduler"] = self.text2img.scheduler.from_config(
+            self.text2img.scheduler.config
+        )
+        self.img2img = StableDiffusionImg2ImgPipeline(**components, requires_safety_checker=False)
+
+        if vae_slicing:
+            self.text2img.vae.enable_slicing()
+        if vae_tiling:
+            self.text2img.vae.enable_tiling()
+
+        # CPUでの高速化（対応していない方法は除かれる）
+        self.cpu_modes = apply_cpu_modes((self.text2img, self.img2img), cpu_modes)
 
-    def generate_from_text(self, prompt, negative_prompt=None, num_steps=30, guidance_scale=7.5):
+        # テキストエンコーダーの出力のキャッシュ（ネガティブプロンプトなど毎回同じ文字列が多い）
+        self.prompt_cache = PromptEmbeddingCache(prompt_cache_size) if prompt_cache_size else None
+
+        # 起動時のメモリ使用量を記録
+        self.startup_seconds = time.perf_counter() - start
+        self.startup_peak_rss = _peak_rss_bytes()
+
+    def memory_report(self):
+        """コンポーネントごとのパラメータのバイト数と、起動時の最大RSSを返す"""
+        import torch
+
+        components = {}
+        seen = set()
+        total = 0
+        for pipeline in (self.text2img, self.img2img):
+            for name, module in pipeline.components.items():
+                if not isinstance(module, torch.nn.Module):
+                    continue
+                nbytes = sum(p.numel() * p.element_size() for p in module.parameters())
+                components[name] = nbytes
+                # 共有されているパラメータは一度だけ数える
+                for p in module.parameters():
+                    if p.data_ptr() not in seen:
+                        seen.add(p.data_ptr())
+                        total += p.numel() * p.element_size()
+
+        return {
+            "components": components,
+            "total_parameter_bytes": total,
+            # メモリマップの重みのうち、型の変換などでプロセスごとにコピーしたバイト数
+            "mmap_weights": self.mmap_weights,
+            "copied_weight_bytes": self.copied_weight_bytes,
+            "cpu_modes": list(self.cpu_modes),
+            "startup_seconds": self.startup_seconds,
+            "startup_peak_rss_bytes": self.startup_peak_rss,
+        }
+
+    def _with_scheduler(self, pipeline, scheduler):
+        """
+        スケジューラーを差し替えたパイプラインを返す（None の場合はそのまま）
+
+        UNet・VAEなどの重みは共有し、スケジューラーは呼び出しごとに新しく作る。
+        """
+        if scheduler is None:
+            return pipeline
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"不明なスケジューラーです: {scheduler}（{', '.join(SCHEDULERS)} から選択）")
+
+        import diffusers
+
+        components = dict(pipeline.components)
+        components["scheduler"] = getattr(diffusers, SCHEDULERS[scheduler]).from_config(
+            pipeline.scheduler.config
+        )
+        scheduled = type(pipeline)(**components, requires_safety_checker=False)
+        scheduled.set_progress_bar_config(**getattr(pipeline, "_progress_bar_config", {}))
+        return scheduled
+
+    def _prompt_kwargs(self, pipeline, prompts, negative_prompts):
+        """
+        パイプラインに渡すプロンプトの引数（キャッシュを使う場合はプロンプトの埋め込み）
+
+        キャッシュにないプロンプトは1つずつエンコードする。バッチの組み合わせによらず
+        同じプロンプトからは同じ埋め込みになり、シードを指定した生成の再現性を保つ。
+        """
+        if self.prompt_cache is None:
+            return {"prompt": list(prompts), "negative_prompt": list(negative_prompts)}
+
+        import torch
+
+        def encode(texts):
+            with torch.no_grad():
+                return [pipeline.encode_prompt(text, self.device, 1, False)[0][0] for text in texts]
+
+        with span("encode_prompt"):
+            embeds = self.prompt_cache.get_many(
+                self.model_id, list(prompts) + list(negative_prompts), encode
+            )
+        return {
+            "prompt_embeds": torch.stack(embeds[: len(prompts)]),
+            "negative_prompt_embeds": torch.stack(embeds[len(prompts) :]),
+        }
+
+    def generate_from_text(
+        self,
+        prompt,
+        negative_prompt=None,
+        num_steps=30,
+        guidance_scale=7.5,
+        seed=None,
+        scheduler=None,
+        resolution=512,
+        output_size=32,
+    ):
         """テキストプロンプトから画像を生成"""
+        return self.generate_batch_from_text(
+            [prompt],
+            [negative_prompt],
+            num_steps=num_steps,
+            guidance_scale=guidance_scale,
+            seeds=[seed],
+            scheduler=scheduler,
+            resolution=resolution,
+            output_size=output_size,
+        )[0]
+
+    def generate_batch_from_text(
+        self,
+        prompts,
+        negative_prompts=None,
+        num_steps=30,
+        guidance_scale=7.5,
+        on_step=None,
+        seeds=None,
+        scheduler=None,
+        resolution=512,
+        output_size=32,
+    ):
+        """
+        複数のテキストプロンプトから、1回のパイプライン呼び出しでまとめて画像を生成
+
+        on_step を指定すると、拡散の各ステップの後に on_step(完了ステップ数, 総ステップ数) を呼ぶ。
+        seeds（画像ごとのシード）を指定すると、同じシード・同じパラメータからは
+        バッチの組み合わせによらず同じ画像を生成する。scheduler は SCHEDULERS の名前。
+        resolution は生成する画像の一辺の長さ（8の倍数。小さいほど速い）、
+        output_size は返す画像の一辺の長さ（マイデザインのサイズ）。
+        """
+        if negative_prompts is None:
+            negative_prompts = [None] * len(prompts)
+
         try:
-            # 画像生成
-            image = self.text2img(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=num_steps,
-                guidance_scale=guidance_scale,
-            ).images[0]
+            # 画像生成（ネガティブプロンプトなしは空文字列と同じ扱い）
+            with span("inference"), inference_context(self.cpu_modes):
+                images = self._with_scheduler(self.text2img, scheduler)(
+                    **self._prompt_kwargs(
+                        self.text2img, prompts, [negative or "" for negative in negative_prompts]
+                    ),
+                    height=resolution,
+                    width=resolution,
+                    num_inference_steps=num_steps,
+                    guidance_scale=guidance_scale,
+                    **_generator_kwargs(seeds),
+                    **_progress_kwargs(on_step, num_steps),
+                ).images
 
             # 32x32にリサイズ（Animal Crossingのマイデザイン用）
-            image = image.resize((32, 32), Image.LANCZOS)
-
-            return image
+            size = (output_size, output_size)
+            with span("resize"):
+                return [image.resize(size, Image.LANCZOS) for image in images]
 
         except Exception as e:
             print(f"Error generating image from text: {str(e)}")
             raise
 
     def generate_from_image(
-        self, input_image, prompt=None, strength=0.75, num_steps=30, guidance_scale=7.5
+        self,
+        input_image,
+        prompt=None,
+        strength=0.75,
+        num_steps=30,
+        guidance_scale=7.5,
+        seed=None,
+        scheduler=None,
+        resolution=512,
+        output_size=32,
     ):
         """入力画像から新しい画像を生成"""
+        return self.generate_batch_from_image(
+            [input_image],
+            [prompt],
+            strength=strength,
+            num_steps=num_steps,
+            guidance_scale=guidance_scale,
+            seeds=[seed],
+            scheduler=scheduler,
+            resolution=resolution,
+            output_size=output_size,
+        )[0]
+
+    def generate_batch_from_image(
+        self,
+        input_images,
+        prompts=None,
+        strength=0.75,
+        num_steps=30,
+        guidance_scale=7.5,
+        on_step=None,
+        seeds=None,
+        scheduler=None,
+        resolution=512,
+        output_size=32,
+    ):
+        """
+        複数の入力画像から、1回のパイプライン呼び出しでまとめて画像を生成
+
+        on_step・seeds・scheduler・resolution・output_size は generate_batch_from_text と同じ
+        （img2imgの総ステップ数は num_steps * strength）
+        """
+        if prompts is None:
+            prompts = [None] * len(input_images)
+
         try:
-            # 入力画像の前処理
-            if input_image.size != (512, 512):
-                input_image = input_image.resize((512, 512), Image.LANCZOS)
+            # 入力画像の前処理（生成する解像度に合わせる）
+            size = (resolution, resolution)
+            with span("resize"):
+                input_images = [
+                    image if image.size == size else image.resize(size, Image.LANCZOS)
+                    for image in input_images
+                ]
 
             # プロンプトが指定されていない場合のデフォルト
-            if prompt is None:
-                prompt = "pixel art style, Animal Crossing design pattern"
+            prompts = [
+                "pixel art style, Animal Crossing design pattern" if prompt is None else prompt
+                for prompt in prompts
+            ]
 
             # 画像生成
-            image = self.img2img(
-                prompt=prompt,
-                image=input_image,
-                strength=strength,
-                num_inference_steps=num_steps,
-                guidance_scale=guidance_scale,
-            ).images[0]
+            with span("inference"), inference_context(self.cpu_modes):
+                images = self._with_scheduler(self.img2img, scheduler)(
+                    **self._prompt_kwargs(self.img2img, prompts, [""] * len(prompts)),
+                    image=input_images,
+                    strength=strength,
+                    num_inference_steps=num_steps,
+                    guidance_scale=guidance_scale,
+                    **_generator_kwargs(seeds),
+                    **_progress_kwargs(on_step, min(int(num_steps * strength), num_steps)),
+                ).images
 
             # 32x32にリサイズ（Animal Crossingのマイデザイン用）
-            image = image.resize((32, 32), Image.LANCZOS)
-
-            return image
+            size = (output_size, output_size)
+            with span("resize"):
+                return [image.resize(size, Image.LANCZOS) for image in images]
 
         except Exception as e:
             print(f"Error generating image from image: {str(e)}")
@@ -0,0 +1,78 @@
+"""
+近似最近傍探索（app.ml.ann_index）のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_ann [--sizes 10000 100000] [--queries 200] [--k 5]
+
+PCA後の特徴量に似せた合成データ（50次元、クラスタ構造あり）で、索引ごとの構築時間・
+1クエリあたりの検索時間・厳密な探索に対する recall@k を測定する。
+"""
+
+# 標準ライブラリ
+import argparse
+import time
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from app.ml.ann_index import create_index
+
+CONFIGS = [
+    ("ivf", {"n_probe": 1}),
+    ("ivf", {"n_probe": 4}),
+    ("ivf", {"n_probe": 16}),
+    ("lsh", {"n_tables": 8, "n_bits": 12}),
+    ("lsh", {"n_tables": 16, "n_bits": 10}),
+    ("lsh", {"n_tables": 32, "n_bits": 8}),
+]
+
+
+def synthetic_features(n: int, dim: int = 50, seed: int = 0) -> np.ndarray:
+    """クラスタに分かれ、分散が次元ごとに減衰する（PCAの出力に似た）特徴量を作る"""
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(np.arange(1, dim + 1))
+    centers = rng.standard_normal((max(1, n // 200), dim)) * scale * 3
+    return centers[rng.integers(len(centers), size=n)] + rng.standard_normal((n, dim)) * scale
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(np.intersect1d(f, t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def run(sizes, n_queries: int, k: int) -> None:
+    print(f"{'件数':<10}{'索引':<30}{'構築(秒)':>10}{'検索(ms/件)':>14}{'recall@' + str(k):>12}")
+    for n in sizes:
+        features = synthetic_features(n)
+        # 学習データの近くにあるクエリ（既存のデザインに似た入力画像を想定）
+        rng = np.random.default_rng(1)
+        queries = features[rng.choice(n, n_queries, replace=False)]
+        queries = queries + rng.standard_normal(queries.shape) * 0.1
+
+        exact = create_index("exact", n_neighbors=k).fit(features)
+        start = time.perf_counter()
+        _, truth = exact.kneighbors(queries)
+        exact_ms = (time.perf_counter() - start) / n_queries * 1000
+        print(f"{n:<10}{'exact':<30}{'-':>10}{exact_ms:>14.3f}{1.0:>12.3f}")
+
+        for name, params in CONFIGS:
+            start = time.perf_counter()
+            index = create_index(name, n_neighbors=k, **params).fit(features)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            _, found = index.kneighbors(queries)
+            search_ms = (time.perf_counter() - start) / n_queries * 1000
+
+            label = name + " " + " ".join(f"{key}={value}" for key, value in params.items())
+            recall = recall_at_k(found, truth)
+            print(f"{'':<10}{label:<30}{build:>10.2f}{search_ms:>14.3f}{recall:>12.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="近似最近傍探索のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.k)
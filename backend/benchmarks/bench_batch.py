@@ -0,0 +1,50 @@
+"""
+一括変換のスループットのベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_batch [--images 64] [--workers 1 2 4]
+
+合成画像のディレクトリを作り、ワーカー数ごとに iter_batch の処理速度（枚/秒）を測定する。
+"""
+
+# 標準ライブラリ
+import argparse
+import os
+import tempfile
+import time
+
+# ローカルモジュール
+from app.generator.batch import create_executor, iter_batch, iter_directory
+from benchmarks.bench_quantize import synthetic_image
+
+
+def run(n_images: int, image_size: int, worker_counts, method: str) -> None:
+    with tempfile.TemporaryDirectory() as input_dir:
+        for i in range(n_images):
+            synthetic_image(image_size, seed=i).save(os.path.join(input_dir, f"{i:05d}.png"))
+
+        print(f"{n_images}枚（{image_size}x{image_size}）, 手法: {method}")
+        print(f"{'ワーカー数':<10}{'時間(秒)':>10}{'枚/秒':>10}{'失敗':>6}")
+        for workers in worker_counts:
+            with create_executor(workers) as executor:
+                # プロセスの起動時間を測定から除くため、先に1件変換しておく
+                list(iter_batch(list(iter_directory(input_dir))[:workers], executor, workers))
+
+                start = time.perf_counter()
+                results = list(
+                    iter_batch(iter_directory(input_dir), executor, workers, method=method)
+                )
+                elapsed = time.perf_counter() - start
+
+            errors = sum("error" in result for result in results)
+            print(f"{workers:<10}{elapsed:>10.2f}{len(results) / elapsed:>10.1f}{errors:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="一括変換のスループットのベンチマーク")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--method", default="kmeans")
+    args = parser.parse_args()
+    run(args.images, args.image_size, args.workers, args.method)
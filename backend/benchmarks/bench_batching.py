@@ -0,0 +1,61 @@
+"""
+バッチ推論のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_batching [--model-id モデルIDまたはパス] [--batch-sizes 1 2 4 8]
+
+同じ枚数の画像を、1枚ずつ生成した場合とバッチサイズごとにまとめて生成した場合の
+処理速度（枚/秒）を比較する。--model-id を省略した場合はランダムに初期化した
+小さなパイプラインを使う（オフラインで実行可能）。
+"""
+
+# 標準ライブラリ
+import argparse
+import os
+import tempfile
+import time
+
+# ローカルモジュール
+from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+
+
+def run(model_id: str, batch_sizes, n_images: int, num_steps: int) -> None:
+    generator = StableDiffusionGenerator(model_id)
+    generator.text2img.set_progress_bar_config(disable=True)
+    prompts = [f"pixel art flower pattern {i}" for i in range(n_images)]
+
+    # 初回呼び出しの準備時間を測定から除く
+    generator.generate_from_text(prompts[0], num_steps=1)
+
+    print(f"モデル: {model_id}, {n_images}枚, {num_steps}ステップ")
+    print(f"{'バッチサイズ':<12}{'時間(秒)':>10}{'枚/秒':>10}")
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, n_images, batch_size):
+            images = generator.generate_batch_from_text(
+                prompts[i : i + batch_size],
+                ["low quality, bad quality, blurry"] * len(prompts[i : i + batch_size]),
+                num_steps=num_steps,
+            )
+            if any(image.size != (32, 32) for image in images):
+                raise RuntimeError("生成された画像のサイズが 32x32 ではありません")
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:<12}{elapsed:>10.2f}{n_images / elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="バッチ推論のベンチマーク")
+    parser.add_argument("--model-id", help="省略時はランダムに初期化した小さなパイプライン")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.model_id:
+        run(args.model_id, args.batch_sizes, args.images, args.steps)
+    else:
+        from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_id = save_tiny_pipeline(os.path.join(tmp_dir, "tiny-sd"))
+            run(model_id, args.batch_sizes, args.images, args.steps)
@@ -0,0 +1,94 @@
+"""
+CPUでの高速化の方法（cpu_modes）ごとの処理時間と、デザインのずれのベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_cpu_modes [--model-id モデルIDまたはパス]
+        [--modes default channels_last bf16 channels_last,bf16 int8 compile]
+        [--threads 4] [--resolution 256] [--steps 20] [--prompts 4]
+
+方法ごとにモデルを読み込み直し、同じプロンプト・同じシードで画像を生成して、
+初回の呼び出し（compile ではコンパイルを含む）と2回目以降の1枚あたりの処理時間、
+最終的に量子化した32x32のデザインを最初の方法（既定では "default"）のデザインと比べた差
+（RGBの平均絶対誤差とPSNR）を表示する。
+--model-id を省略した場合はランダムに初期化した小さなパイプラインを使う（オフラインで実行可能。
+出力は意味のある絵にならず、ランダムな重みでは数値の誤差が大きく出るため、ずれと処理時間の
+比較は実際のモデルで行う）。
+"""
+
+# 標準ライブラリ
+import argparse
+import os
+import tempfile
+import time
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from app.ml.cpu_acceleration import bf16_supported
+from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+from benchmarks.bench_speed_tiers import PROMPTS, design_array
+
+
+def run(model_id: str, modes, threads, resolution: int, steps: int, n_prompts: int) -> None:
+    prompts = (PROMPTS * n_prompts)[:n_prompts]
+    options = dict(num_steps=steps, resolution=resolution)
+    print(f"モデル: {model_id}, {resolution}px, {steps}ステップ, {n_prompts}枚")
+    print(f"bfloat16 の演算命令: {'あり' if bf16_supported() else 'なし'}")
+    print(f"{'方法':<22}{'初回(秒)':>10}{'秒/枚':>10}{'速度比':>8}{'MAE':>8}{'PSNR(dB)':>10}")
+
+    reference = None
+    reference_seconds = None
+    for mode in modes:
+        generator = StableDiffusionGenerator(model_id, cpu_modes=mode, threads=threads)
+        generator.text2img.set_progress_bar_config(disable=True)
+
+        start = time.perf_counter()
+        generator.generate_from_text(prompts[0], seed=0, **options)
+        first = time.perf_counter() - start
+
+        start = time.perf_counter()
+        images = [
+            generator.generate_from_text(
+                prompt, "low quality, bad quality, blurry", seed=i, **options
+            )
+            for i, prompt in enumerate(prompts)
+        ]
+        seconds = (time.perf_counter() - start) / n_prompts
+
+        designs = [design_array(image) for image in images]
+        if reference is None:
+            reference, reference_seconds = designs, seconds
+
+        mae = np.mean([np.abs(a - b).mean() for a, b in zip(designs, reference)])
+        mse = np.mean([((a - b) ** 2).mean() for a, b in zip(designs, reference)])
+        psnr = "inf" if mse == 0 else f"{10 * np.log10(255**2 / mse):.1f}"
+        applied = ",".join(generator.cpu_modes) or "default"
+        print(
+            f"{applied:<22}{first:>10.2f}{seconds:>10.2f}{reference_seconds / seconds:>8.2f}"
+            f"{mae:>8.1f}{psnr:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPUでの高速化の方法ごとのベンチマーク")
+    parser.add_argument("--model-id", help="省略時はランダムに初期化した小さなパイプライン")
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["default", "channels_last", "bf16", "channels_last,bf16", "int8", "compile"],
+    )
+    parser.add_argument("--threads", type=int, help="推論スレッド数（省略時は torch の既定）")
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--prompts", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.model_id:
+        run(args.model_id, args.modes, args.threads, args.resolution, args.steps, args.prompts)
+    else:
+        from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_id = save_tiny_pipeline(os.path.join(tmp_dir, "tiny-sd"))
+            run(model_id, args.modes, args.threads, args.resolution, args.steps, args.prompts)
@@ -0,0 +1,116 @@
+"""
+最近傍色の参照表（LUT）とディザリングのベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_dither [--sizes 32 128 512] [--palette-size 15] [--repeat 5]
+
+画像サイズごとに次を比較する。
+- 最近傍色: すべてのパレット色との距離を計算する方法と、32^3 の参照表を引く方法
+  （参照表の作成時間と、厳密な結果と一致した画素の割合も表示する）
+- Floyd–Steinberg: 1画素ずつ処理するPythonのループと、波面ごとに配列演算で処理する実装
+  （両者のパレット番号が一致することを確認する）
+- 組織的ディザリング（ベイヤー 4x4 / 8x8）
+"""
+
+# 標準ライブラリ
+import argparse
+import time
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from app.generator.effects import (
+    _cached_lut,
+    build_lut,
+    dither_to_palette,
+    lookup,
+    nearest_colors,
+)
+from app.generator.quantizer import quantize_array
+from benchmarks.bench_quantize import synthetic_image
+
+
+def loop_floyd_steinberg(rgb: np.ndarray, palette: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """1画素ずつ誤差を拡散する従来の実装（比較用）"""
+    height, width = rgb.shape[:2]
+    work = rgb.astype(np.float32).copy()
+    colors = palette.astype(np.float32)
+    labels = np.empty((height, width), dtype=np.intp)
+    for y in range(height):
+        for x in range(width):
+            value = np.clip(work[y, x], 0, 255)
+            index = lookup(lut, value)
+            labels[y, x] = index
+            error = value - colors[index]
+            if x + 1 < width:
+                work[y, x + 1] += error * (7 / 16)
+            if y + 1 < height:
+                if x > 0:
+                    work[y + 1, x - 1] += error * (3 / 16)
+                work[y + 1, x] += error * (5 / 16)
+                if x + 1 < width:
+                    work[y + 1, x + 1] += error * (1 / 16)
+    return labels
+
+
+def best_time(func, repeat: int):
+    """最速の実行時間（ミリ秒）と最後の結果を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def run(sizes, palette_size: int, repeat: int) -> None:
+    print(f"{'サイズ':<8}{'処理':<34}{'時間(ms)':>12}{'備考':>16}")
+    for size in sizes:
+        rgba = np.array(synthetic_image(size, seed=size))
+        _, palette, _ = quantize_array(rgba, palette_size, "median_cut")
+        rgb = rgba[..., :3].astype(np.float32)
+        opaque = np.ones((size, size), dtype=bool)
+        pixels = rgb.reshape(-1, 3)
+
+        def row(label: str, ms: float, note: str = "") -> None:
+            print(f"{size:<8}{label:<34}{ms:>12.2f}{note:>16}")
+
+        ms, exact = best_time(lambda: nearest_colors(pixels, palette), repeat)
+        row("最近傍色（全パレットとの距離）", ms)
+
+        def fresh_lut():
+            _cached_lut.cache_clear()
+            return build_lut(palette)
+
+        ms, lut = best_time(fresh_lut, repeat)
+        row("LUT の作成（32^3）", ms)
+        ms, labels = best_time(lambda: lookup(lut, pixels), repeat)
+        row("最近傍色（LUT）", ms, f"一致 {np.mean(labels == exact):.1%}")
+
+        for color_space in ("rgb", "lab"):
+            ms, _ = best_time(
+                lambda: dither_to_palette(rgb, opaque, palette, "floyd_steinberg", color_space),
+                repeat,
+            )
+            row(f"Floyd–Steinberg 波面（{color_space}）", ms)
+
+        # 1画素ずつのループは遅いので、大きな画像では1回だけ測る
+        ms, loop_labels = best_time(
+            lambda: loop_floyd_steinberg(rgb, palette, lut), 1 if size > 128 else repeat
+        )
+        wavefront = dither_to_palette(rgb, opaque, palette, "floyd_steinberg")
+        row("Floyd–Steinberg 画素ループ", ms, f"一致 {np.mean(loop_labels == wavefront):.1%}")
+
+        for dither in ("bayer4", "bayer8"):
+            ms, _ = best_time(lambda: dither_to_palette(rgb, opaque, palette, dither), repeat)
+            row(f"組織的ディザリング（{dither}）", ms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LUTとディザリングのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 128, 512])
+    parser.add_argument("--palette-size", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.palette_size, args.repeat)
@@ -0,0 +1,100 @@
+"""
+学習用画像の読み込み（DesignGenerator.train）のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_ingest [--sizes 1000 5000 20000] [--workers 1 4]
+
+合成した画像を一時ディレクトリに書き出し、枚数とワーカー数ごとに train(full=True) の
+処理速度（枚/秒）と最大RSS（親プロセスと、最も大きいワーカープロセス）を測定する。
+最大RSSが他の計測の影響を受けないよう、計測は1回ずつ新しいプロセスで実行する。
+--memmap-mb を小さくすると、少ない枚数でもメモリマップを使う経路を確認できる。
+"""
+
+# 標準ライブラリ
+import argparse
+import json
+import os
+import resource
+import subprocess  # nosec B404 - 計測用の子プロセスとしてこのスクリプト自身を起動する
+import sys
+import tempfile
+import time
+
+# サードパーティ
+import numpy as np
+from PIL import Image
+
+
+def write_corpus(directory: str, n_images: int, size: int = 48) -> None:
+    """グラデーションとノイズの画像を n_images 枚書き出す"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size] / (size - 1)
+    for i in range(n_images):
+        tint = rng.uniform(0, 255, 3)
+        rgb = np.stack([x, y, 1 - x], axis=-1) * tint + rng.normal(0, 16, (size, size, 3))
+        image = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+        image.save(os.path.join(directory, f"design_{i}.png"))
+
+
+def measure_child(training_dir: str, workers: int, memmap_mb: float) -> dict:
+    from app.ml import design_generator
+    from app.ml.design_generator import DesignGenerator
+
+    design_generator.MEMMAP_BYTES = int(memmap_mb * 2**20)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generator = DesignGenerator(
+            training_dir, index_path=os.path.join(tmp_dir, "index.npz"), workers=workers
+        )
+        start = time.perf_counter()
+        generator.train(full=True)
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss はLinuxではKB単位
+    return {
+        "images": len(generator.images),
+        "seconds": elapsed,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "worker_peak_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+    }
+
+
+def measure(training_dir: str, workers: int, memmap_mb: float) -> dict:
+    """計測を新しいプロセスで実行する"""
+    output = subprocess.run(  # nosec B603 - シェルを使わず、このスクリプト自身を子プロセスとして起動する
+        [
+            sys.executable, "-m", "benchmarks.bench_ingest", "--child", training_dir,
+            "--workers", str(workers), "--memmap-mb", str(memmap_mb),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout  # fmt: skip
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(sizes, workers_list, memmap_mb: float) -> None:
+    print(f"{'枚数':<10}{'ワーカー':>8}{'枚/秒':>10}{'最大RSS(MB)':>14}{'ワーカーRSS(MB)':>18}")
+    for n_images in sizes:
+        with tempfile.TemporaryDirectory() as training_dir:
+            write_corpus(training_dir, n_images)
+            for workers in workers_list:
+                report = measure(training_dir, workers, memmap_mb)
+                print(
+                    f"{n_images:<10}{workers:>8}{report['images'] / report['seconds']:>10.0f}"
+                    f"{report['peak_rss_bytes'] / 2**20:>14.1f}"
+                    f"{report['worker_peak_rss_bytes'] / 2**20:>18.1f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="学習用画像の読み込みのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--memmap-mb", type=float, default=256)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_child(args.child, args.workers[0], args.memmap_mb)))
+    else:
+        run(args.sizes, args.workers, args.memmap_mb)
@@ -0,0 +1,102 @@
+"""
+StableDiffusionGenerator の起動時メモリのベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_memory [--model-id モデルIDまたはパス]
+
+コンポーネントを共有する現在の読み込み方と、text2img/img2img を別々に from_pretrained する
+従来の読み込み方を、それぞれ新しいプロセスで実行して起動時間・最大RSS・パラメータ量を比較する。
+--model-id を省略した場合はランダムに初期化した小さなパイプラインを使う（オフラインで実行可能）。
+"""
+
+# 標準ライブラリ
+import argparse
+import json
+import os
+import subprocess  # nosec B404 - 計測用の子プロセスとしてこのスクリプト自身を起動する
+import sys
+import tempfile
+import time
+
+
+def load_separately(model_id: str) -> dict:
+    """従来の方法（パイプラインごとに from_pretrained）で読み込む"""
+    import torch
+    from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionPipeline
+
+    from app.ml.stable_diffusion_generator import _peak_rss_bytes
+
+    start = time.perf_counter()
+    pipelines = [
+        cls.from_pretrained(model_id, safety_checker=None, requires_safety_checker=False)
+        for cls in (StableDiffusionPipeline, StableDiffusionImg2ImgPipeline)
+    ]
+    startup_seconds = time.perf_counter() - start
+
+    total = sum(
+        p.numel() * p.element_size()
+        for pipeline in pipelines
+        for module in pipeline.components.values()
+        if isinstance(module, torch.nn.Module)
+        for p in module.parameters()
+    )
+    return {
+        "total_parameter_bytes": total,
+        "startup_seconds": startup_seconds,
+        "startup_peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def load_shared(model_id: str) -> dict:
+    """現在の StableDiffusionGenerator で読み込む"""
+    from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+
+    return StableDiffusionGenerator(model_id).memory_report()
+
+
+def measure(mode: str, model_id: str) -> dict:
+    """計測を新しいプロセスで実行し、最大RSSが他の計測の影響を受けないようにする"""
+    output = subprocess.run(  # nosec B603 - シェルを使わず、このスクリプト自身を子プロセスとして起動する
+        [sys.executable, "-m", "benchmarks.bench_memory", "--model-id", model_id, "--child", mode],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(model_id: str) -> None:
+    results = {mode: measure(mode, model_id) for mode in ("separate", "shared")}
+
+    print(f"モデル: {model_id}")
+    print(f"{'読み込み方':<12}{'起動(秒)':>10}{'最大RSS(MB)':>14}{'パラメータ(MB)':>16}")
+    for mode, report in results.items():
+        print(
+            f"{mode:<12}{report['startup_seconds']:>10.2f}"
+            f"{report['startup_peak_rss_bytes'] / 2**20:>14.1f}"
+            f"{report['total_parameter_bytes'] / 2**20:>16.1f}"
+        )
+
+    components = results["shared"].get("components", {})
+    if components:
+        print("コンポーネントごとのパラメータ(MB):")
+        for name, nbytes in components.items():
+            print(f"  {name:<14}{nbytes / 2**20:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="起動時メモリのベンチマーク")
+    parser.add_argument("--model-id", help="省略時はランダムに初期化した小さなパイプライン")
+    parser.add_argument("--child", choices=["separate", "shared"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        loader = load_shared if args.child == "shared" else load_separately
+        print(json.dumps(loader(args.model_id)))
+    elif args.model_id:
+        run(args.model_id)
+    else:
+        from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(save_tiny_pipeline(os.path.join(tmp_dir, "tiny-sd")))
@@ -0,0 +1,122 @@
+"""
+壁画モード（複数タイルのデザイン）のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_mural [--grids 4x3 8x8 16x16] [--workers 1 4] [--source-size 8000]
+
+グリッドごとに次を比較する。
+- タイルごと: 画像をタイルに切り分けて1枚ずつ convert_image で変換する従来の方法
+  （タイルごとに別のパレットになる）
+- 壁画: convert_mural で共通のパレットを1回だけ求め、タイルをまとめて割り当てる
+また、source-size x source-size のJPEGを読み込むときの最大RSSを、画像全体をデコードする
+場合と load_mural_image で縮小しながら読み込む場合で比較する（計測ごとに新しいプロセス）。
+"""
+
+# 標準ライブラリ
+import argparse
+import json
+import os
+import resource
+import subprocess  # nosec B404 - 計測用の子プロセスとしてこのスクリプト自身を起動する
+import sys
+import tempfile
+import time
+
+# サードパーティ
+from PIL import Image
+
+# ローカルモジュール
+from app.generator.mural import convert_mural, load_mural_image
+from app.generator.pixel_generator import convert_image
+from benchmarks.bench_quantize import synthetic_image
+
+
+def per_tile(image: Image.Image, columns: int, rows: int, tile_size: int) -> set:
+    """タイルを1枚ずつ変換し、使われたパレットの集合を返す"""
+    mural = load_mural_image(image, columns * tile_size, rows * tile_size)
+    palettes = set()
+    for row in range(rows):
+        for column in range(columns):
+            left, top = column * tile_size, row * tile_size
+            tile = mural.crop((left, top, left + tile_size, top + tile_size))
+            design_data = convert_image(tile, size=tile_size, compact=True)
+            palettes.add(tuple(tuple(c.values()) for c in design_data["palette"]))
+    return palettes
+
+
+def measure_child(path: str, mode: str, size: int) -> dict:
+    if mode == "write":
+        synthetic_image(size, seed=1).convert("RGB").save(path, quality=90)
+        return {}
+
+    start = time.perf_counter()
+    if mode == "full":
+        with Image.open(path) as image:
+            image.convert("RGBA").resize((size, size), Image.LANCZOS)
+    else:
+        load_mural_image(path, size, size)
+    # ru_maxrss はLinuxではKB単位
+    return {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def measure(path: str, mode: str, size: int) -> dict:
+    """計測を新しいプロセスで実行する"""
+    output = subprocess.run(  # nosec B603 - シェルを使わず、このスクリプト自身を子プロセスとして起動する
+        [
+            sys.executable, "-m", "benchmarks.bench_mural", "--child", path,
+            "--mode", mode, "--mural-size", str(size),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout  # fmt: skip
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(grids, workers_list, tile_size: int, source_size: int, dither: str) -> None:
+    image = synthetic_image(1024, seed=0)
+    print(f"{'グリッド':<10}{'処理':<24}{'時間(秒)':>10}{'パレット数':>12}")
+    for grid in grids:
+        columns, rows = (int(n) for n in grid.split("x"))
+
+        start = time.perf_counter()
+        palettes = per_tile(image, columns, rows, tile_size)
+        elapsed = time.perf_counter() - start
+        print(f"{grid:<10}{'タイルごと（従来）':<24}{elapsed:>10.2f}{len(palettes):>12}")
+
+        for workers in workers_list:
+            start = time.perf_counter()
+            convert_mural(image, columns, rows, tile_size, dither=dither, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{grid:<10}{f'壁画 workers={workers}':<24}{elapsed:>10.2f}{1:>12}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "source.jpg")
+        # 大きな画像の作成で計測側のプロセスのRSSが増えないよう、作成も別プロセスで行う
+        measure(path, "write", source_size)
+        print(f"\n{source_size}x{source_size} のJPEGを 512x512 の壁画に読み込む")
+        print(f"{'方法':<24}{'時間(秒)':>10}{'最大RSS(MB)':>14}")
+        for mode, label in (("full", "全体をデコード"), ("mural", "load_mural_image")):
+            report = measure(path, mode, 512)
+            print(f"{label:<24}{report['seconds']:>10.2f}{report['peak_rss_bytes'] / 2**20:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="壁画モードのベンチマーク")
+    parser.add_argument("--grids", nargs="+", default=["4x3", "8x8", "16x16"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--tile-size", type=int, default=32)
+    parser.add_argument("--source-size", type=int, default=8000)
+    parser.add_argument("--dither", default="none")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="mural", help=argparse.SUPPRESS)
+    parser.add_argument("--mural-size", type=int, default=512, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_child(args.child, args.mode, args.mural_size)))
+    else:
+        run(args.grids, args.workers, args.tile_size, args.source_size, args.dither)
@@ -0,0 +1,72 @@
+"""
+デザイン画像のエンコード（サイズと処理時間）のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_png [--sizes 32 64 128] [--repeat 200]
+
+量子化したデザインを、従来のRGBAのPNGとパレットモード（P）のPNG（圧縮レベル別）で
+エンコードしたときのバイト数・base64にしたときのバイト数・1回あたりの処理時間を比較する。
+元画像をそのままPNGで返す場合と、サムネイルのJPEGで返す場合も比較する。
+"""
+
+# 標準ライブラリ
+import argparse
+import base64
+import io
+import time
+from functools import partial
+
+# ローカルモジュール
+from app.generator.pixel_generator import design_to_png, quantize_design
+from benchmarks.bench_quantize import synthetic_image
+
+
+def rgba_png(image, **options) -> bytes:
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", **options)
+    return buffered.getvalue()
+
+
+def jpeg_thumbnail(image, size: int = 256) -> bytes:
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((size, size))
+    buffered = io.BytesIO()
+    thumbnail.save(buffered, format="JPEG", quality=85)
+    return buffered.getvalue()
+
+
+def measure(encode, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = encode()
+    return data, (time.perf_counter() - start) / repeat
+
+
+def report(label: str, data: bytes, seconds: float) -> None:
+    encoded = len(base64.b64encode(data))
+    print(f"  {label:<28}{len(data):>10}{encoded:>12}{seconds * 1e6:>12.0f}")
+
+
+def run(sizes, repeat: int) -> None:
+    print(f"  {'形式':<28}{'バイト':>10}{'base64':>12}{'時間(µs)':>12}")
+    for size in sizes:
+        preview, design = quantize_design(synthetic_image(256, seed=size), size, 15)
+        print(f"{size}x{size} のデザイン（15色）")
+        report("RGBA PNG（従来）", *measure(lambda: rgba_png(preview), repeat))
+        report("RGBA PNG optimize", *measure(lambda: rgba_png(preview, optimize=True), repeat))
+        for level in (6, 9):
+            encode = partial(design_to_png, design, compress_level=level)
+            report(f"パレットPNG level={level}", *measure(encode, repeat))
+
+    original = synthetic_image(1024, seed=0).convert("RGB")
+    print("元画像（1024x1024）")
+    report("PNG（従来）", *measure(lambda: rgba_png(original), max(1, repeat // 50)))
+    report("JPEG サムネイル 256px", *measure(lambda: jpeg_thumbnail(original), max(1, repeat // 50)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="デザイン画像のエンコードのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
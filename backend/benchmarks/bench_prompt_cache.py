@@ -0,0 +1,99 @@
+"""
+プロンプトの埋め込みのキャッシュのベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_prompt_cache [--model-id モデルIDまたはパス] [--requests 8]
+
+キャッシュなし（prompt_cache_size=0）とキャッシュありで、テキストからの生成と画像からの生成を
+requests 回ずつ実行し、テキストエンコーダーを通した回数（キャッシュのミス）と、1回あたりの
+プロンプトのエンコード時間（キャッシュありのみ。design_stage_seconds の encode_prompt）・
+生成全体の時間を表示する。
+テキストからの生成は毎回異なるプロンプトと共通のネガティブプロンプト、画像からの生成は
+既定のプロンプトを使う（API と同じ）。キャッシュの有無で生成される画像が同じことも確認する。
+--model-id を省略した場合はランダムに初期化した小さなパイプラインを使う（テキストエンコーダーが
+小さいため、実際のモデルより差は小さい）。
+"""
+
+# 標準ライブラリ
+import argparse
+import os
+import tempfile
+import time
+
+# サードパーティ
+import numpy as np
+from PIL import Image
+
+# ローカルモジュール
+from app.core.metrics import STAGE_SECONDS
+from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+from benchmarks.bench_speed_tiers import PROMPTS
+
+NEGATIVE_PROMPT = "low quality, bad quality, blurry"
+
+
+def encode_seconds() -> float:
+    """これまでに記録したプロンプトのエンコード時間の合計（秒）"""
+    return sum(
+        value
+        for name, labels, value in STAGE_SECONDS.samples()
+        if name.endswith("_sum") and labels.get("stage") == "encode_prompt"
+    )
+
+
+def run(model_id: str, n_requests: int, resolution: int, steps: int) -> None:
+    source = Image.new("RGB", (resolution, resolution), (200, 80, 60))
+    options = dict(num_steps=steps, resolution=resolution)
+    print(f"モデル: {model_id}, {n_requests}回, {resolution}px, {steps}ステップ")
+    print(f"{'キャッシュ':<10}{'生成':<8}{'エンコード回数':>14}{'エンコード(ms/回)':>18}{'生成(秒/回)':>14}")
+
+    outputs = {}
+    for cache_size in (0, 128):
+        generator = StableDiffusionGenerator(model_id, prompt_cache_size=cache_size)
+        generator.text2img.set_progress_bar_config(disable=True)
+        generator.img2img.set_progress_bar_config(disable=True)
+        label = "あり" if cache_size else "なし"
+
+        for kind in ("text", "image"):
+            misses = generator.prompt_cache.misses if cache_size else 0
+            encoded = encode_seconds()
+            start = time.perf_counter()
+            images = []
+            for i in range(n_requests):
+                if kind == "text":
+                    prompt = f"{PROMPTS[i % len(PROMPTS)]} {i}"
+                    image = generator.generate_from_text(prompt, NEGATIVE_PROMPT, seed=i, **options)
+                else:
+                    image = generator.generate_from_image(source, seed=i, **options)
+                images.append(np.asarray(image))
+            seconds = (time.perf_counter() - start) / n_requests
+
+            # キャッシュなしでは1回の生成でプロンプトとネガティブプロンプトをエンコードする
+            encodes = generator.prompt_cache.misses - misses if cache_size else 2 * n_requests
+            encode_ms = (
+                f"{(encode_seconds() - encoded) / n_requests * 1000:.2f}" if cache_size else "-"
+            )
+            print(f"{label:<10}{kind:<8}{encodes:>14}{encode_ms:>18}{seconds:>14.3f}")
+            outputs.setdefault(kind, []).append(images)
+
+    for kind, (without_cache, with_cache) in outputs.items():
+        same = all(np.array_equal(a, b) for a, b in zip(without_cache, with_cache))
+        print(f"{kind}: キャッシュの有無で同じ画像 {'はい' if same else 'いいえ'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="プロンプトの埋め込みのキャッシュのベンチマーク")
+    parser.add_argument("--model-id", help="省略時はランダムに初期化した小さなパイプライン")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--resolution", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.model_id:
+        run(args.model_id, args.requests, args.resolution, args.steps)
+    else:
+        from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_id = save_tiny_pipeline(os.path.join(tmp_dir, "tiny-sd"))
+            run(model_id, args.requests, args.resolution, args.steps)
@@ -0,0 +1,113 @@
+"""
+色の量子化のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_quantize [--image 画像パス] [--repeat 3]
+
+32x32・64x64・フル解像度の入力で各クラスタリング手法の処理時間を比較し、
+"kmeans" については従来のピクセル単位ループ実装と出力が一致するかも確認する。
+"""
+
+# 標準ライブラリ
+import argparse
+import time
+from typing import Optional
+
+# サードパーティ
+import numpy as np
+from PIL import Image
+from sklearn.cluster import KMeans
+
+# ローカルモジュール
+from app.generator.quantizer import QUANTIZERS, quantize_array
+
+
+def legacy_quantize(img_array: np.ndarray, palette_size: int):
+    """
+    ベクトル化前の quantize_colors の実装（比較用）
+
+    quantize_array と同じく (量子化した配列, パレット, ラベル) を返す。
+    ラベルは各ピクセルのパレット番号（平坦化した順序、透明ピクセルは -1）。
+    """
+    original_shape = img_array.shape
+    pixels = img_array.reshape(-1, original_shape[2])
+    if original_shape[2] == 4:
+        rgb_pixels = pixels[pixels[:, 3] > 128][:, :3]
+    else:
+        rgb_pixels = pixels[:, :3]
+
+    kmeans = KMeans(n_clusters=palette_size, random_state=0).fit(rgb_pixels)
+    colors = kmeans.cluster_centers_.astype(int)
+
+    labels = kmeans.predict(pixels[:, :3])
+    quantized_pixels = np.zeros_like(pixels)
+
+    for i in range(len(pixels)):
+        if original_shape[2] == 4 and pixels[i, 3] <= 128:
+            quantized_pixels[i] = [0, 0, 0, 0]
+        else:
+            quantized_pixels[i, :3] = colors[labels[i]]
+            if original_shape[2] == 4:
+                quantized_pixels[i, 3] = pixels[i, 3]
+
+    if original_shape[2] == 4:
+        labels = np.where(pixels[:, 3] > 128, labels, -1)
+
+    return quantized_pixels.reshape(original_shape), colors, labels
+
+
+def synthetic_image(size: int, seed: int = 0) -> Image.Image:
+    """グラデーションとノイズ、透明な角を持つRGBAのテスト画像を作る"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / max(size - 1, 1)
+    rgb = np.stack([x, y, 1 - (x + y) / 2], axis=-1) * 255
+    rgb += rng.normal(0, 12, rgb.shape)
+    alpha = np.where((x < 0.15) & (y < 0.15), 0, 255)
+    rgba = np.dstack([np.clip(rgb, 0, 255), alpha]).astype(np.uint8)
+    return Image.fromarray(rgba)
+
+
+def time_call(func, repeat: int) -> float:
+    """最速の実行時間（ミリ秒）を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(image_path: Optional[str], repeat: int, palette_size: int) -> None:
+    if image_path:
+        full = Image.open(image_path).convert("RGBA")
+    else:
+        full = synthetic_image(512)
+
+    inputs = [
+        ("32x32", full.resize((32, 32), Image.LANCZOS)),
+        ("64x64", full.resize((64, 64), Image.LANCZOS)),
+        (f"{full.width}x{full.height}", full),
+    ]
+
+    print(f"{'入力':<12}{'手法':<14}{'時間(ms)':>12}  備考")
+    for label, image in inputs:
+        img_array = np.array(image)
+
+        for method in QUANTIZERS:
+            elapsed = time_call(lambda: quantize_array(img_array, palette_size, method), repeat)
+            print(f"{label:<12}{method:<14}{elapsed:>12.1f}")
+
+        legacy_ms = time_call(lambda: legacy_quantize(img_array, palette_size), 1)
+        expected, expected_colors, _ = legacy_quantize(img_array, palette_size)
+        actual, colors, _ = quantize_array(img_array, palette_size, "kmeans")
+        parity = np.array_equal(expected, actual) and np.array_equal(expected_colors, colors)
+        print(f"{label:<12}{'legacy':<14}{legacy_ms:>12.1f}  一致: {'OK' if parity else 'NG'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="色の量子化のベンチマーク")
+    parser.add_argument("--image", help="フル解像度として使う画像（省略時は512x512の合成画像）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--palette-size", type=int, default=15)
+    args = parser.parse_args()
+    run(args.image, args.repeat, args.palette_size)
@@ -0,0 +1,94 @@
+"""
+速度の段階（SPEED_TIERS）ごとの品質と処理時間のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_speed_tiers [--model-id モデルIDまたはパス] [--prompts 4]
+
+同じプロンプト・同じシードで各段階の画像を生成し、1枚あたりの処理時間と、最終的に
+量子化した32x32のデザインを最初の段階（既定では "quality"）のデザインと比べた差
+（RGBの平均絶対誤差とPSNR）を表示する。途中の512pxなどの画像ではなく、ユーザーに届くデザインの差を測る。
+--model-id を省略した場合はランダムに初期化した小さなパイプラインを使う（オフラインで実行可能。
+出力は意味のある絵にならないため、処理時間の比較だけに使う）。
+"""
+
+# 標準ライブラリ
+import argparse
+import os
+import tempfile
+import time
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from app.generator.pixel_generator import quantize_colors
+from app.ml.stable_diffusion_generator import SPEED_TIERS, StableDiffusionGenerator
+
+PROMPTS = [
+    "pixel art red flower pattern",
+    "pixel art blue sea wave pattern",
+    "pixel art green tree pattern",
+    "pixel art yellow star pattern",
+]
+
+
+def design_array(image, palette_size: int = 15) -> np.ndarray:
+    """生成画像を15色に量子化した32x32のデザイン（RGB）にする"""
+    quantized, _ = quantize_colors(image.convert("RGBA"), palette_size)
+    return np.asarray(quantized, dtype=np.float64)[:, :, :3]
+
+
+def run(model_id: str, tiers, n_prompts: int, vae_slicing: bool) -> None:
+    generator = StableDiffusionGenerator(model_id, vae_slicing=vae_slicing)
+    generator.text2img.set_progress_bar_config(disable=True)
+    prompts = (PROMPTS * n_prompts)[:n_prompts]
+
+    designs = {}
+    print(f"モデル: {model_id}, {n_prompts}枚")
+    print(f"{'段階':<10}{'解像度':>8}{'ステップ':>10}{'秒/枚':>10}{'MAE':>8}{'PSNR(dB)':>10}")
+    for name in tiers:
+        tier = SPEED_TIERS[name]
+        # 初回呼び出しの準備時間を測定から除く
+        generator.generate_from_text(prompts[0], num_steps=1, resolution=tier["resolution"])
+
+        start = time.perf_counter()
+        images = [
+            generator.generate_from_text(
+                prompt,
+                "low quality, bad quality, blurry",
+                num_steps=tier["num_steps"],
+                seed=i,
+                scheduler=tier["scheduler"],
+                resolution=tier["resolution"],
+            )
+            for i, prompt in enumerate(prompts)
+        ]
+        seconds = (time.perf_counter() - start) / n_prompts
+        designs[name] = [design_array(image) for image in images]
+
+        reference = designs[tiers[0]]
+        mae = np.mean([np.abs(a - b).mean() for a, b in zip(designs[name], reference)])
+        mse = np.mean([((a - b) ** 2).mean() for a, b in zip(designs[name], reference)])
+        psnr = "inf" if mse == 0 else f"{10 * np.log10(255**2 / mse):.1f}"
+        print(
+            f"{name:<10}{tier['resolution']:>8}{tier['num_steps']:>10}"
+            f"{seconds:>10.2f}{mae:>8.1f}{psnr:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="速度の段階ごとの品質と処理時間のベンチマーク")
+    parser.add_argument("--model-id", help="省略時はランダムに初期化した小さなパイプライン")
+    parser.add_argument("--tiers", nargs="+", choices=list(SPEED_TIERS), default=list(SPEED_TIERS))
+    parser.add_argument("--prompts", type=int, default=4)
+    parser.add_argument("--vae-slicing", action="store_true")
+    args = parser.parse_args()
+
+    if args.model_id:
+        run(args.model_id, args.tiers, args.prompts, args.vae_slicing)
+    else:
+        from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_id = save_tiny_pipeline(os.path.join(tmp_dir, "tiny-sd"))
+            run(model_id, args.tiers, args.prompts, args.vae_slicing)
@@ -0,0 +1,88 @@
+"""
+テキスト検索（DesignGenerator.search_text）のベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_text_search [--sizes 1000 10000 100000] [--queries 100]
+
+合成した説明文の件数ごとに、1件ずつのプロンプトとまとめたプロンプトの検索時間を測定する。
+--legacy-max 以下の件数では、説明文を1件ずつベクトル化していた従来の実装とも比較する。
+"""
+
+# 標準ライブラリ
+import argparse
+import time
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from app.ml.design_generator import DesignGenerator
+
+WORDS = [
+    "flower", "tree", "star", "heart", "fish", "bird", "cat", "dog", "leaf", "apple",
+    "red", "blue", "green", "yellow", "pink", "white", "black", "stripe", "dot", "check",
+    "kimono", "dress", "shirt", "flag", "sign", "floor", "wall", "sky", "sea", "moon",
+]  # fmt: skip
+
+
+def build_generator(n_images: int, seed: int = 0) -> DesignGenerator:
+    """画像を読み込まずに、合成した説明文だけでテキスト検索用の索引を作る"""
+    rng = np.random.default_rng(seed)
+    generator = DesignGenerator()
+    generator.images = [f"design_{i}.png" for i in range(n_images)]
+    generator.image_descriptions = {
+        path: " ".join(rng.choice(WORDS, size=3)) for path in generator.images
+    }
+    generator.description_matrix = generator.tfidf.fit_transform(
+        [generator.image_descriptions[path] for path in generator.images]
+    ).tocsr()
+    generator.is_trained = True
+    return generator
+
+
+def legacy_search(generator: DesignGenerator, text_prompt: str, k: int = 3):
+    """ベクトル化前の generate_from_text の検索部分（比較用）"""
+    prompt_features = generator.tfidf.transform([text_prompt]).toarray()
+    similarities = []
+    for img_path in generator.images:
+        desc = generator.image_descriptions[img_path]
+        desc_features = generator.tfidf.transform([desc]).toarray()
+        similarities.append(np.dot(prompt_features, desc_features.T)[0][0])
+    return np.argsort(similarities)[-k:][::-1]
+
+
+def run(sizes, n_queries: int, legacy_max: int) -> None:
+    rng = np.random.default_rng(1)
+    prompts = [" ".join(rng.choice(WORDS, size=2)) for _ in range(n_queries)]
+
+    print(f"{'画像数':<10}{'1件ずつ(ms/件)':>16}{'まとめて(ms/件)':>16}{'従来(ms/件)':>14}")
+    for n_images in sizes:
+        generator = build_generator(n_images)
+
+        start = time.perf_counter()
+        for prompt in prompts:
+            generator.search_text([prompt])
+        single = (time.perf_counter() - start) / n_queries * 1000
+
+        start = time.perf_counter()
+        generator.search_text(prompts)
+        batched = (time.perf_counter() - start) / n_queries * 1000
+
+        legacy = "-"
+        if n_images <= legacy_max:
+            # 従来の実装は遅いので、数件だけ測定する
+            start = time.perf_counter()
+            for prompt in prompts[:3]:
+                legacy_search(generator, prompt)
+            legacy = f"{(time.perf_counter() - start) / 3 * 1000:.2f}"
+
+        print(f"{n_images:<10}{single:>16.2f}{batched:>16.2f}{legacy:>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="テキスト検索のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--legacy-max", type=int, default=10000)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.legacy_max)
@@ -0,0 +1,114 @@
+"""
+複数のワーカープロセスで重みを共有したときのメモリのベンチマーク
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.bench_workers [--model-id モデルIDまたはパス] [--workers 1 2 4]
+
+ワーカー数ごとに、StableDiffusionGenerator を読み込んで1枚生成したプロセスを同時に起動し、
+重みをワーカーごとに読み込む場合（従来）と safetensors のメモリマップで共有する場合（mmap）で、
+各ワーカーのRSS・USS（そのプロセスだけが使うメモリ）・PSS と、全ワーカーのPSSの合計を比較する。
+全ワーカーのPSSの合計が、マシン全体で実際に使われたメモリにあたる。
+従来の読み込みで重みがコピーされるかどうかは diffusers・accelerate の版とモデルの形式
+（.bin や fp16 の別版では必ずコピーされる）によって変わるため、実際の環境で確認する。
+--model-id を省略した場合はランダムに初期化した小さなパイプラインを使う（重みが数MBのため、
+差は重みの大きさの分だけになる。SD 1.5 の float32 では重みがコピーされる場合1ワーカーあたり約4GB）。
+最後に、このマシンでの recommend_workers の結果を表示する。
+"""
+
+# 標準ライブラリ
+import argparse
+import json
+import os
+import subprocess  # nosec B404 - 計測用の子プロセスとしてこのスクリプト自身を起動する
+import sys
+import tempfile
+import time
+
+# ローカルモジュール
+from app.core.workers import memory_usage, model_weight_bytes, recommend_workers
+from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+
+def child(model_id: str, mmap_weights: bool) -> None:
+    """モデルを読み込んで1枚生成し、親プロセスが標準入力を閉じるまで待つ"""
+    from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+
+    start = time.perf_counter()
+    generator = StableDiffusionGenerator(model_id, mmap_weights=mmap_weights)
+    generator.text2img.set_progress_bar_config(disable=True)
+    generator.generate_from_text("pixel art flower", num_steps=2, seed=0, resolution=64)
+    print(json.dumps({"load_seconds": time.perf_counter() - start}), flush=True)
+    sys.stdin.read()
+
+
+def measure(model_id: str, workers: int, mmap_weights: bool) -> list:
+    """workers 個のワーカーを同時に動かし、それぞれのメモリ使用量を返す"""
+    command = [sys.executable, "-m", "benchmarks.bench_workers", "--child", model_id]
+    if mmap_weights:
+        command.append("--mmap")
+    processes = [
+        subprocess.Popen(  # nosec B603 - シェルを使わず、このスクリプト自身を子プロセスとして起動する
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        for _ in range(workers)
+    ]
+    try:
+        reports = [json.loads(p.stdout.readline()) for p in processes]
+        # すべてのワーカーが読み込みを終えてから測る（PSSは同時に動いているプロセス数で変わる）
+        for process, report in zip(processes, reports):
+            report.update(memory_usage(process.pid))
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+    return reports
+
+
+def run(model_id: str, workers_list) -> None:
+    weight_bytes = model_weight_bytes(model_id)
+    print(f"モデル: {model_id}（重み {weight_bytes / 2**20:.1f}MB）")
+    print(
+        f"{'ワーカー数':<10}{'読み込み':<10}{'RSS(MB)':>10}{'USS(MB)':>10}"
+        f"{'PSS(MB)':>10}{'PSS合計(MB)':>14}{'読込(秒)':>10}"
+    )
+    for workers in workers_list:
+        for mmap_weights in (False, True):
+            reports = measure(model_id, workers, mmap_weights)
+
+            def mean(key):
+                return sum(r[key] for r in reports) / len(reports)
+
+            print(
+                f"{workers:<10}{'mmap' if mmap_weights else '従来':<10}"
+                f"{mean('rss') / 2**20:>10.1f}{mean('uss') / 2**20:>10.1f}"
+                f"{mean('pss') / 2**20:>10.1f}{sum(r['pss'] for r in reports) / 2**20:>14.1f}"
+                f"{mean('load_seconds'):>10.2f}"
+            )
+
+    plan = recommend_workers(weight_bytes)
+    print(
+        f"\nrecommend_workers: {plan['workers']}ワーカー x {plan['threads_per_worker']}スレッド"
+        f"（コア数 {plan['cores']}, 空きメモリ {plan['memory_bytes'] / 2**30:.1f}GB, "
+        f"上限: {plan['limited_by']}）"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ワーカー間での重みの共有のベンチマーク")
+    parser.add_argument("--model-id")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--mmap", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.mmap)
+    elif args.model_id:
+        run(args.model_id, args.workers)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(save_tiny_pipeline(os.path.join(tmp_dir, "tiny_sd")), args.workers)
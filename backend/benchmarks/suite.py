@@ -0,0 +1,400 @@
+"""
+性能の回帰を検出するオフラインのベンチマーク一式（CIでも実行する）
+
+実行方法（backend ディレクトリで）:
+    python -m benchmarks.suite [--output results.json] [--baseline benchmarks/baseline.json]
+                               [--threshold 0.25] [--only pixel_art load_test] [--runs 1]
+                               [--update-baseline]
+
+ネットワーク接続やモデルのダウンロードは不要で、次の項目を計測する。
+- pixel_art: 合成画像を generate_pixel_art でデザインに変換する（手法・ディザリング別）
+- mural: 合成画像を convert_mural で 8x8 枚の壁画に変換する
+- design_generator: 合成画像のコーパスで DesignGenerator を学習し、画像・テキストから生成する
+- diffusion: ランダムに初期化した小さなパイプラインを StableDiffusionGenerator で読み込んで生成する
+- load_test: FastAPI のアプリを ASGI で直接呼び出し、同時に届く生成リクエストと壁画の変換を処理する
+
+計測値はすべて秒（小さいほど良い）で、繰り返した中央値を JSON に書き出す。マシンの速さの違いを
+打ち消すため、各値はケースの前後で測った calibration（決まった量のnumpyの計算）との比で
+ベースラインと比べ、比が threshold を超えて悪化した項目があれば終了コード 1 で終了する。
+ベースラインは --update-baseline --runs 3 で書き直す（性能が変わる変更と同じコミットで更新する）。
+"""
+
+# 標準ライブラリ
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List
+
+# サードパーティ
+import numpy as np
+
+# ローカルモジュール
+from benchmarks.bench_ingest import write_corpus
+from benchmarks.bench_quantize import synthetic_image
+from benchmarks.tiny_pipeline import save_tiny_pipeline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# これより短い差は計測の揺らぎとして回帰に数えない（秒）
+MIN_DIFF_SECONDS = 0.005
+
+PROMPTS = ["red flower pattern", "blue sea wave", "green tree", "yellow star"]
+
+# load_test を同じプロセスで呼んだ回数（main の結果キャッシュは --runs の間も残るため、
+# プロンプトに含めて毎回キャッシュにない生成にする）
+_load_test_runs = itertools.count()
+
+
+def median_seconds(func: Callable, repeat: int) -> float:
+    """func を repeat 回実行した時間の中央値（秒）"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def png_bytes(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def calibrate(repeat: int) -> float:
+    """マシンの速さの目安（行列積とソートの時間の中央値、秒）"""
+    rng = np.random.default_rng(0)
+    a = rng.random((256, 256))
+    b = rng.random(1 << 18)
+
+    def work():
+        for _ in range(8):
+            a @ a
+        np.sort(b)
+
+    return median_seconds(work, repeat * 5)
+
+
+def bench_pixel_art(work_dir: str, repeat: int) -> Dict[str, float]:
+    from app.generator.pixel_generator import generate_pixel_art
+
+    path = os.path.join(work_dir, "pixel_art.png")
+    synthetic_image(256, seed=0).save(path)
+    results = {}
+    for method in ("kmeans", "median_cut"):
+        results[method] = median_seconds(
+            lambda: generate_pixel_art(input_path=path, method=method, compact=True), repeat
+        )
+    for dither in ("floyd_steinberg", "bayer4"):
+        results[dither] = median_seconds(
+            lambda: generate_pixel_art(input_path=path, dither=dither, compact=True), repeat
+        )
+    return results
+
+
+def bench_mural(work_dir: str, repeat: int) -> Dict[str, float]:
+    from app.generator.mural import convert_mural
+
+    image = synthetic_image(1024, seed=1)
+    return {
+        "8x8": median_seconds(lambda: convert_mural(image, 8, 8, workers=1), repeat),
+        "8x8_floyd_steinberg": median_seconds(
+            lambda: convert_mural(image, 8, 8, dither="floyd_steinberg", workers=1), repeat
+        ),
+    }
+
+
+def bench_design_generator(work_dir: str, repeat: int) -> Dict[str, float]:
+    from app.ml.design_generator import DesignGenerator
+
+    training_dir = os.path.join(work_dir, "training_images")
+    os.makedirs(training_dir, exist_ok=True)
+    write_corpus(training_dir, 300)
+    query = os.path.join(work_dir, "query.png")
+    synthetic_image(64, seed=2).save(query)
+
+    def train():
+        index_path = os.path.join(work_dir, "design_index.npz")
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        generator = DesignGenerator(training_dir, index_path=index_path, workers=1)
+        generator.train(full=True)
+        return generator
+
+    results = {"train_300": median_seconds(train, repeat)}
+    generator = train()
+    results["from_image"] = median_seconds(lambda: generator.generate_from_image(query), repeat)
+    results["from_text"] = median_seconds(
+        lambda: generator.generate_batch_from_text(PROMPTS), repeat
+    )
+    return results
+
+
+def bench_diffusion(work_dir: str, repeat: int) -> Dict[str, float]:
+    from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+
+    model_path = save_tiny_pipeline(os.path.join(work_dir, "tiny_sd"))
+    start = time.perf_counter()
+    generator = StableDiffusionGenerator(model_path)
+    results = {"load": time.perf_counter() - start}
+    generator.text2img.set_progress_bar_config(disable=True)
+    generator.img2img.set_progress_bar_config(disable=True)
+    options = dict(num_steps=4, seed=0, resolution=64)
+
+    # 初回呼び出しの準備時間を測定から除く
+    generator.generate_from_text(PROMPTS[0], num_steps=1, resolution=64)
+    results["from_text"] = median_seconds(
+        lambda: generator.generate_from_text(PROMPTS[0], **options), repeat
+    )
+    results["batch_from_text_4"] = median_seconds(
+        lambda: generator.generate_batch_from_text(
+            PROMPTS, [None] * len(PROMPTS), num_steps=4, seeds=[0] * len(PROMPTS), resolution=64
+        ),
+        repeat,
+    )
+    image = synthetic_image(64, seed=3)
+    results["from_image"] = median_seconds(
+        lambda: generator.generate_from_image(image, PROMPTS[0], **options), repeat
+    )
+    return results
+
+
+def bench_load_test(work_dir: str, repeat: int, concurrency: int = 4) -> Dict[str, float]:
+    """
+    アプリを ASGI で直接呼び出す負荷試験
+
+    main は環境変数を読み込み時に参照するため、小さなパイプライン・一時ディレクトリ・
+    速い段階（fast）を環境変数で指定してから読み込む。ログも一時ディレクトリに書く。
+    """
+    import httpx
+
+    model_path = save_tiny_pipeline(os.path.join(work_dir, "tiny_sd"))
+    os.environ.update(
+        MODEL_ID=model_path,
+        MODEL_WARMUP="false",
+        DEFAULT_SPEED="fast",
+        UPLOAD_DIR=os.path.join(work_dir, "uploads"),
+        OUTPUT_DIR=os.path.join(work_dir, "outputs"),
+    )
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    mural_png = png_bytes(synthetic_image(512, seed=4))
+    run_id = next(_load_test_runs)
+
+    async def generate(client, prompt):
+        start = time.perf_counter()
+        response = await client.post("/api/generate/from-text", data={"prompt": prompt})
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    async def mural(client):
+        response = await client.post(
+            "/api/convert/mural",
+            files={"file": ("mural.png", mural_png, "image/png")},
+            data={"columns": "4", "rows": "4"},
+        )
+        response.raise_for_status()
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=600
+        ) as client:
+            # 最初のリクエストでモデルを読み込む（起動直後の応答時間として別に記録する。
+            # 2回目以降の呼び出しではモデルは読み込み済み）
+            start = time.perf_counter()
+            await generate(client, f"warm up {run_id}")
+            cold_start = time.perf_counter() - start
+
+            # concurrency 件ずつ同時に送る（同じ内容のリクエストは結果キャッシュに当たるため、
+            # 呼び出しごと・回ごとにプロンプトを変える）
+            latencies = []
+            start = time.perf_counter()
+            for i in range(repeat):
+                prompts = [f"{p} {run_id}-{i}" for p in (PROMPTS * concurrency)[:concurrency]]
+                latencies += await asyncio.gather(*(generate(client, p) for p in prompts))
+            per_request = (time.perf_counter() - start) / len(latencies)
+
+            mural_seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await mural(client)
+                mural_seconds.append(time.perf_counter() - start)
+
+            (await client.get("/metrics")).raise_for_status()
+
+        # 計測した生成がすべてキャッシュにない生成だったことを確かめる
+        stats = main.result_cache.stats()
+        if stats["memory_hits"] + stats["disk_hits"]:
+            raise RuntimeError("load_test の生成リクエストが結果キャッシュに当たりました")
+
+        return {
+            "cold_start": cold_start,
+            "from_text_p50": float(np.percentile(latencies, 50)),
+            "from_text_p95": float(np.percentile(latencies, 95)),
+            "from_text_seconds_per_request": per_request,
+            "mural_4x4": statistics.median(mural_seconds),
+        }
+
+    return asyncio.run(run())
+
+
+CASES: Dict[str, Callable[[str, int], Dict[str, float]]] = {
+    "pixel_art": bench_pixel_art,
+    "mural": bench_mural,
+    "design_generator": bench_design_generator,
+    "diffusion": bench_diffusion,
+    "load_test": bench_load_test,
+}
+
+# マシンの速さに左右されにくい初回の読み込み時間などは、比較の対象から外す
+UNCOMPARED = {("diffusion", "load"), ("load_test", "cold_start")}
+
+
+def environment() -> Dict[str, str]:
+    import PIL
+    import torch
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "torch": torch.__version__,
+    }
+
+
+def run_cases(names: List[str], repeat: int, runs: int = 1) -> Dict[str, Dict[str, float]]:
+    """
+    指定したケースを runs 回ずつ実行し、ケースごとの計測値（各回の中央値）を返す
+
+    CPUのクロックは実行中にも変わるため、calibration はケースごとに前後で測って平均する
+    （"calibration" にケース名 -> 秒 で記録する）。ベースラインの更新など、揺らぎを
+    抑えたい場合は runs を増やす。
+    """
+    samples: Dict[str, Dict[str, List[float]]] = {"calibration": {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for run in range(runs):
+            for name in names:
+                print(f"{name} を計測中...（{run + 1}/{runs}）", file=sys.stderr)
+                case_dir = os.path.join(work_dir, name)
+                os.makedirs(case_dir, exist_ok=True)
+                # 小さなパイプラインはケース間で共有する
+                if name in ("diffusion", "load_test"):
+                    case_dir = work_dir
+                before = calibrate(repeat)
+                for metric, seconds in CASES[name](case_dir, repeat).items():
+                    samples.setdefault(name, {}).setdefault(metric, []).append(seconds)
+                after = calibrate(repeat)
+                samples["calibration"].setdefault(name, []).append((before + after) / 2)
+
+    return {
+        case: {metric: statistics.median(values) for metric, values in metrics.items()}
+        for case, metrics in samples.items()
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    calibration との比でベースラインと比べ、結果の表を表示して回帰した項目の一覧を返す
+
+    Parameters:
+    -----------
+    results, baseline : dict
+        run_cases の結果を含む JSON（"results" キー）
+    threshold : float
+        許容する悪化の割合（0.25 なら 25% まで）
+
+    Returns:
+    --------
+    list of str
+        回帰した項目（"ケース.項目"）
+    """
+    calibration = results["results"]["calibration"]
+    base_calibration = baseline["results"]["calibration"]
+
+    regressions = []
+    print(f"{'項目':<44}{'ベースライン(秒)':>16}{'今回(秒)':>12}{'比':>8}")
+    for case, metrics in results["results"].items():
+        if case == "calibration":
+            continue
+        for metric, seconds in metrics.items():
+            name = f"{case}.{metric}"
+            base = baseline["results"].get(case, {}).get(metric)
+            if base is None:
+                print(f"{name:<44}{'-':>16}{seconds:>12.4f}{'new':>8}")
+                continue
+            # ベースラインの値を、このケースを測ったときのマシンの速さに換算してから比べる
+            expected = base * calibration[case] / base_calibration[case]
+            ratio = seconds / expected if expected > 0 else 1.0
+            status = ""
+            if (case, metric) not in UNCOMPARED and ratio > 1 + threshold:
+                if seconds - expected > MIN_DIFF_SECONDS:
+                    regressions.append(name)
+                    status = "  回帰"
+            print(f"{name:<44}{expected:>16.4f}{seconds:>12.4f}{ratio:>8.2f}{status}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="性能の回帰を検出するベンチマーク一式")
+    parser.add_argument("--output", help="結果を書き出す JSON のパス")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=1, help="ケースを繰り返す回数（中央値を使う）")
+    parser.add_argument("--only", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    # diffusers の非推奨の警告で結果の表が読みにくくならないようにする
+    warnings.filterwarnings("ignore", category=FutureWarning)
+
+    results = {
+        "environment": environment(),
+        "repeat": args.repeat,
+        "runs": args.runs,
+        "results": run_cases(args.only, args.repeat, args.runs),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"ベースラインを更新: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"ベースラインがありません: {args.baseline}（--update-baseline で作成）")
+        return 1
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{args.threshold:.0%} を超えて遅くなった項目: {', '.join(regressions)}")
+        return 1
+    print("\n回帰はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+オフラインのベンチマーク用に、ランダムに初期化した小さなStable Diffusionパイプラインを作る
+
+save_tiny_pipeline(path) で from_pretrained 形式のディレクトリを書き出すので、
+StableDiffusionGenerator(model_id=path) でそのまま読み込める（ネットワーク接続は不要）。
+"""
+
+# 標準ライブラリ
+import json
+import os
+import tempfile
+
+# サードパーティ
+import torch
+from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+
+def _byte_chars():
+    """CLIPのバイトレベルBPEが使う256個の文字（GPT-2の bytes_to_unicode と同じ対応）"""
+    printable = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    chars = []
+    extra = 0
+    for b in range(256):
+        if b in printable:
+            chars.append(chr(b))
+        else:
+            chars.append(chr(256 + extra))
+            extra += 1
+    return chars
+
+
+def _write_tokenizer_files(path: str) -> None:
+    """1文字ずつに分割するだけの最小のBPE語彙を書き出す"""
+    chars = _byte_chars()
+    tokens = ["<|startoftext|>", "<|endoftext|>"] + chars + [f"{c}</w>" for c in chars]
+    with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump({token: i for i, token in enumerate(tokens)}, f, ensure_ascii=False)
+    with open(os.path.join(path, "merges.txt"), "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+
+
+def build_tiny_pipeline(seed: int = 0) -> StableDiffusionPipeline:
+    """ランダムに初期化した小さなパイプラインを作る（出力は64x64）"""
+    torch.manual_seed(seed)
+
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 64),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+        latent_channels=4,
+    )
+
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        _write_tokenizer_files(tokenizer_dir)
+        tokenizer = CLIPTokenizer(
+            os.path.join(tokenizer_dir, "vocab.json"),
+            os.path.join(tokenizer_dir, "merges.txt"),
+            model_max_length=77,
+        )
+
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            bos_token_id=0,
+            eos_token_id=1,
+            pad_token_id=1,
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            vocab_size=len(tokenizer),
+        )
+    )
+    scheduler = PNDMScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        skip_prk_steps=True,
+        steps_offset=1,
+    )
+
+    return StableDiffusionPipeline(
+        unet=unet,
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+def save_tiny_pipeline(path: str, seed: int = 0) -> str:
+    """小さなパイプラインを from_pretrained 形式で保存し、そのパスを返す"""
+    if not os.path.exists(os.path.join(path, "model_index.json")):
+        build_tiny_pipeline(seed).save_pretrained(path)
+    return path
@@ -1,19 +1,61 @@
 # 標準ライブラリ
+import asyncio
 import os
-from typing import Optional
+import resource
+import time
+from typing import List, Optional
 import base64
 import io
+import json
 
 # サードパーティ
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    UploadFile,
+    File,
+    Form,
+    BackgroundTasks,
+    Depends,
+    Query,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from starlette.routing import Match
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, validator
 from PIL import Image
 
 # ローカルモジュール
-from app.ml.stable_diffusion_generator import StableDiffusionGenerator
+from app.ml.cpu_acceleration import parse_cpu_modes, supported_cpu_modes
+from app.ml.stable_diffusion_generator import SCHEDULERS, SPEED_TIERS, StableDiffusionGenerator
+from app.generator.batch import create_executor, iter_batch
+from app.generator.effects import COLOR_SPACES, DITHERS, parse_hex_colors
+from app.generator.mural import convert_mural
+from app.generator.quantizer import QUANTIZERS
+from app.generator.pixel_generator import (
+    design_to_png,
+    encode_design_data,
+    quantize_design,
+    resize_image,
+)
 from app.core.logger import setup_logger
+from app.core.cache import ResultCache, make_cache_key
+from app.core.model_loader import ModelLoader
+from app.core.inference_queue import InferenceQueue, QueueFullError
+from app.core.batcher import MicroBatcher
+from app.core.job_store import JobStore
+from app.core.image_ingest import ImageRejected, decode_image, read_upload
+from app.core.metrics import (
+    collect_spans,
+    current_trace,
+    merge_spans,
+    registry,
+    span,
+    start_trace,
+)
+from app.core.workers import memory_usage
 
 # ロガーの設定
 logger = setup_logger("app")
@@ -30,23 +72,282 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 一時ファイル保存用のディレクトリ
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
-OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outputs")
+# 一時ファイル保存用のディレクトリ（ベンチマークなどでは環境変数で別の場所を指定できる）
+UPLOAD_DIR = os.getenv(
+    "UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+)
+OUTPUT_DIR = os.getenv(
+    "OUTPUT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "outputs")
+)
 
 # ディレクトリが存在しない場合は作成
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# 画像生成モデルのインスタンスを作成
-generator = StableDiffusionGenerator()
+# アップロード画像の上限（バイト数・画素数）と、デコード後の最大辺の長さ
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "20")) * 1024 * 1024
+# 一括変換（/api/convert/batch）のリクエスト全体の上限（1枚ごとの上限は MAX_UPLOAD_BYTES）
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_MB", "500")) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", "1024"))
+ALLOWED_IMAGE_TYPES = os.getenv("ALLOWED_IMAGE_TYPES", "jpg,jpeg,png").split(",")
+# レスポンスに含める元画像のサムネイルの最大辺の長さ
+ORIGINAL_PREVIEW_SIZE = int(os.getenv("ORIGINAL_PREVIEW_SIZE", "256"))
+
+
+@app.middleware("http")
+async def reject_large_uploads(request, call_next):
+    """
+    Content-Length が上限を超えるリクエストは、本文を受信する前に断る
+
+    複数の画像を送る一括変換は MAX_BATCH_UPLOAD_BYTES、それ以外は MAX_UPLOAD_BYTES を上限にする。
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        limit = (
+            MAX_BATCH_UPLOAD_BYTES if request.url.path == "/api/convert/batch" else MAX_UPLOAD_BYTES
+        )
+        # multipartの境界やフォーム項目の分として少し余裕を持たせる
+        if int(content_length) > limit + 64 * 1024:
+            return JSONResponse({"detail": "Request body too large"}, status_code=413)
+    return await call_next(request)
+
+
+# トレースを記録しないパス（監視用のエンドポイント）
+UNTRACED_PATHS = ("/metrics", "/health/live", "/health/ready")
+
+
+def route_path(request) -> str:
+    """リクエストに一致したルートのパス（/api/jobs/{job_id} など。ラベルの種類を増やさない）"""
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    """リクエストごとの所要時間と段階ごとのスパンを記録し、構造化したログを1行書く"""
+    if request.url.path in UNTRACED_PATHS:
+        return await call_next(request)
+
+    trace = start_trace()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = route_path(request)
+    REQUEST_SECONDS.observe(elapsed, route=route, status=str(response.status_code))
+    record = {
+        "event": "request",
+        "method": request.method,
+        "route": route,
+        "status": response.status_code,
+        "seconds": round(elapsed, 4),
+        "spans": {stage: round(seconds, 4) for stage, seconds in trace.items()},
+    }
+    logger.info(json.dumps(record, ensure_ascii=False))
+    return response
+
+
+async def ingest_upload(file: UploadFile):
+    """アップロードを上限付きで読み出し、縮小デコードした画像と元のバイト列を返す"""
+    try:
+        with span("upload"):
+            contents = await read_upload(file, MAX_UPLOAD_BYTES)
+        with span("decode"):
+            input_image = await run_in_threadpool(
+                decode_image, contents, MAX_IMAGE_PIXELS, MAX_IMAGE_SIZE, ALLOWED_IMAGE_TYPES
+            )
+    except ImageRejected as e:
+        logger.warning(f"アップロードを拒否: {file.filename}: {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return contents, input_image
+
+
+# 画像生成モデル（起動時にバックグラウンドで、または最初の生成リクエストで読み込む）
+MODEL_ID = os.getenv("MODEL_ID", "runwayml/stable-diffusion-v1-5")
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+# VAEのデコードを1枚ずつ（slicing）・タイルごと（tiling）に行い、メモリ使用量を抑える
+VAE_SLICING = os.getenv("VAE_SLICING", "false").lower() in ("1", "true", "yes")
+VAE_TILING = os.getenv("VAE_TILING", "false").lower() in ("1", "true", "yes")
+# 重みを safetensors のメモリマップから使い、同じマシンの複数のワーカーでメモリを共有する
+MMAP_WEIGHTS = os.getenv("MMAP_WEIGHTS", "false").lower() in ("1", "true", "yes")
+# CPUでの高速化の方法（"channels_last,bf16" など。app.ml.cpu_acceleration.CPU_MODES）と推論スレッド数
+CPU_MODES = os.getenv("CPU_MODES", "")
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0")) or None
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "0")) or None
+# 生成結果のキーに使うモデルの識別子。bf16・int8 などは出力を変えるため、このCPUで実際に
+# 使う高速化の方法を含める（指定がなければ MODEL_ID のまま）
+CACHE_MODEL_ID = MODEL_ID + "".join(
+    f"+cpu:{mode}" for mode in supported_cpu_modes(parse_cpu_modes(CPU_MODES))
+)
+# プロンプトの埋め込み（テキストエンコーダーの出力）をキャッシュする件数（0 でキャッシュしない）
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "128"))
+# speed を指定しないリクエストの速度の段階
+DEFAULT_SPEED = os.getenv("DEFAULT_SPEED", "quality")
+
+
+def load_generator() -> StableDiffusionGenerator:
+    logger.info(f"モデルの読み込みを開始: {MODEL_ID}")
+    model = StableDiffusionGenerator(
+        MODEL_ID,
+        vae_slicing=VAE_SLICING,
+        vae_tiling=VAE_TILING,
+        mmap_weights=MMAP_WEIGHTS,
+        cpu_modes=CPU_MODES,
+        threads=TORCH_THREADS,
+        interop_threads=TORCH_INTEROP_THREADS,
+        prompt_cache_size=PROMPT_CACHE_SIZE,
+    )
+    logger.info(f"モデルのメモリ使用量: {model.memory_report()}")
+    return model
+
+
+generator = ModelLoader(load_generator)
+
+
+@app.on_event("startup")
+def warm_up_generator():
+    if MODEL_WARMUP:
+        generator.start_background()
+
+
+# 生成結果のキャッシュ（メモリのLRUと OUTPUT_DIR/cache 以下のファイル）
+result_cache = ResultCache(
+    os.path.join(OUTPUT_DIR, "cache"),
+    max_memory_bytes=int(os.getenv("RESULT_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    max_disk_bytes=int(os.getenv("RESULT_CACHE_DISK_MB", "1024")) * 1024 * 1024,
+)
+
+# 推論を実行する専用のワーカーと、上限付きの待ち行列（上限を超えたリクエストは503で断る）
+inference_queue = InferenceQueue(
+    workers=int(os.getenv("INFERENCE_WORKERS", "1")),
+    max_pending=int(os.getenv("INFERENCE_QUEUE_SIZE", "8")),
+)
+
+# 生成ジョブのメタデータ（SQLite）。期限が切れたジョブと出力は定期的に削除する
+job_store = JobStore(
+    os.path.join(OUTPUT_DIR, "jobs.sqlite3"),
+    ttl_seconds=float(os.getenv("JOB_TTL_HOURS", "24")) * 3600,
+)
+JOB_CLEANUP_INTERVAL = int(os.getenv("JOB_CLEANUP_INTERVAL_SECONDS", "600"))
+job_tasks = set()
+
+# 一括変換用のプロセスプール（最初の一括変換リクエストで作成）
+batch_executor = None
+
+
+def get_batch_executor():
+    global batch_executor
+    if batch_executor is None:
+        batch_executor = create_executor()
+    return batch_executor
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    for task in job_tasks:
+        task.cancel()
+    inference_queue.shutdown()
+    if batch_executor is not None:
+        batch_executor.shutdown(cancel_futures=True)
 
 
 class DesignOptions(BaseModel):
-    size: int = 32  # Animal Crossingのデザインサイズ（通常は32x32）
-    palette_size: int = 15  # 使用する色数（Animal Crossingは最大15色）
+    size: int = Field(32, ge=8, le=128)  # Animal Crossingのデザインサイズ（通常は32x32）
+    palette_size: int = Field(15, ge=1, le=15)  # 使用する色数（Animal Crossingは最大15色）
     style: str = "pixel"  # 変換スタイル
     prompt: Optional[str] = None  # 追加のプロンプト
+    # 速度の段階（quality: 512px, balanced: 256px, fast: 128px。ステップ数なども段階ごとに決まる）
+    speed: str = DEFAULT_SPEED
+    num_steps: Optional[int] = Field(None, ge=1, le=100)  # 拡散のステップ数（省略時は段階の既定）
+    # 乱数のシード（指定すると同じパラメータから同じデザインを再現できる。省略時はリクエストの内容から決まる）
+    seed: Optional[int] = Field(None, ge=0, lt=2**32)
+    scheduler: Optional[str] = None  # スケジューラー（省略時は段階の既定）
+    dither: str = "none"  # ディザリング（style が pixel のとき。floyd_steinberg, ordered など）
+    color_space: str = "rgb"  # 減色に使う色空間（rgb または知覚的な色差に近い lab）
+    # 使える色の一覧（"#RRGGBB"。ゲーム内の色などに合わせる場合に指定）
+    target_palette: Optional[List[str]] = Field(None, min_items=1, max_items=256)
+
+    @validator("speed")
+    def check_speed(cls, value):
+        if value not in SPEED_TIERS:
+            raise ValueError(f"speed は {', '.join(SPEED_TIERS)} のいずれかです")
+        return value
+
+    @validator("scheduler")
+    def check_scheduler(cls, value):
+        if value is not None and value not in SCHEDULERS:
+            raise ValueError(f"scheduler は {', '.join(SCHEDULERS)} のいずれかです")
+        return value
+
+    @validator("dither")
+    def check_dither(cls, value):
+        if value not in DITHERS:
+            raise ValueError(f"dither は {', '.join(DITHERS)} のいずれかです")
+        return value
+
+    @validator("color_space")
+    def check_color_space(cls, value):
+        if value not in COLOR_SPACES:
+            raise ValueError(f"color_space は {', '.join(COLOR_SPACES)} のいずれかです")
+        return value
+
+    @validator("target_palette")
+    def check_target_palette(cls, value):
+        if value is not None:
+            parse_hex_colors(value)
+        return value
+
+
+def design_options(
+    options: Optional[str] = Form(None),
+    size: Optional[int] = Form(None),
+    palette_size: Optional[int] = Form(None),
+    style: Optional[str] = Form(None),
+    prompt: Optional[str] = Form(None),
+    speed: Optional[str] = Form(None),
+    num_steps: Optional[int] = Form(None),
+    seed: Optional[int] = Form(None),
+    scheduler: Optional[str] = Form(None),
+    dither: Optional[str] = Form(None),
+    color_space: Optional[str] = Form(None),
+    target_palette: Optional[List[str]] = Form(None),
+) -> DesignOptions:
+    """
+    マルチパートのフォームからデザインのオプションを読む
+
+    options に DesignOptions のJSON文字列を送るか、各項目を同じ名前のフォーム項目として送る
+    （両方ある場合は個別の項目が優先。target_palette は項目を色の数だけ繰り返す）。
+    指定のない項目は DesignOptions の既定値になる。
+    """
+    try:
+        values = json.loads(options) if options else {}
+    except ValueError:
+        raise HTTPException(status_code=422, detail="options はJSONのオブジェクトで指定します")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=422, detail="options はJSONのオブジェクトで指定します")
+
+    fields = dict(
+        size=size,
+        palette_size=palette_size,
+        style=style,
+        prompt=prompt,
+        speed=speed,
+        num_steps=num_steps,
+        seed=seed,
+        scheduler=scheduler,
+        dither=dither,
+        color_space=color_space,
+        target_palette=target_palette,
+    )
+    values.update({name: value for name, value in fields.items() if value is not None})
+    try:
+        return DesignOptions(**values)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
 
 
 @app.get("/")
@@ -54,43 +355,506 @@ def read_root():
     return {"message": "Welcome to Animal Crossing Design Generator API"}
 
 
-def image_to_base64(image: Image.Image) -> str:
+@app.get("/health/live")
+def liveness():
+    """プロセスが応答できるかどうか（モデルの読み込み状態には依存しない）"""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def readiness():
+    """モデルの読み込みが完了し、生成リクエストを処理できるかどうか"""
+    status = generator.status()
+    return JSONResponse(status, status_code=200 if generator.is_ready else 503)
+
+
+def server_timing(timings: dict) -> str:
+    """処理段階ごとの所要時間（秒）を Server-Timing ヘッダーの値（ミリ秒）にする"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+async def build_design(image: Image.Image, options: DesignOptions):
+    """生成結果をデザインのサイズ・色数に量子化し、プレビュー画像とデザインデータを返す"""
+    target_palette = options.target_palette and parse_hex_colors(options.target_palette)
+
+    def quantize(image: Image.Image):
+        with span("resize"):
+            if image.size != (options.size, options.size):
+                image = resize_image(image, options.size)
+        with span("quantize"):
+            return quantize_design(
+                image,
+                options.size,
+                options.palette_size,
+                options.style,
+                dither=options.dither,
+                color_space=options.color_space,
+                target_palette=target_palette,
+            )
+
+    return await run_in_threadpool(quantize, image)
+
+
+def image_to_base64(image: Image.Image, format: str = "PNG", **save_options) -> str:
     """PIL Imageをbase64文字列に変換"""
     buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
+    image.save(buffered, format=format, **save_options)
     return base64.b64encode(buffered.getvalue()).decode()
 
 
+def thumbnail_base64(image: Image.Image) -> str:
+    """元画像を ORIGINAL_PREVIEW_SIZE 以下に縮小したJPEGのdata URLにする"""
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((ORIGINAL_PREVIEW_SIZE, ORIGINAL_PREVIEW_SIZE), Image.LANCZOS)
+    return f"data:image/jpeg;base64,{image_to_base64(thumbnail, 'JPEG', quality=85)}"
+
+
+def save_design(design_id: str, png: bytes, design: dict) -> None:
+    """パレットPNGとデザインデータを OUTPUT_DIR に保存する（/designs/{design_id} で取得できる）"""
+    with open(design_output_path(design_id), "wb") as f:
+        f.write(png)
+    with open(design_data_path(design_id), "w") as f:
+        json.dump(encode_design_data(design), f)
+
+
+async def design_response(
+    kind: str,
+    design: dict,
+    key: str,
+    seed: int,
+    response_format: str,
+    original: Optional[Image.Image] = None,
+    body: Optional[dict] = None,
+) -> Response:
+    """
+    デザインを指定された形式のレスポンスにする
+
+    json: パレットPNGをbase64で埋め込み、デザインデータも返す
+    png: パレットPNGをそのまま本文で返す（生成キーとシードはヘッダーで返す）
+    url: 保存して取得用のURLを返す（ジョブと同じく JOB_TTL_HOURS 後に削除される）
+    original を指定すると、json・url の場合に元画像のサムネイルを含める。
+    各段階の所要時間（記録中のスパン）を Server-Timing ヘッダーで返す。
+    """
+    headers = {"X-Generation-Key": key, "X-Seed": str(seed)}
+    with span("encode"):
+        png = design_to_png(design)
+
+    if response_format == "png":
+        headers["Server-Timing"] = server_timing(current_trace())
+        return Response(png, media_type="image/png", headers=headers)
+
+    body = dict(body or {})
+    with span("encode"):
+        if original is not None:
+            body["original_image"] = thumbnail_base64(original)
+        if response_format == "url":
+
+            def store() -> str:
+                design_id = job_store.create(kind)
+                save_design(design_id, png, design)
+                job_store.update(design_id, status="done")
+                return design_id
+
+            # SQLite とファイルへの書き込みはスレッドプールで行う
+            design_id = await run_in_threadpool(store)
+            body["generated_image_url"] = f"/designs/{design_id}"
+            body["design_url"] = f"/designs/{design_id}/data"
+        else:
+            body["generated_image"] = f"data:image/png;base64,{base64.b64encode(png).decode()}"
+            body["design"] = encode_design_data(design)
+        body.update(generation_key=key, seed=seed)
+
+    # JSONへの変換は別の段階として測る（ヘッダーに含めるため、レスポンスの作成前に行う）
+    with span("serialize"):
+        content = JSONResponse(body).body
+    headers["Server-Timing"] = server_timing(current_trace())
+    return Response(content, media_type="application/json", headers=headers)
+
+
+async def generate_with_cache(cache_key: str, generate) -> Image.Image:
+    """
+    キャッシュに結果があればモデルを実行せずに返し、なければ生成して保存する
+
+    キャッシュの読み書き（ディスクへのアクセスとPNGへの変換）はスレッドプールで行う。
+    """
+    cached = await run_in_threadpool(result_cache.get, cache_key)
+    if cached is not None:
+        logger.info(f"キャッシュから生成結果を返します: {cache_key[:12]}")
+        return Image.open(io.BytesIO(cached))
+
+    image = await generate()
+
+    def store():
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG")
+        result_cache.put(cache_key, buffered.getvalue())
+
+    await run_in_threadpool(store)
+    return image
+
+
+async def run_inference(job, requests: int = 1):
+    """モデルの読み込みと推論は推論用のワーカーで実行し、イベントループを止めない"""
+    try:
+        return await inference_queue.run(job, requests)
+    except QueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+
+
+async def run_batch_inference(job, items: List[dict]) -> List[Image.Image]:
+    """
+    バッチの推論を実行し、待ち時間と推論の段階ごとの所要時間をバッチ内の各リクエストのスパンに加える
+
+    バッチは最初のリクエストとは別のタスクで実行されることがあるため、スパンは submit 時に
+    item["trace"] に渡された各リクエストの記録先に加える。
+    """
+    with collect_spans() as spans:
+        images = await run_inference(job, len(items))
+    for item in items:
+        merge_spans(item["trace"], spans)
+    return images
+
+
+# バッチ内でリクエストごとに異なってよいパラメータ（それ以外がすべて同じリクエストをまとめる）
+PER_REQUEST_PARAMS = ("prompt", "negative_prompt", "seed")
+
+
+def batch_key(params: dict) -> tuple:
+    return tuple(sorted((k, v) for k, v in params.items() if k not in PER_REQUEST_PARAMS))
+
+
+def combine_on_step(items: List[dict], kind: str):
+    """バッチ内の各リクエストの進捗通知を1つにまとめ、1ステップごとの所要時間を記録する"""
+    callbacks = [item["on_step"] for item in items if item.get("on_step") is not None]
+    last_step = time.perf_counter()
+
+    def on_step(step, total_steps):
+        nonlocal last_step
+        now = time.perf_counter()
+        STEP_SECONDS.observe(now - last_step, kind=kind)
+        last_step = now
+        for callback in callbacks:
+            callback(step, total_steps)
+
+    return on_step
+
+
+async def run_text_batch(key: tuple, items: List[dict]) -> List[Image.Image]:
+    def job():
+        model = generator.get()
+        logger.info(f"画像生成を開始（{len(items)}件）")
+        images = model.generate_batch_from_text(
+            [item["params"]["prompt"] for item in items],
+            [item["params"].get("negative_prompt") for item in items],
+            on_step=combine_on_step(items, "text"),
+            seeds=[item["params"]["seed"] for item in items],
+            **dict(key),
+        )
+        logger.info("画像生成が完了")
+        return images
+
+    return await run_batch_inference(job, items)
+
+
+async def run_image_batch(key: tuple, items: List[dict]) -> List[Image.Image]:
+    def job():
+        model = generator.get()
+        logger.info(f"画像生成を開始（{len(items)}件）")
+        images = model.generate_batch_from_image(
+            [item["input_image"] for item in items],
+            [item["params"]["prompt"] for item in items],
+            on_step=combine_on_step(items, "image"),
+            seeds=[item["params"]["seed"] for item in items],
+            **dict(key),
+        )
+        logger.info("画像生成が完了")
+        return images
+
+    return await run_batch_inference(job, items)
+
+
+# 同時に届いた生成リクエストを、ステップ数などが同じものどうしでまとめて1回で推論する
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "4"))
+INFERENCE_BATCH_WAIT = int(os.getenv("INFERENCE_BATCH_WAIT_MS", "50")) / 1000
+text_batcher = MicroBatcher(run_text_batch, INFERENCE_MAX_BATCH_SIZE, INFERENCE_BATCH_WAIT)
+image_batcher = MicroBatcher(run_image_batch, INFERENCE_MAX_BATCH_SIZE, INFERENCE_BATCH_WAIT)
+
+
+def tier_params(options: DesignOptions) -> dict:
+    """速度の段階から解像度・ステップ数・スケジューラーを決める（個別の指定が優先）"""
+    tier = SPEED_TIERS[options.speed]
+    return dict(
+        resolution=tier["resolution"],
+        num_steps=options.num_steps or tier["num_steps"],
+        scheduler=options.scheduler or tier["scheduler"],
+    )
+
+
+def image_params(options: DesignOptions, contents: bytes) -> dict:
+    """画像からの生成のパラメータ（キャッシュキーとバッチのまとめ方にも使う）"""
+    params = dict(
+        prompt=options.prompt,
+        strength=0.75,  # 元の画像の特徴をどの程度保持するか（0-1）
+        guidance_scale=7.5,
+        output_size=options.size,
+        **tier_params(options),
+    )
+    return dict(params, seed=resolve_seed(options, params, contents))
+
+
+def text_params(prompt: str, options: DesignOptions) -> dict:
+    """テキストからの生成のパラメータ（キャッシュキーとバッチのまとめ方にも使う）"""
+    params = dict(
+        prompt=prompt,
+        negative_prompt="low quality, bad quality, blurry",
+        guidance_scale=7.5,
+        output_size=options.size,
+        **tier_params(options),
+    )
+    return dict(params, seed=resolve_seed(options, params))
+
+
+def resolve_seed(options: DesignOptions, params: dict, contents: Optional[bytes] = None) -> int:
+    """
+    シードが指定されていなければ、シード以外のパラメータと入力画像から決める
+
+    同じ内容のリクエストは同じシード（同じ生成キー）になり、結果キャッシュから返せる。
+    決めたシードも結果と一緒に返す。
+    """
+    if options.seed is not None:
+        return options.seed
+    return int(make_cache_key(MODEL_ID, contents, **params)[:8], 16)
+
+
+def result_key(params: dict, contents: Optional[bytes] = None) -> str:
+    """
+    生成画像の結果キャッシュのキー（モデルと使うCPUの高速化の方法・入力画像・シードを含む
+    生成のパラメータから決まる）
+
+    キャッシュには量子化の前の画像を保存するため、色数などが違うだけのリクエストは
+    同じ生成画像を使う。
+    """
+    return make_cache_key(CACHE_MODEL_ID, contents, **params)
+
+
+def generation_key(cache_key: str, options: DesignOptions) -> str:
+    """
+    デザインを一意に表すキー（生成画像のキーと、量子化のすべてのオプションから決まる）
+
+    同じキーの生成画像はキャッシュから返し、キャッシュにない場合も同じキーからは同じデザインを
+    再生成する。デザインのサイズは生成のパラメータ（output_size）に含まれる。
+    """
+    return make_cache_key(
+        CACHE_MODEL_ID,
+        result=cache_key,
+        palette_size=options.palette_size,
+        style=options.style,
+        dither=options.dither,
+        color_space=options.color_space,
+        target_palette=options.target_palette,
+    )
+
+
+async def submit_generation(batcher: MicroBatcher, params: dict, item: dict, batched: bool):
+    """
+    生成をバッチに追加する（batched=False の場合は他のリクエストとまとめずに実行する）
+
+    バッチの組み合わせが変わると浮動小数点の計算順序が変わり、画素値がわずかにずれることがある。
+    シードが指定されたリクエストは、同じキーから常に同じ結果になるよう1件ずつ実行する。
+    """
+    if batched:
+        return await batcher.submit(batch_key(params), item)
+    return await batcher.run_alone(batch_key(params), item)
+
+
+async def generate_image_from_image(
+    input_image: Image.Image, params: dict, cache_key: str, batched: bool = True, on_step=None
+) -> Image.Image:
+    """画像から生成する（同じ画像・同じパラメータの結果はキャッシュから返す）"""
+    item = {
+        "params": params,
+        "input_image": input_image,
+        "on_step": on_step,
+        "trace": current_trace(),
+    }
+    return await generate_with_cache(
+        cache_key, lambda: submit_generation(image_batcher, params, item, batched)
+    )
+
+
+async def generate_image_from_text(
+    params: dict, cache_key: str, batched: bool = True, on_step=None
+) -> Image.Image:
+    """テキストから生成する（同じプロンプト・同じパラメータの結果はキャッシュから返す）"""
+    item = {"params": params, "on_step": on_step, "trace": current_trace()}
+    return await generate_with_cache(
+        cache_key, lambda: submit_generation(text_batcher, params, item, batched)
+    )
+
+
+# /metrics で公開するメトリクス（段階ごとの所要時間は app.core.metrics の design_stage_seconds）
+REQUEST_SECONDS = registry.histogram(
+    "design_http_request_seconds", "HTTPリクエストの所要時間（秒）", labelnames=("route", "status")
+)
+STEP_SECONDS = registry.histogram(
+    "design_inference_step_seconds",
+    "拡散の1ステップの所要時間（秒、バッチ全体）",
+    labelnames=("kind",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+registry.gauge(
+    "design_inference_queue_depth",
+    "推論の待ち行列のジョブ数",
+    lambda: [
+        ({"state": "waiting"}, inference_queue.stats()["waiting"]),
+        ({"state": "running"}, inference_queue.stats()["running"]),
+    ],
+)
+registry.collected_counter(
+    "design_inference_queue_rejected",
+    "待ち行列が上限に達して断ったリクエストの累計（バッチはリクエストの件数で数える）",
+    lambda: [({}, inference_queue.rejected)],
+)
+registry.collected_counter(
+    "design_cache_lookups",
+    "生成結果キャッシュの検索回数の累計",
+    lambda: [
+        ({"result": result}, result_cache.stats()[result])
+        for result in ("memory_hits", "disk_hits", "misses")
+    ],
+)
+registry.gauge(
+    "design_cache_hit_ratio",
+    "生成結果キャッシュのヒット率",
+    lambda: [({}, result_cache.stats()["hit_ratio"])],
+)
+registry.collected_counter(
+    "design_prompt_cache_lookups",
+    "プロンプトの埋め込みのキャッシュの検索回数の累計（モデルの読み込み後のみ）",
+    lambda: [
+        ({"result": result}, count)
+        for result, count in prompt_cache_stats().items()
+        if result in ("hits", "misses")
+    ],
+)
+registry.gauge(
+    "design_batch_mean_size",
+    "推論のバッチの平均サイズ",
+    lambda: [
+        ({"kind": "text"}, text_batcher.stats()["mean_batch_size"]),
+        ({"kind": "image"}, image_batcher.stats()["mean_batch_size"]),
+    ],
+)
+registry.gauge("design_model_loaded", "モデルの読み込みが完了しているか", lambda: [({}, generator.is_ready)])
+registry.gauge(
+    "design_model_parameter_bytes",
+    "モデルのパラメータのバイト数（読み込み後のみ）",
+    lambda: (
+        [({}, generator.get().memory_report()["total_parameter_bytes"])]
+        if generator.is_ready
+        else []
+    ),
+)
+registry.gauge("process_resident_memory_bytes", "プロセスの常駐メモリ（バイト）", lambda: [({}, rss_bytes())])
+registry.gauge(
+    "process_unique_memory_bytes",
+    "このワーカーだけが使っているメモリ（USS、共有している重みのページを含まない）",
+    lambda: memory_samples("uss"),
+)
+registry.gauge(
+    "process_proportional_memory_bytes",
+    "共有ページをプロセス数で按分したメモリ（PSS）",
+    lambda: memory_samples("pss"),
+)
+
+
+def memory_samples(field: str) -> list:
+    """memory_usage() の値（smaps_rollup がなく取得できない環境では出力しない）"""
+    usage = memory_usage()
+    return [({}, usage[field])] if field in usage else []
+
+
+def prompt_cache_stats() -> dict:
+    """プロンプトの埋め込みのキャッシュの統計（モデルが未読み込みかキャッシュしない場合は空）"""
+    if not generator.is_ready or generator.get().prompt_cache is None:
+        return {}
+    return generator.get().prompt_cache.stats()
+
+
+def rss_bytes() -> int:
+    """このプロセスの現在の常駐メモリ（/proc がない環境では最大RSS）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus のテキスト形式のメトリクス"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/stats")
+def get_stats():
+    """推論の待ち行列・生成結果キャッシュ・プロンプトの埋め込みのキャッシュ・バッチ処理の統計"""
+    return {
+        "queue": inference_queue.stats(),
+        "cache": result_cache.stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "batching": {"text": text_batcher.stats(), "image": image_batcher.stats()},
+    }
+
+
+# レスポンスの形式（json: base64で埋め込み, png: PNGの本文, url: 保存してURLを返す）
+RESPONSE_FORMAT = Query("json", regex="^(json|png|url)$")
+
+
 @app.post("/api/generate/from-image")
 async def generate_from_image(
-    file: UploadFile = File(...), options: Optional[DesignOptions] = None
+    file: UploadFile = File(...),
+    options: DesignOptions = Depends(design_options),
+    response_format: str = RESPONSE_FORMAT,
+    include_original: bool = Query(True),
 ):
-    """画像から類似のマイデザインを生成"""
+    """
+    画像から類似のマイデザインを生成
+
+    生成 → 量子化 → エンコードをメモリ上で行い、パレットPNGのプレビュー画像と
+    コンパクト形式のデザインデータを返す。各段階の所要時間は Server-Timing ヘッダーで返す。
+    include_original=false の場合は元画像のサムネイルを返さない。
+    """
     try:
         logger.info(f"画像生成リクエストを受信: {file.filename}")
 
-        if options is None:
-            options = DesignOptions()
-
-        # アップロードされた画像を読み込み
-        contents = await file.read()
-        input_image = Image.open(io.BytesIO(contents))
+        # アップロードされた画像を読み込み（大きすぎる画像はデコード前に断る）
+        contents, input_image = await ingest_upload(file)
 
         # 画像生成
-        logger.info("画像生成を開始")
-        generated_image = generator.generate_from_image(
-            input_image,
-            prompt=options.prompt,
-            strength=0.75,  # 元の画像の特徴をどの程度保持するか（0-1）
-        )
-        logger.info("画像生成が完了")
+        params = image_params(options, contents)
+        cache_key = result_key(params, contents)
+        key = generation_key(cache_key, options)
+        with span("generate"):
+            generated_image = await generate_image_from_image(
+                input_image, params, cache_key, batched=options.seed is None
+            )
 
-        # base64エンコード
-        original_base64 = f"data:image/png;base64,{image_to_base64(input_image)}"
-        generated_base64 = f"data:image/png;base64,{image_to_base64(generated_image)}"
+        # デザインのサイズ・色数に量子化
+        _, design = await build_design(generated_image, options)
 
-        return {"original_image": original_base64, "generated_image": generated_base64}
+        return await design_response(
+            "image",
+            design,
+            key,
+            params["seed"],
+            response_format,
+            original=input_image if include_original else None,
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"画像生成中にエラーが発生: {str(e)}"
         logger.error(error_msg)
@@ -98,39 +862,277 @@ async def generate_from_image(
 
 
 @app.post("/api/generate/from-text")
-async def generate_from_text(prompt: str = Form(...), options: Optional[DesignOptions] = None):
-    """テキストプロンプトから画像を生成"""
+async def generate_from_text(
+    prompt: str = Form(...),
+    options: DesignOptions = Depends(design_options),
+    response_format: str = RESPONSE_FORMAT,
+):
+    """テキストプロンプトから画像を生成（返す内容は /api/generate/from-image と同じ）"""
     try:
         logger.info(f"テキスト生成リクエストを受信: {prompt}")
 
-        if options is None:
-            options = DesignOptions()
-
         # 画像生成
-        logger.info("画像生成を開始")
-        generated_image = generator.generate_from_text(
-            prompt=prompt, negative_prompt="low quality, bad quality, blurry"
-        )
-        logger.info("画像生成が完了")
+        params = text_params(prompt, options)
+        cache_key = result_key(params)
+        key = generation_key(cache_key, options)
+        with span("generate"):
+            generated_image = await generate_image_from_text(
+                params, cache_key, batched=options.seed is None
+            )
 
-        # base64エンコード
-        generated_base64 = f"data:image/png;base64,{image_to_base64(generated_image)}"
+        # デザインのサイズ・色数に量子化
+        _, design = await build_design(generated_image, options)
 
-        return {"success": True, "generated_image": generated_base64}
+        return await design_response(
+            "text", design, key, params["seed"], response_format, body={"success": True}
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"画像生成中にエラーが発生: {str(e)}"
         logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
 
+def design_output_path(design_id: str) -> str:
+    return os.path.join(OUTPUT_DIR, f"{design_id}_output.png")
+
+
+def design_data_path(design_id: str) -> str:
+    return os.path.join(OUTPUT_DIR, f"{design_id}_design.json")
+
+
+def start_job(job_id: str, generate, options: DesignOptions) -> None:
+    """生成ジョブをバックグラウンドで実行し、プレビュー画像とデザインデータを保存する"""
+
+    def on_step(step, total_steps):
+        job_store.update(job_id, status="running", step=step, total_steps=total_steps)
+
+    async def run():
+        # 登録したリクエストとは別に、ジョブの段階ごとの所要時間を記録する
+        trace = start_trace()
+        try:
+            with span("generate"):
+                image = await generate(on_step)
+            _, design = await build_design(image, options)
+            with span("encode"):
+                save_design(job_id, design_to_png(design), design)
+            job_store.update(job_id, status="done")
+            record = {"event": "job", "job_id": job_id, "spans": trace}
+            logger.info(json.dumps(record, ensure_ascii=False))
+        except HTTPException as e:
+            job_store.update(job_id, status="failed", error=str(e.detail))
+        except Exception as e:
+            logger.error(f"ジョブの実行中にエラーが発生: {job_id}: {str(e)}")
+            job_store.update(job_id, status="failed", error=str(e))
+
+    task = asyncio.create_task(run())
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+
+
+def job_response(job_id: str) -> dict:
+    job = job_store.get(job_id)
+    job["status_url"] = f"/api/jobs/{job_id}"
+    if job["status"] == "done":
+        job["result_url"] = f"/designs/{job_id}"
+        job["design_url"] = f"/designs/{job_id}/data"
+    return job
+
+
+def reject_if_queue_full() -> None:
+    """ジョブを登録する前に、推論の待ち行列に空きがあるかを確認する"""
+    if inference_queue.depth >= inference_queue.max_pending:
+        inference_queue.rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail="推論の待ち行列が上限に達しています",
+            headers={"Retry-After": "10"},
+        )
+
+
+@app.post("/api/jobs/from-image", status_code=202)
+async def submit_image_job(
+    file: UploadFile = File(...), options: DesignOptions = Depends(design_options)
+):
+    """画像からの生成ジョブを登録し、すぐにジョブIDを返す"""
+    reject_if_queue_full()
+
+    contents, input_image = await ingest_upload(file)
+
+    params = image_params(options, contents)
+    cache_key = result_key(params, contents)
+    key = generation_key(cache_key, options)
+    batched = options.seed is None
+    job_id = job_store.create("image", total_steps=int(params["num_steps"] * params["strength"]))
+    logger.info(f"画像生成ジョブを登録: {job_id} ({file.filename})")
+    start_job(
+        job_id,
+        lambda on_step: generate_image_from_image(input_image, params, cache_key, batched, on_step),
+        options,
+    )
+    return {**job_response(job_id), "generation_key": key, "seed": params["seed"]}
+
+
+@app.post("/api/jobs/from-text", status_code=202)
+async def submit_text_job(
+    prompt: str = Form(...), options: DesignOptions = Depends(design_options)
+):
+    """テキストからの生成ジョブを登録し、すぐにジョブIDを返す"""
+    reject_if_queue_full()
+
+    params = text_params(prompt, options)
+    cache_key = result_key(params)
+    key = generation_key(cache_key, options)
+    batched = options.seed is None
+    job_id = job_store.create("text", total_steps=params["num_steps"])
+    logger.info(f"テキスト生成ジョブを登録: {job_id} ({prompt})")
+    start_job(
+        job_id,
+        lambda on_step: generate_image_from_text(params, cache_key, batched, on_step),
+        options,
+    )
+    return {**job_response(job_id), "generation_key": key, "seed": params["seed"]}
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """ジョブの状態と拡散ステップ単位の進捗を返す"""
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job_id)
+
+
+async def cleanup_expired_jobs():
+    """有効期限が切れたジョブと、その出力ファイルを定期的に削除する"""
+    while True:
+        for job_id in job_store.pop_expired():
+            for path in (design_output_path(job_id), design_data_path(job_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            logger.info(f"期限切れのジョブを削除: {job_id}")
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_job_cleanup():
+    job_tasks.add(asyncio.create_task(cleanup_expired_jobs()))
+
+
+@app.post("/api/convert/batch")
+async def convert_batch(
+    files: List[UploadFile] = File(...),
+    size: int = Form(32, ge=8, le=128),
+    palette_size: int = Form(15, ge=1, le=15),
+    style: str = Form("pixel"),
+    method: str = Form("kmeans"),
+    compact: bool = Form(False),
+    dither: str = Form("none"),
+    color_space: str = Form("rgb"),
+):
+    """複数の画像を並列にマイデザインへ変換し、完了した順にJSON Linesで返す"""
+    logger.info(f"一括変換リクエストを受信: {len(files)}件")
+    # 不正なオプションは全件の変換に失敗するため、プールに投入する前に断る
+    if method not in QUANTIZERS:
+        raise HTTPException(status_code=422, detail="method が不正です")
+    if dither not in DITHERS or color_space not in COLOR_SPACES:
+        raise HTTPException(status_code=422, detail="dither または color_space が不正です")
+    # 1枚ごとの大きさは、画像を1枚送る API と同じ MAX_UPLOAD_BYTES までにする
+    for file in files:
+        file.file.seek(0, os.SEEK_END)
+        if file.file.tell() > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"ファイルサイズが上限（{MAX_UPLOAD_BYTES // (1024 * 1024)}MB）を超えています: "
+                f"{file.filename}",
+            )
+        file.file.seek(0)
+
+    # アップロードは一時ファイルに置かれているので、投入する直前に1件ずつ読み出す
+    items = ((file.filename, file.file.read()) for file in files)
+    results = iter_batch(
+        items,
+        executor=get_batch_executor(),
+        size=size,
+        palette_size=palette_size,
+        style=style,
+        method=method,
+        compact=compact,
+        dither=dither,
+        color_space=color_space,
+    )
+
+    def stream():
+        for result in results:
+            if "error" in result:
+                logger.warning(f"変換に失敗: {result['name']}: {result['error']}")
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/api/convert/mural")
+async def convert_mural_design(
+    file: UploadFile = File(...),
+    columns: int = Form(..., ge=1, le=16),
+    rows: int = Form(..., ge=1, le=16),
+    tile_size: int = Form(32, ge=8, le=64),
+    palette_size: int = Form(15, ge=1, le=15),
+    method: str = Form("kmeans"),
+    dither: str = Form("none"),
+    color_space: str = Form("rgb"),
+):
+    """大きな画像を columns x rows 枚の、パレットを共有するマイデザインに分けて変換する"""
+    logger.info(f"壁画の変換リクエストを受信: {file.filename}, {columns}x{rows}枚")
+    if method not in QUANTIZERS:
+        raise HTTPException(status_code=422, detail="method が不正です")
+    if dither not in DITHERS or color_space not in COLOR_SPACES:
+        raise HTTPException(status_code=422, detail="dither または color_space が不正です")
+    _, input_image = await ingest_upload(file)
+
+    # API の壁画は小さいため、プロセスを起動せずスレッドプールで処理する
+    try:
+        mural = await run_in_threadpool(
+            convert_mural,
+            input_image,
+            columns,
+            rows,
+            tile_size=tile_size,
+            palette_size=palette_size,
+            method=method,
+            dither=dither,
+            color_space=color_space,
+            workers=1,
+        )
+    except ValueError as e:
+        logger.warning(f"壁画に変換できません: {file.filename}: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+    for tile in mural["tiles"]:
+        tile["design_data"] = encode_design_data(tile["design_data"])
+    return {"success": True, **mural}
+
+
 @app.get("/designs/{design_id}")
 async def get_design(design_id: str):
     logger.info(f"デザイン取得リクエスト: {design_id}")
-    output_path = os.path.join(OUTPUT_DIR, f"{design_id}_output.png")
+    output_path = design_output_path(design_id)
 
     if not os.path.exists(output_path):
         logger.warning(f"デザインが見つかりません: {design_id}")
         raise HTTPException(status_code=404, detail="Design not found")
 
     return FileResponse(output_path)
+
+
+@app.get("/designs/{design_id}/data")
+async def get_design_data(design_id: str):
+    """ジョブで生成したデザインデータ（コンパクト形式のJSON）を返す"""
+    data_path = design_data_path(design_id)
+
+    if not os.path.exists(data_path):
+        raise HTTPException(status_code=404, detail="Design not found")
+
+    return FileResponse(data_path, media_type="application/json")
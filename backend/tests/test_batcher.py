@@ -0,0 +1,87 @@
+"""
+同時に届いたリクエストをまとめる MicroBatcher のテスト
+"""
+
+# 標準ライブラリ
+import asyncio
+
+# ローカルモジュール
+from app.core.batcher import MicroBatcher
+
+
+class RecordingBatch:
+    """受け取ったバッチを記録し、各項目を (キー, 項目) にして返す run_batch"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, key, items):
+        self.batches.append((key, list(items)))
+        return [(key, item) for item in items]
+
+
+def test_groups_concurrent_items_by_key():
+    run_batch = RecordingBatch()
+
+    async def main():
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait=0.05)
+        return await asyncio.gather(
+            batcher.submit("a", 1),
+            batcher.submit("b", 2),
+            batcher.submit("a", 3),
+            batcher.submit("a", 4),
+        )
+
+    results = asyncio.run(main())
+
+    assert results == [("a", 1), ("b", 2), ("a", 3), ("a", 4)]
+    assert sorted(run_batch.batches) == [("a", [1, 3, 4]), ("b", [2])]
+
+
+def test_full_batch_runs_without_waiting():
+    run_batch = RecordingBatch()
+
+    async def main():
+        # max_wait まで待っていればタイムアウトする
+        batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait=60)
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit("a", i) for i in range(4))), timeout=5
+        )
+
+    results = asyncio.run(main())
+
+    assert results == [("a", i) for i in range(4)]
+    assert run_batch.batches == [("a", [0, 1]), ("a", [2, 3])]
+
+
+def test_run_alone_is_not_merged():
+    run_batch = RecordingBatch()
+
+    async def main():
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait=0.05)
+        results = await asyncio.gather(
+            batcher.submit("a", 1), batcher.run_alone("a", 2), batcher.submit("a", 3)
+        )
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(main())
+
+    assert results == [("a", 1), ("a", 2), ("a", 3)]
+    assert run_batch.batches == [("a", [2]), ("a", [1, 3])]
+    assert stats["batches"] == 2
+    assert stats["mean_batch_size"] == 1.5
+
+
+def test_batch_error_is_raised_for_every_item():
+    async def fail(key, items):
+        raise RuntimeError("推論に失敗")
+
+    async def main():
+        batcher = MicroBatcher(fail, max_batch_size=4, max_wait=0.01)
+        return await asyncio.gather(
+            batcher.submit("a", 1), batcher.submit("a", 2), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert [str(result) for result in results] == ["推論に失敗", "推論に失敗"]
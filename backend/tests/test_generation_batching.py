@@ -0,0 +1,147 @@
+"""
+生成リクエストのまとめ方（main のマイクロバッチ）と、推論の待ち行列が満杯のときの503のテスト
+
+モデルの代わりに、シードとプロンプトから決まる単色の画像を返すスタブを使う。
+"""
+
+# 標準ライブラリ
+import asyncio
+import importlib
+import threading
+
+# サードパーティ
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+
+class StubPipeline:
+    """StableDiffusionGenerator の代わりに、呼び出しごとのバッチサイズを記録するスタブ"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def generate_batch_from_text(
+        self, prompts, negative_prompts=None, on_step=None, seeds=None, output_size=32, **kwargs
+    ):
+        self.batch_sizes.append(len(prompts))
+        return [
+            Image.new("RGB", (output_size, output_size), (seed % 256, len(prompt), 0))
+            for prompt, seed in zip(prompts, seeds)
+        ]
+
+
+class StubLoader:
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        return self.model
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    # ログ・アップロード・キャッシュは一時ディレクトリに書き出す
+    workdir = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)
+        mp.setenv("UPLOAD_DIR", str(workdir / "uploads"))
+        mp.setenv("OUTPUT_DIR", str(workdir / "outputs"))
+        mp.setenv("MODEL_WARMUP", "false")
+        mp.setenv("INFERENCE_WORKERS", "1")
+        mp.setenv("INFERENCE_QUEUE_SIZE", "2")
+        mp.setenv("INFERENCE_MAX_BATCH_SIZE", "4")
+        mp.setenv("INFERENCE_BATCH_WAIT_MS", "100")
+        yield importlib.import_module("main")
+
+
+@pytest.fixture
+def model(main, monkeypatch):
+    stub = StubPipeline()
+    monkeypatch.setattr(main, "generator", StubLoader(stub))
+    return stub
+
+
+def _params(prompt: str, seed: int) -> dict:
+    return dict(
+        prompt=prompt,
+        negative_prompt="low quality",
+        guidance_scale=7.5,
+        output_size=32,
+        resolution=64,
+        num_steps=2,
+        scheduler="dpm",
+        seed=seed,
+    )
+
+
+def test_seeded_request_matches_batched(main, model):
+    requests = [("red panda", 1), ("sunflower", 2), ("star", 3)]
+
+    async def generate(prompt, seed, batched):
+        main.start_trace()
+        # キャッシュから返さないよう、まとめる場合とまとめない場合で別のキーにする
+        cache_key = f"{'batched' if batched else 'alone'}-{prompt}-{seed}"
+        image = await main.generate_image_from_text(_params(prompt, seed), cache_key, batched)
+        return image, main.current_trace()
+
+    async def run():
+        batched = await asyncio.gather(*(generate(p, s, True) for p, s in requests))
+        alone = [await generate(p, s, False) for p, s in requests]
+        return batched, alone
+
+    batched, alone = asyncio.run(run())
+
+    # 同時に届いた3件は1回の推論にまとめ、シードを指定した実行は1件ずつ行う
+    assert model.batch_sizes == [3, 1, 1, 1]
+    for (batched_image, _), (alone_image, _) in zip(batched, alone):
+        assert batched_image.tobytes() == alone_image.tobytes()
+    # バッチの待ち時間は、まとめられたすべてのリクエストのスパンに記録する
+    for _, trace in batched + alone:
+        assert "queue_wait" in trace
+
+
+def test_different_parameters_are_not_batched(main, model):
+    async def run():
+        return await asyncio.gather(
+            main.generate_image_from_text(_params("a", 1), "steps2"),
+            main.generate_image_from_text(dict(_params("a", 1), num_steps=3), "steps3"),
+        )
+
+    asyncio.run(run())
+
+    assert model.batch_sizes == [1, 1]
+
+
+def test_full_queue_is_rejected_with_503(main):
+    queue = main.inference_queue
+    release = threading.Event()
+
+    async def run():
+        # ワーカー1つで実行中1件・待機中1件になり、待ち行列（上限2件）が満杯になる
+        blocked = [asyncio.ensure_future(main.run_inference(release.wait)) for _ in range(2)]
+        while queue.depth < queue.max_pending:
+            await asyncio.sleep(0.01)
+
+        rejected = queue.rejected
+        try:
+            with pytest.raises(HTTPException) as single:
+                await main.run_inference(lambda: None)
+            with pytest.raises(HTTPException) as batch:
+                items = [{"trace": {}} for _ in range(3)]
+                await main.run_batch_inference(lambda: [], items)
+            with pytest.raises(HTTPException) as job:
+                main.reject_if_queue_full()
+        finally:
+            release.set()
+            await asyncio.gather(*blocked)
+        return single.value, batch.value, job.value, queue.rejected - rejected
+
+    single, batch, job, rejected = asyncio.run(run())
+
+    for error in (single, batch, job):
+        assert error.status_code == 503
+        assert error.headers["Retry-After"] == "10"
+    # 断ったリクエストの数（バッチはまとめた件数）を数える
+    assert rejected == 1 + 3 + 1
+    assert queue.depth == 0
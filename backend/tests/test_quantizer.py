@@ -0,0 +1,41 @@
+"""
+色の量子化（quantize_array）が従来のピクセル単位ループ実装と同じ結果を返すことのテスト
+"""
+
+# サードパーティ
+import numpy as np
+import pytest
+
+# ローカルモジュール
+from app.generator.quantizer import quantize_array
+from benchmarks.bench_quantize import legacy_quantize, synthetic_image
+
+
+def _image(size: int, seed: int, mode: str) -> np.ndarray:
+    return np.array(synthetic_image(size, seed).convert(mode))
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+@pytest.mark.parametrize("palette_size", [4, 15])
+@pytest.mark.parametrize("size,seed", [(32, 0), (32, 1), (64, 2)])
+def test_kmeans_matches_legacy(size, seed, palette_size, mode):
+    img_array = _image(size, seed, mode)
+
+    expected, expected_colors, expected_labels = legacy_quantize(img_array, palette_size)
+    actual, colors, labels = quantize_array(img_array, palette_size, "kmeans")
+
+    np.testing.assert_array_equal(colors, expected_colors)
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_transparent_pixels_are_unlabeled():
+    img_array = _image(32, 0, "RGBA")
+
+    actual, _, labels = quantize_array(img_array, 8, "kmeans")
+
+    transparent = img_array.reshape(-1, 4)[:, 3] <= 128
+    assert transparent.any()
+    assert (labels[transparent] == -1).all()
+    assert (labels[~transparent] >= 0).all()
+    assert (actual.reshape(-1, 4)[transparent] == 0).all()
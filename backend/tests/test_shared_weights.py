@@ -0,0 +1,55 @@
+"""
+text2img と img2img のパイプラインが UNet・VAE・テキストエンコーダーを共有し、
+重みを二重に読み込んでいないことのテスト（ランダムに初期化した小さなパイプラインを使う）
+"""
+
+# サードパーティ
+import pytest
+
+# torch・diffusers は requirements.txt に含まれない環境もあるため、なければスキップする
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+# ローカルモジュール
+from app.ml.stable_diffusion_generator import StableDiffusionGenerator  # noqa: E402
+from benchmarks.tiny_pipeline import save_tiny_pipeline  # noqa: E402
+
+SHARED_COMPONENTS = ("unet", "vae", "text_encoder", "tokenizer")
+
+
+@pytest.fixture(scope="module")
+def generator(tmp_path_factory):
+    model_dir = save_tiny_pipeline(str(tmp_path_factory.mktemp("tiny_sd")))
+    return StableDiffusionGenerator(model_id=model_dir, prompt_cache_size=0)
+
+
+def _parameter_bytes(module) -> int:
+    return sum(p.numel() * p.element_size() for p in module.parameters())
+
+
+@pytest.mark.parametrize("name", SHARED_COMPONENTS)
+def test_components_are_shared(generator, name):
+    assert getattr(generator.img2img, name) is getattr(generator.text2img, name)
+
+
+def test_scheduler_is_not_shared(generator):
+    # スケジューラーは生成ごとに状態が変わるため、パイプラインごとに別のインスタンスにする
+    assert generator.img2img.scheduler is not generator.text2img.scheduler
+
+
+def test_parameters_share_memory(generator):
+    for name in ("unet", "vae", "text_encoder"):
+        text2img_ptrs = {p.data_ptr() for p in getattr(generator.text2img, name).parameters()}
+        img2img_ptrs = {p.data_ptr() for p in getattr(generator.img2img, name).parameters()}
+        assert img2img_ptrs == text2img_ptrs
+
+
+def test_memory_report_counts_weights_once(generator):
+    report = generator.memory_report()
+
+    expected = sum(
+        _parameter_bytes(getattr(generator.text2img, name))
+        for name in ("unet", "vae", "text_encoder")
+    )
+    # 重みを二重に読み込んでいれば、共有されていないパラメータの分だけ大きくなる
+    assert report["total_parameter_bytes"] == expected